@@ -0,0 +1,300 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue
+import random
+import subprocess
+import time
+import traceback
+import numpy as np
+import round_7_backtab as r7_backtab
+import round_8_backtab as r8_backtab
+from loss_engine import DrawState
+from schedules import make_schedule, schedules
+from snapshot import load_snapshot
+from synthetic import generate, load_truth, write_tournament
+from strategies import make_strategy
+
+try:
+    import resource
+except ImportError: # not on Windows, where peak memory isn't reported
+    resource = None
+
+# CONFIG (each can be overridden on the command line)
+years = [2022, 2023, 2024, 2025]
+rounds = [7, 8]
+restarts = 20 # restarts per (year, round)
+seed = 0
+strategy_name = "descent"
+r8_mode = "joint" # "joint", or "staged" to read that year's round 7 output
+chains = 1 # round 7 restarts run side by side, see multi_chain.py
+schedule_name = "fixed" # restart cutoffs, see schedules.py
+warm_share = 0.0 # restarts started near the best states so far, elites.py
+output_filename = "benchmark.json"
+synthetic_sizes = [250, 500, 1000, 2000] # team counts for --synthetic
+
+
+def r7_output_for(year):
+    """
+    The round 7 output that staged round 8 reads for a year
+    """
+    for filename in [f"r7_output_{year}.txt", f"output_{year}.txt"]:
+        if os.path.exists(filename):
+            return filename
+    raise FileNotFoundError(f"no round 7 output for {year}")
+
+
+def bench_one(year, round_num, num_restarts, seed, strategy_name, r8_mode,
+              chains=1, schedule_name="fixed", warm_share=0.0):
+    """
+    Runs num_restarts restarts of one round on one year, from a fixed seed
+    chains (int): round 7 only, restarts run side by side
+    schedule_name (str): when to give up on a restart, see schedules.py
+    warm_share (float): share of restarts started near the best states
+        found so far, see elites.py
+    Returns a dict of timings and outcome shares, and, for a generated
+    tournament (see synthetic.py), the share of team results in saved
+    sims that match the true ones
+    """
+    random.seed(seed)
+    directory = f"data/{year}"
+    strategy = make_strategy(strategy_name)
+    setup_start = time.perf_counter()
+    if round_num == 7:
+        schedule = make_schedule(schedule_name, r7_backtab.max_search_len,
+                                 r7_backtab.cutoff_point,
+                                 r7_backtab.cutoff_threshold)
+        teams, r7_rooms, r8_rooms, known, r8_loss = r7_backtab.initialise(
+            directory)
+        r7_est = np.zeros(len(teams), dtype=np.int64)
+        r8_state = DrawState(r8_loss, known + r7_est)
+        allowed = r7_backtab.prune_rooms(known, r7_rooms, r8_rooms)
+        elites = r7_backtab.make_elites(r7_rooms, allowed)
+        finished = r7_backtab.restarts(known, r7_est, r8_state, r7_rooms,
+                                       r8_loss, strategy, verbose=False,
+                                       allowed=allowed, chains=chains,
+                                       schedule=schedule, elites=elites)
+        def restart():
+            return next(finished)
+        zero, saved = "ACHIEVED", ["ACHIEVED"]
+    else:
+        schedule = make_schedule(schedule_name, r8_backtab.max_search_len,
+                                 r8_backtab.cutoff_point,
+                                 r8_backtab.cutoff_threshold, "ZERO")
+        teams, r7_rooms, r8_rooms, r9_rooms, known, r8_loss, r9_loss = (
+            r8_backtab.initialise(directory))
+        joint = r8_mode == "joint"
+        r8_backtab.set_r7_options(
+            teams, r7_rooms, joint, None if joint else r7_output_for(year))
+        r8_backtab.prune_options(known, r7_rooms, r8_rooms, r9_rooms)
+        elites = r8_backtab.make_elites(r7_rooms, r8_rooms)
+        r7_est = np.zeros(len(teams), dtype=np.int64)
+        r8_est = np.zeros(len(teams), dtype=np.int64)
+        r8_state = DrawState(r8_loss, known + r7_est)
+        r9_state = DrawState(r9_loss, known + r7_est + r8_est)
+        def restart():
+            return r8_backtab.run_restart(known, r7_est, r8_est, r7_rooms,
+                                          r8_rooms, r8_state, r9_state,
+                                          strategy, verbose=False,
+                                          joint=joint, schedule=schedule,
+                                          elites=elites)
+        zero, saved = "ZERO", ["ZERO", "EXPIRED"]
+    elites.warm_share = warm_share
+    setup_seconds = time.perf_counter() - setup_start
+
+    truth = load_truth(directory, list(teams))
+    snapshot = load_snapshot(directory)
+    played = {"r7": snapshot["r7"].ravel(), "r8": snapshot["r8"].ravel()}
+    matches = {"r7": [], "r8": []}
+
+    outcomes = []
+    first_zero = None
+    start = time.perf_counter()
+    for _ in range(num_restarts):
+        outcome, _ = restart()
+        outcomes.append(outcome)
+        if outcome == zero and first_zero is None:
+            first_zero = time.perf_counter() - start
+        if truth is not None and outcome in saved:
+            ests = {"r7": r7_est, "r8": r8_est if round_num == 8 else None}
+            for name, est in ests.items():
+                if est is not None:
+                    matches[name].append(np.mean(
+                        est[played[name]] == truth[name][played[name]]))
+    seconds = time.perf_counter() - start
+    sweeps = sum(strategy.stats.sweeps)
+    shares = {outcome: outcomes.count(outcome) / len(outcomes)
+              for outcome in sorted(set(outcomes))}
+    return {
+        "year": year,
+        "round": round_num,
+        "mode": r8_mode if round_num == 8 else None,
+        "chains": chains if round_num == 7 else None,
+        "schedule": schedule.report(),
+        "elites": elites.report(),
+        "teams": len(teams),
+        "restarts": len(outcomes),
+        "setup_seconds": setup_seconds,
+        "seconds": seconds,
+        "restarts_per_second": len(outcomes) / seconds,
+        "sims_per_second": sum(o in saved for o in outcomes) / seconds,
+        "sweeps_per_second": sweeps / seconds,
+        "sweeps_per_zero": sweeps / outcomes.count(zero)
+                           if zero in outcomes else None,
+        "time_to_first_zero": first_zero,
+        "outcome_shares": shares,
+        "cutoff_share": shares.get("CUTOFF FAILED", 0.0),
+        "expired_share": shares.get("EXPIRED", 0.0),
+        "r7_accuracy": float(np.mean(matches["r7"]))
+                       if matches["r7"] else None,
+        "r8_accuracy": float(np.mean(matches["r8"]))
+                       if matches["r8"] else None,
+    }
+
+
+def _bench_worker(results, *args):
+    """
+    Runs bench_one and puts its result on results, or the traceback (a
+    str) if it raised, so the parent always hears back
+    """
+    try:
+        result = bench_one(*args)
+    except Exception:
+        results.put(traceback.format_exc())
+        return
+    if resource is not None:
+        # kilobytes on Linux, bytes on macOS
+        scale = 1 if platform.system() == "Darwin" else 1024
+        result["peak_memory_bytes"] = (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale)
+    else:
+        result["peak_memory_bytes"] = None
+    results.put(result)
+
+
+def _bench_result(results, process):
+    """
+    Waits for what _bench_worker sends, raising RuntimeError if it failed
+    or the process died without sending anything (e.g. killed)
+    """
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if process.is_alive():
+                continue
+            try: # it may have sent just before exiting
+                result = results.get(timeout=1)
+                break
+            except queue.Empty:
+                raise RuntimeError(f"benchmark process exited with code "
+                                   f"{process.exitcode} and no result")
+    process.join()
+    if isinstance(result, str):
+        raise RuntimeError(f"benchmark process failed:\n{result}")
+    return result
+
+
+def synthetic_tournaments(sizes, seed=0):
+    """
+    Generates data/synthetic_{size} for each team count not already there
+    (see synthetic.py), so they can be benchmarked like years
+    Returns their names
+    """
+    names = []
+    for size in sizes:
+        name = f"synthetic_{size}"
+        if not os.path.exists(f"data/{name}/standings.txt"):
+            write_tournament(f"data/{name}", generate(size, seed=seed))
+        names.append(name)
+    return names
+
+
+def run_benchmarks(years, rounds, num_restarts, seed=0,
+                   strategy_name="descent", r8_mode="joint", chains=1,
+                   schedule_name="fixed", warm_share=0.0):
+    """
+    Every (year, round) runs in a fresh process, so peak memory is that
+    benchmark's alone and nothing is shared between runs
+    Returns a dict with the settings, the machine, and one entry per run
+    """
+    runs = []
+    for year in years:
+        for round_num in rounds:
+            results = mp.Queue()
+            process = mp.Process(target=_bench_worker, args=(
+                results, year, round_num, num_restarts, seed,
+                strategy_name, r8_mode, chains, schedule_name, warm_share))
+            process.start()
+            result = _bench_result(results, process)
+            print(f"{year} r{round_num}: "
+                  f"{result['restarts_per_second']:.2f} restarts/s, "
+                  f"{result['sims_per_second']:.2f} sims/s, "
+                  f"first zero {result['time_to_first_zero']}, "
+                  f"cutoff {result['cutoff_share']:.2f}, "
+                  f"expired {result['expired_share']:.2f}"
+                  + (f", r{round_num} accuracy "
+                     f"{result[f'r{round_num}_accuracy']:.2f}"
+                     if result[f"r{round_num}_accuracy"] is not None
+                     else ""))
+            runs.append(result)
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"],
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "settings": {
+            "restarts": num_restarts,
+            "seed": seed,
+            "strategy": strategy_name,
+            "r8_mode": r8_mode,
+            "chains": chains,
+            "schedule": schedule_name,
+            "warm_share": warm_share,
+        },
+        "machine": {
+            "commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "runs": runs,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the backtab search on each year's data")
+    parser.add_argument("--years", type=int, nargs="+", default=years)
+    parser.add_argument("--synthetic", type=int, nargs="*", default=None,
+                        help="benchmark generated tournaments of these "
+                             "team counts instead of years (no counts for "
+                             f"{synthetic_sizes})")
+    parser.add_argument("--rounds", type=int, nargs="+", default=rounds,
+                        choices=[7, 8])
+    parser.add_argument("--restarts", type=int, default=restarts)
+    parser.add_argument("--seed", type=int, default=seed)
+    parser.add_argument("--strategy", default=strategy_name)
+    parser.add_argument("--r8-mode", default=r8_mode,
+                        choices=["joint", "staged"])
+    parser.add_argument("--chains", type=int, default=chains)
+    parser.add_argument("--schedule", default=schedule_name,
+                        choices=list(schedules))
+    parser.add_argument("--warm-share", type=float, default=warm_share)
+    parser.add_argument("--output", default=output_filename)
+    args = parser.parse_args()
+    if args.synthetic is not None:
+        args.years = synthetic_tournaments(args.synthetic or synthetic_sizes,
+                                           args.seed)
+    report = run_benchmarks(args.years, args.rounds, args.restarts,
+                            args.seed, args.strategy, args.r8_mode,
+                            args.chains, args.schedule, args.warm_share)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Written to {args.output}")
@@ -0,0 +1,67 @@
+import os
+import pickle
+import time
+import zlib
+
+# CONFIG
+checkpoint_interval = 300 # seconds between checkpoints
+format_version = 3 # bumped whenever what a job saves changes
+
+
+def save_checkpoint(filename, state):
+    """
+    Writes state (a dict of anything picklable) to filename, compressed
+    Written to a temporary file, flushed to disk and renamed over the old
+    checkpoint, so a crash part-way through leaves the last one whole
+    """
+    data = zlib.compress(pickle.dumps(
+        {"version": format_version, "saved": time.time(), "state": state},
+        protocol=pickle.HIGHEST_PROTOCOL))
+    temp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temp_filename, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_filename, filename)
+    return len(data)
+
+
+def load_checkpoint(filename):
+    """
+    Returns the state saved by save_checkpoint, or None if there is none
+    """
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "rb") as f:
+        saved = pickle.loads(zlib.decompress(f.read()))
+    if saved["version"] != format_version:
+        raise ValueError(f"{filename} is checkpoint format "
+                         f"{saved['version']}, not {format_version}")
+    return saved["state"]
+
+
+class Checkpointer:
+    """
+    Says when a checkpoint is due, every interval seconds, and writes it
+    Does nothing if filename is None
+    """
+    def __init__(self, filename, interval=checkpoint_interval):
+        self.filename = filename
+        self.interval = interval
+        self.last = time.time()
+
+    def due(self):
+        return (self.filename is not None
+                and time.time() - self.last >= self.interval)
+
+    def save(self, state):
+        """
+        Returns the size of the checkpoint in bytes
+        """
+        self.last = time.time()
+        return save_checkpoint(self.filename, state)
+
+    def load(self):
+        if self.filename is None:
+            return None
+        return load_checkpoint(self.filename)
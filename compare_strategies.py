@@ -0,0 +1,81 @@
+import argparse
+import json
+import random
+import time
+import numpy as np
+import round_7_backtab as r7_backtab
+import round_8_backtab as r8_backtab
+from loss_engine import DrawState
+from strategies import make_strategy, strategies
+
+# CONFIG (each can be overridden on the command line)
+round_num = 7
+seconds_per_strategy = 60
+seed = 0
+
+
+def compare(round_num, names, seconds, seed=0, joint=False):
+    """
+    Runs each strategy for the same CPU budget from the same seed
+    joint (bool): round 8 only, see round_8_backtab.set_r7_options
+    Returns a dict with key strategy name, value its RestartStats summary
+    """
+    if round_num == 7:
+        teams, r7_rooms, r8_rooms, known, r8_loss = r7_backtab.initialise(
+            r7_backtab.initialise_directory)
+        r7_est = np.zeros(len(teams), dtype=np.int64)
+        r8_state = DrawState(r8_loss, known + r7_est)
+        allowed = r7_backtab.prune_rooms(known, r7_rooms, r8_rooms)
+        def restart(strategy):
+            return r7_backtab.run_restart(known, r7_est, r8_state, r7_rooms,
+                                          strategy, verbose=False,
+                                          allowed=allowed)
+        success = "ACHIEVED"
+    else:
+        teams, r7_rooms, r8_rooms, r9_rooms, known, r8_loss, r9_loss = (
+            r8_backtab.initialise(r8_backtab.initialise_directory))
+        r8_backtab.set_r7_options(teams, r7_rooms, joint)
+        r8_backtab.prune_options(known, r7_rooms, r8_rooms, r9_rooms)
+        r7_est = np.zeros(len(teams), dtype=np.int64)
+        r8_est = np.zeros(len(teams), dtype=np.int64)
+        r8_state = DrawState(r8_loss, known + r7_est)
+        r9_state = DrawState(r9_loss, known + r7_est + r8_est)
+        def restart(strategy):
+            return r8_backtab.run_restart(known, r7_est, r8_est, r7_rooms,
+                                          r8_rooms, r8_state, r9_state,
+                                          strategy, verbose=False,
+                                          joint=joint)
+        success = "ZERO"
+
+    summaries = {}
+    for name in names:
+        random.seed(seed)
+        strategy = make_strategy(name)
+        start = time.process_time()
+        while time.process_time() - start < seconds:
+            restart(strategy)
+        summaries[name] = strategy.stats.summary(success)
+        print(f"{name}: {summaries[name]}")
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare search strategies on the current year's data")
+    parser.add_argument("--round", type=int, default=round_num,
+                        choices=[7, 8])
+    parser.add_argument("--seconds", type=float,
+                        default=seconds_per_strategy,
+                        help="CPU seconds per strategy")
+    parser.add_argument("--seed", type=int, default=seed)
+    parser.add_argument("--strategies", nargs="+", default=list(strategies),
+                        choices=list(strategies))
+    parser.add_argument("--joint", action="store_true",
+                        help="round 8 only: search r7 and r8 together")
+    parser.add_argument("--json", help="also write the summaries here")
+    args = parser.parse_args()
+    summaries = compare(args.round, args.strategies, args.seconds, args.seed,
+                        args.joint)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summaries, f, indent=2)
@@ -0,0 +1,105 @@
+from collections import deque
+import numpy as np
+
+
+def wilson_interval(counts, samples, z=1.96):
+    """
+    Wilson score interval for each share counts / samples
+    counts (array): any shape, samples (int): the same for every entry
+    Returns (lower, upper) arrays shaped like counts
+    """
+    counts = np.asarray(counts, dtype=float)
+    if samples == 0:
+        return np.zeros_like(counts), np.ones_like(counts)
+    share = counts / samples
+    denominator = 1 + z ** 2 / samples
+    centre = (share + z ** 2 / (2 * samples)) / denominator
+    half = (z / denominator) * np.sqrt(share * (1 - share) / samples
+                                       + z ** 2 / (4 * samples ** 2))
+    return np.maximum(centre - half, 0.0), np.minimum(centre + half, 1.0)
+
+
+class Convergence:
+    """
+    Decides when the marginal table has settled, so a run can stop itself
+    Settled means, once there are at least min_samples samples, either
+    every (team, place) Wilson interval is narrower than target_width, or
+    no share has moved by more than tolerance over the last window samples
+    Teams whose intervals are still too wide are "undetermined"
+    """
+    def __init__(self, names, target_width=0.1, window=None,
+                 tolerance=0.01, z=1.96, min_samples=30):
+        """
+        names (list): team names, in the row order of the counts
+        target_width (float): widest interval allowed, None to not use
+        window (int): samples to look back over for the shares to have
+            stopped moving, None to not use
+        """
+        self.names = list(names)
+        self.target_width = target_width
+        self.window = window
+        self.tolerance = tolerance
+        self.z = z
+        self.min_samples = min_samples
+        self.samples = 0
+        self.widths = np.ones((len(self.names), 1))
+        self.history = deque() # (samples, shares), oldest first
+        self.moved = None # biggest change in a share over the window
+
+    def update(self, counts, samples):
+        """
+        counts (array): samples per (team, place), one row per name
+        samples (int): total number of samples
+        Returns True once the marginals have settled
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        self.samples = samples
+        lower, upper = wilson_interval(counts, samples, self.z)
+        self.widths = upper - lower
+        if self.window is not None and samples > 0:
+            shares = counts / samples
+            self.history.append((samples, shares))
+            while (len(self.history) > 1
+                   and self.history[1][0] <= samples - self.window):
+                self.history.popleft()
+            oldest_samples, oldest_shares = self.history[0]
+            if oldest_samples <= samples - self.window:
+                self.moved = float(np.abs(shares - oldest_shares).max())
+        return self.converged()
+
+    def undetermined(self):
+        """
+        Names of teams with an interval wider than target_width, widest
+        first (early on every team is wide, but the teams really split
+        between places are the widest)
+        """
+        if self.target_width is None:
+            return []
+        widest = self.widths.max(axis=1)
+        return [self.names[i] for i in np.argsort(-widest, kind="stable")
+                if widest[i] > self.target_width]
+
+    def converged(self):
+        if self.samples < self.min_samples:
+            return False
+        if (self.target_width is not None
+                and float(self.widths.max()) <= self.target_width):
+            return True
+        return self.moved is not None and self.moved <= self.tolerance
+
+    def report(self, max_names=10):
+        """
+        One line of progress: widest interval, recent movement, and which
+        teams are still undetermined
+        """
+        undetermined = self.undetermined()
+        line = (f"{self.samples} samples, widest interval "
+                f"{float(self.widths.max()):.3f}")
+        if self.moved is not None:
+            line += f", moved {self.moved:.3f} over last {self.window}"
+        line += f", {len(undetermined)} teams undetermined"
+        if undetermined:
+            shown = ", ".join(undetermined[:max_names])
+            more = len(undetermined) - max_names
+            line += f": {shown}" + (f" and {more} more" if more > 0 else "")
+        return line
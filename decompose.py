@@ -0,0 +1,189 @@
+import argparse
+import numpy as np
+from loss_engine import max_pullups, num_brackets
+from snapshot import load_snapshot
+
+
+def couplings(lo, hi, draw_rooms, owners):
+    """
+    Groups of search rooms whose choices can interact through one draw
+    lo, hi (array): lowest and highest points each team could go into the
+        draw's round with (equal once a team's points are settled)
+    draw_rooms (array): one row of four team indices per room in the draw
+    owners (list): arrays giving, per team, the search room that sets its
+        points (-1 if none), e.g. [r7 room of] for the r8 draw, or
+        [r7 room of, r8 room of] for the r9 draw
+    A group is made for each draw room with an unsettled member (its
+    unsettled members, plus unsettled teams that could sit strictly
+    inside its range), and for each bracket that could go over
+    max_pullups (every unsettled team that could be pulled up into it)
+    Rooms in no group together add to the loss separately
+    Returns a list of arrays of search room ids
+    """
+    draw_rooms = np.asarray(draw_rooms, dtype=np.int64).reshape(-1, 4)
+    drawn = np.zeros(len(lo), dtype=bool)
+    drawn[draw_rooms.ravel()] = True
+    room_of = np.full(len(lo), -1, dtype=np.int64)
+    room_of[draw_rooms.ravel()] = np.repeat(np.arange(len(draw_rooms)), 4)
+    unsettled = (lo < hi) & drawn
+
+    def owners_of(teams):
+        ids = np.concatenate([owner[teams] for owner in owners])
+        return np.unique(ids[ids >= 0])
+
+    groups = []
+    room_min = lo[draw_rooms].min(axis=1)
+    room_max = hi[draw_rooms].max(axis=1)
+    for room, teams in enumerate(draw_rooms):
+        if not unsettled[teams].any():
+            continue
+        could_be_inside = (unsettled
+                           & (np.maximum(lo, room_min[room] + 1)
+                              <= np.minimum(hi, room_max[room] - 1)))
+        could_be_inside[teams] = False
+        groups.append(owners_of(np.concatenate(
+            [teams[unsettled[teams]], np.flatnonzero(could_be_inside)])))
+
+    max_of_room = room_max[np.maximum(room_of, 0)]
+    settled_pullups = np.bincount(
+        lo[~unsettled & drawn & (lo < max_of_room)], minlength=num_brackets)
+    for bracket in range(num_brackets):
+        could_pull_up = (unsettled & (lo <= bracket) & (hi >= bracket)
+                         & (bracket < max_of_room))
+        if settled_pullups[bracket] + could_pull_up.sum() > max_pullups:
+            groups.append(owners_of(np.flatnonzero(could_pull_up)))
+    return [group for group in groups if len(group) > 1]
+
+
+def components(groups, rooms):
+    """
+    Split rooms into connected components, rooms being connected if they
+    share a group
+    Returns a list of lists of room ids
+    """
+    parent = {room: room for room in rooms}
+    def find(room):
+        while parent[room] != room:
+            parent[room] = parent[parent[room]]
+            room = parent[room]
+        return room
+    for group in groups:
+        roots = {find(room) for room in group.tolist() if room in parent}
+        if roots:
+            first = roots.pop()
+            for room in roots:
+                parent[room] = first
+    found = {}
+    for room in rooms:
+        found.setdefault(find(room), []).append(room)
+    return list(found.values())
+
+
+def interaction_graph(groups, num_rooms):
+    """
+    weights[a, b] is the number of groups rooms a and b share
+    """
+    weights = np.zeros((num_rooms, num_rooms), dtype=np.int64)
+    for group in groups:
+        weights[np.ix_(group, group)] += 1
+    np.fill_diagonal(weights, 0)
+    return weights
+
+
+def band_blocks(weights, bands, max_block):
+    """
+    Split rooms into blocks of consecutive score bands, at most max_block
+    rooms each, cutting as few interactions as possible
+    bands (array): a score per room (e.g. mean points) to order them by
+    Returns (blocks, cut), blocks being lists of room ids and cut the
+    total weight of interactions between different blocks
+    """
+    order = np.argsort(bands, kind="stable")
+    num_rooms = len(order)
+    ordered = np.triu(weights[np.ix_(order, order)])
+    # below[i, j]: weight of edges from the first i rooms to the first j,
+    # so a block [start, end) cuts below[start, end] - below[start, start]
+    # edges back to earlier rooms, and each cut edge is counted once
+    below = np.zeros((num_rooms + 1, num_rooms + 1), dtype=np.int64)
+    below[1:, 1:] = ordered.cumsum(axis=0).cumsum(axis=1)
+
+    # best[i]: least cut weight splitting the first i rooms into blocks
+    best = np.full(num_rooms + 1, np.iinfo(np.int64).max, dtype=np.int64)
+    back = np.zeros(num_rooms + 1, dtype=np.int64)
+    best[0] = 0
+    for end in range(1, num_rooms + 1):
+        for start in range(max(0, end - max_block), end):
+            cost = best[start] + below[start, end] - below[start, start]
+            if cost < best[end]:
+                best[end], back[end] = cost, start
+    blocks, end = [], num_rooms
+    while end > 0:
+        blocks.append(order[back[end]:end].tolist())
+        end = back[end]
+    return blocks[::-1], int(best[num_rooms])
+
+
+def round_7_groups(known, r7_rooms, r8_rooms):
+    """
+    Groups for the round 7 problem: r7 rooms interacting in the r8 draw,
+    before anything is settled
+    """
+    known = np.asarray(known, dtype=np.int64)
+    r7_rooms = np.asarray(r7_rooms, dtype=np.int64).reshape(-1, 4)
+    r7_of = np.full(len(known), -1, dtype=np.int64)
+    r7_of[r7_rooms.ravel()] = np.repeat(np.arange(len(r7_rooms)), 4)
+    hi = known.copy()
+    hi[r7_rooms.ravel()] += 3
+    return couplings(known, hi, r8_rooms, [r7_of])
+
+
+def round_8_groups(known, r7_rooms, r8_rooms, r9_rooms):
+    """
+    Groups for the joint round 8 problem: r7 rooms are 0 to K-1 and r8
+    rooms K onwards, interacting in the r8 and r9 draws
+    """
+    known = np.asarray(known, dtype=np.int64)
+    r7_rooms = np.asarray(r7_rooms, dtype=np.int64).reshape(-1, 4)
+    r8_rooms = np.asarray(r8_rooms, dtype=np.int64).reshape(-1, 4)
+    r7_of = np.full(len(known), -1, dtype=np.int64)
+    r7_of[r7_rooms.ravel()] = np.repeat(np.arange(len(r7_rooms)), 4)
+    r8_of = np.full(len(known), -1, dtype=np.int64)
+    r8_of[r8_rooms.ravel()] = len(r7_rooms) + np.repeat(
+        np.arange(len(r8_rooms)), 4)
+    r7_hi = known.copy()
+    r7_hi[r7_rooms.ravel()] += 3
+    r8_hi = r7_hi.copy()
+    r8_hi[r8_rooms.ravel()] += 3
+    return (couplings(known, r7_hi, r8_rooms, [r7_of])
+            + couplings(known, r8_hi, r9_rooms, [r7_of, r8_of]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show how a draw splits into independent pieces")
+    parser.add_argument("directory", help="e.g. data/2025")
+    parser.add_argument("--round", type=int, default=7, choices=[7, 8])
+    parser.add_argument("--max-block", type=int, default=20)
+    args = parser.parse_args()
+    snapshot = load_snapshot(args.directory)
+    known = snapshot["points"]
+    if args.round == 7:
+        groups = round_7_groups(known, snapshot["r7"], snapshot["r8"])
+        rooms = [snapshot["r7"]]
+    else:
+        groups = round_8_groups(known, snapshot["r7"], snapshot["r8"],
+                                snapshot["r9"])
+        rooms = [snapshot["r7"], snapshot["r8"]]
+    rooms = np.concatenate(rooms)
+    found = components(groups, list(range(len(rooms))))
+    print(f"{len(rooms)} rooms, {len(found)} independent components of "
+          f"sizes {sorted((len(c) for c in found), reverse=True)}")
+    weights = interaction_graph(groups, len(rooms))
+    blocks, cut = band_blocks(weights, known[rooms].mean(axis=1),
+                              args.max_block)
+    print(f"{len(blocks)} score-band blocks of at most {args.max_block}, "
+          f"{cut} of {weights.sum() // 2} interactions cut")
+    for block in blocks:
+        points = known[rooms[block]]
+        print(f"\t{len(block)} rooms, {points.min()} to {points.max()} "
+              f"points")
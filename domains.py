@@ -0,0 +1,204 @@
+import argparse
+import numpy as np
+from loss_engine import max_pullups, num_brackets, orders
+from snapshot import load_snapshot
+
+
+class Propagator:
+    """
+    Works out which of the 24 orders each room of one round can still take
+    without making the next round's draw impossible
+    Each team's points going into the round are an interval [before_lo,
+    before_hi] (a single point once known), and its points after it are
+    kept as an interval [lo, hi], narrowed as orders are ruled out
+    Only definite violations rule an order out: whatever the rest of the
+    round does, some draw room must have a team strictly between its min
+    and max, or some bracket must go over max_pullups
+    So no zero-loss result is ever ruled out
+    """
+    def __init__(self, before_lo, before_hi, rooms, draw):
+        """
+        before_lo, before_hi (array): points per team index going into the
+            round (the same array twice when they are known)
+        rooms (list): four team indices per room of the round
+        draw (list): four team indices per room of the next round's draw
+        """
+        self.before_lo = np.asarray(before_lo, dtype=np.int64)
+        self.before_hi = np.asarray(before_hi, dtype=np.int64)
+        self.rooms = np.array(rooms, dtype=np.int64).reshape(-1, 4)
+        self.draw = np.array(draw, dtype=np.int64).reshape(-1, 4)
+        num_teams = len(self.before_lo)
+
+        self.drawn = np.zeros(num_teams, dtype=bool)
+        self.drawn[self.draw.ravel()] = True
+        self.draw_of = np.full(num_teams, -1, dtype=np.int64)
+        self.draw_of[self.draw.ravel()] = np.repeat(
+            np.arange(len(self.draw)), 4)
+        self.slot_of = np.zeros(num_teams, dtype=np.int64)
+        self.slot_of[self.draw.ravel()] = np.tile(
+            np.arange(4), len(self.draw))
+        self.room_of = np.full(num_teams, -1, dtype=np.int64)
+        self.room_of[self.rooms.ravel()] = np.repeat(
+            np.arange(len(self.rooms)), 4)
+
+        # Teams that miss the round get a 0, everyone else could get 0 to 3
+        self.lo = self.before_lo.copy()
+        self.hi = self.before_hi.copy()
+        self.hi[self.rooms.ravel()] += 3
+
+    def _interval_index(self):
+        """
+        index[a, b] is the number of drawn teams with lo >= a and hi < b
+        """
+        counts = np.zeros((num_brackets, num_brackets), dtype=np.int64)
+        np.add.at(counts, (self.lo[self.drawn], self.hi[self.drawn]), 1)
+        index = np.zeros((num_brackets + 1, num_brackets + 1),
+                         dtype=np.int64)
+        index[:num_brackets, 1:] = np.cumsum(
+            np.cumsum(counts[::-1], axis=0)[::-1], axis=1)
+        return index
+
+    def _candidates(self, open_rooms):
+        """
+        Each open room's members' points under every order, as intervals
+        Returns (lo, hi), each of shape (open rooms, 24, 4)
+        """
+        members = self.rooms[open_rooms]
+        lo = np.maximum(self.before_lo[members][:, None, :] + orders,
+                        self.lo[members][:, None, :])
+        hi = np.minimum(self.before_hi[members][:, None, :] + orders,
+                        self.hi[members][:, None, :])
+        return lo, hi
+
+    def feasible_orders(self, open_rooms):
+        """
+        Which of the 24 orders of each open room survive, given the
+        current intervals of everyone else
+        Returns a boolean array, one row per open room
+        """
+        num_open = len(open_rooms)
+        num_rooms = len(self.draw)
+        members = self.rooms[open_rooms]
+        new_lo, new_hi = self._candidates(open_rooms)
+        ok = (new_lo <= new_hi).all(axis=2)
+
+        # Every draw room's member intervals under each candidate order
+        shape = (num_open, len(orders), num_rooms, 4)
+        cand_lo = np.broadcast_to(self.lo[self.draw], shape).copy()
+        cand_hi = np.broadcast_to(self.hi[self.draw], shape).copy()
+        for j in range(4):
+            team = members[:, j]
+            has = np.flatnonzero(self.draw_of[team] >= 0)
+            room, slot = self.draw_of[team[has]], self.slot_of[team[has]]
+            cand_lo[has, :, room, slot] = new_lo[has, :, j]
+            cand_hi[has, :, room, slot] = new_hi[has, :, j]
+        min_hi = cand_hi.min(axis=3) # the room min can be no higher
+        max_lo = cand_lo.max(axis=3) # the room max can be no lower
+
+        # OOB: teams that must sit strictly between min and max
+        def must_be_inside(lo, hi):
+            return (lo > min_hi[..., None]) & (hi < max_lo[..., None])
+        index = self._interval_index()
+        inside = index[np.minimum(min_hi + 1, num_brackets), max_lo]
+        moved = self.drawn[members][:, None, None, :]
+        old_lo = self.lo[members][:, None, None, :]
+        old_hi = self.hi[members][:, None, None, :]
+        inside -= (must_be_inside(old_lo, old_hi) & moved).sum(axis=3)
+        inside += (must_be_inside(new_lo[:, :, None, :], new_hi[:, :, None, :])
+                   & moved).sum(axis=3)
+        inside -= must_be_inside(cand_lo, cand_hi).sum(axis=3)
+        ok &= (inside <= 0).all(axis=2)
+
+        # Pullups: settled teams below the lowest the room max can be
+        pulled_up = (cand_lo == cand_hi) & (cand_hi < max_lo[..., None])
+        num_cands = num_open * len(orders)
+        offsets = np.arange(num_cands).reshape(
+            num_open, len(orders), 1, 1) * num_brackets
+        pullups = np.bincount((cand_lo + offsets)[pulled_up],
+                              minlength=num_cands * num_brackets)
+        pullups = pullups.reshape(num_open, len(orders), num_brackets)
+        ok &= (pullups <= max_pullups).all(axis=2)
+        return ok
+
+    def propagate(self, open_rooms):
+        """
+        Narrow the intervals of open rooms' teams to what their surviving
+        orders allow, until nothing changes
+        Returns the surviving orders, or None if some room has none left
+        """
+        while True:
+            ok = self.feasible_orders(open_rooms)
+            if not ok.any(axis=1).all():
+                return None
+            members = self.rooms[open_rooms]
+            new_lo, new_hi = self._candidates(open_rooms)
+            lo = np.where(ok[:, :, None], new_lo, num_brackets).min(axis=1)
+            hi = np.where(ok[:, :, None], new_hi, -1).max(axis=1)
+            if (lo == self.lo[members]).all() and (hi == self.hi[members]).all():
+                return ok
+            self.lo[members] = lo
+            self.hi[members] = hi
+
+
+def prune(known, r7_rooms, r8_rooms, r9_rooms=None):
+    """
+    Rules out every r7 order (and, given r9_rooms, every r8 order) that
+    can't be part of a zero-loss result, straight from the standings and
+    draws, before any search
+    R7 orders are checked against the r8 draw; r8 orders against the r9
+    draw, with each team's post-r7 points narrowed to what is left
+    Returns (r7_ok, r8_ok): boolean arrays with one row of 24 per room,
+    True for orders still possible (r8_ok is None without r9_rooms)
+    If the draws allow no zero-loss result at all, nothing is ruled out,
+    so the search can still find the least bad one
+    """
+    r7 = Propagator(known, known, r7_rooms, r8_rooms)
+    r7_ok = r7.propagate(list(range(len(r7.rooms))))
+    if r7_ok is None:
+        r7_ok = np.ones((len(r7.rooms), len(orders)), dtype=bool)
+        r7.lo, r7.hi = r7.before_lo.copy(), r7.before_hi.copy()
+        r7.hi[r7.rooms.ravel()] += 3
+    if r9_rooms is None:
+        return r7_ok, None
+    r8 = Propagator(r7.lo, r7.hi, r8_rooms, r9_rooms)
+    r8_ok = r8.propagate(list(range(len(r8.rooms))))
+    if r8_ok is None:
+        r8_ok = np.ones((len(r8.rooms), len(orders)), dtype=bool)
+    return r7_ok, r8_ok
+
+
+def possible_places(rooms, ok, num_teams):
+    """
+    The places each team can still take, from the surviving orders of its
+    room
+    Returns a boolean array, one row of four per team index (teams in no
+    room can only take a 0)
+    """
+    rooms = np.asarray(rooms, dtype=np.int64).reshape(-1, 4)
+    possible = np.zeros((num_teams, 4), dtype=bool)
+    possible[:, 0] = True
+    for room, room_ok in zip(rooms, ok):
+        possible[room] = False
+        for j, team in enumerate(room):
+            possible[team, orders[room_ok][:, j]] = True
+    return possible
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show how far the draws alone pin down r7 and r8")
+    parser.add_argument("directory", help="e.g. data/2025")
+    args = parser.parse_args()
+    snapshot = load_snapshot(args.directory)
+    known = snapshot["points"]
+    r9_rooms = snapshot["r9"] if len(snapshot["r9"]) else None
+    r7_ok, r8_ok = prune(known, snapshot["r7"], snapshot["r8"], r9_rooms)
+    for round_num, ok in [(7, r7_ok), (8, r8_ok)]:
+        if ok is None:
+            continue
+        rooms = snapshot[f"r{round_num}"]
+        possible = possible_places(rooms, ok, len(known))[rooms.ravel()]
+        print(f"Round {round_num}: {ok.sum()} of {ok.size} orders left, "
+              f"{(ok.sum(axis=1) == 1).sum()} of {len(rooms)} rooms fixed, "
+              f"{(possible.sum(axis=1) == 1).sum()} of {len(possible)} "
+              f"teams fixed")
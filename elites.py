@@ -0,0 +1,149 @@
+import random
+import numpy as np
+from telemetry import metrics
+
+# CONFIG (defaults, each can be passed to ElitePool instead)
+pool_size = 20 # elites kept
+min_difference = 0.05 # share of rooms any two elites must differ in
+warm_share = 0.0 # share of restarts started near an elite once there are
+max_loss = 0 # only elites with at most this loss are started near (None
+              # for any)
+crossover_share = 0.5 # share of warm starts made by crossing two elites
+perturb_share = 0.1 # most rooms given a fresh random order when warm
+
+
+class ElitePool:
+    """
+    The lowest-loss distinct states restarts have ended on, kept so later
+    restarts can start near them rather than from scratch
+    A state is one or more estimate arrays (r7_est, or r7_est and r8_est)
+    and is compared room by room: two states are as far apart as the
+    number of rooms whose orders differ. No two elites are closer than
+    min_difference of the rooms; a new state that close to some elites
+    replaces them if its loss is lower than all of theirs, and is dropped
+    otherwise, and a full pool drops its highest loss
+    A warm start is an elite with up to perturb_share of its rooms re-drawn
+    at random, or (crossover_share of the time, with two or more to pick
+    from) a run of rooms, in draw order so neighbouring brackets stay
+    together, from one elite and the rest from another, re-drawn the same
+    way. Only elites with loss up to max_loss are started near: in round 7
+    descent from a perturbed near miss mostly falls back into the same
+    trap, and the states it ends on then crowd the pool, though in round
+    8, where zero loss is rare, near misses are the way down
+    Samples found from warm starts lie near earlier ones, so they aren't
+    as independent as those from random starts
+    Each elite can also keep snapshots of the caller's draw totals (see
+    DrawState.snapshot), so a warm start restores them and only has to
+    move the rooms that differ from its first parent (DrawState.update)
+    rather than rebuild them
+    """
+    def __init__(self, rooms, size=pool_size, min_difference=min_difference,
+                 warm_share=warm_share, max_loss=max_loss,
+                 crossover_share=crossover_share, perturb_share=perturb_share):
+        """
+        rooms (list): (part, ids, options) per room in draw order, part
+            being which estimate array the room's teams are in, ids their
+            indices, options the orders it can take
+        """
+        self.rooms = [(part, np.array(ids), options)
+                      for part, ids, options in rooms]
+        self.size = size
+        self.min_distance = max(1, int(min_difference * len(self.rooms)))
+        self.warm_share = warm_share
+        self.max_loss = max_loss
+        self.crossover_share = crossover_share
+        self.perturb_share = perturb_share
+        self.elites = [] # (loss, state, snapshots), each a tuple of arrays
+        self.added = 0
+        self.starts = {"random": 0, "perturbed": 0, "crossover": 0}
+
+    def __len__(self):
+        return len(self.elites)
+
+    def distance(self, state, other):
+        """
+        Number of rooms whose orders differ between two states
+        """
+        return sum(bool((state[part][ids] != other[part][ids]).any())
+                   for part, ids, _ in self.rooms)
+
+    def add(self, loss, *ests, states=()):
+        """
+        Offers the state in ests (copied if kept), with its total loss
+        states (tuple): DrawStates in step with ests, snapshotted if kept
+        Returns True if it joined the pool
+        """
+        state = tuple(est.copy() for est in ests)
+        close = [i for i, (_, elite, _) in enumerate(self.elites)
+                 if self.distance(state, elite) < self.min_distance]
+        if any(self.elites[i][0] <= loss for i in close):
+            return False
+        if not close and len(self.elites) >= self.size:
+            worst = max(range(len(self.elites)),
+                        key=lambda i: self.elites[i][0])
+            if self.elites[worst][0] <= loss:
+                return False
+            close = [worst]
+        for i in sorted(close, reverse=True):
+            del self.elites[i]
+        snapshots = tuple(draw_state.snapshot() for draw_state in states)
+        self.elites.append((loss, state, snapshots))
+        self.added += 1
+        metrics.count("elites_added")
+        return True
+
+    def _perturb(self, ests):
+        """
+        Gives a random order to between one room and perturb_share of them,
+        how many picked uniformly, as how far the nearest unexplored
+        solution is varies from draw to draw
+        """
+        most = max(1, round(self.perturb_share * len(self.rooms)))
+        for part, ids, options in random.sample(self.rooms,
+                                                random.randint(1, most)):
+            ests[part][ids] = options[random.randrange(len(options))]
+
+    def start(self, *ests, states=()):
+        """
+        Fills ests with a warm start, warm_share of the time once there are
+        elites within max_loss
+        states (tuple): DrawStates as passed to add, restored to the first
+            parent's totals; the caller still has to update them to ests
+        Returns how it was made, "perturbed" or "crossover", or None if
+        ests (and states) were left alone for the caller's random start
+        """
+        parents = [(state, snapshots) for loss, state, snapshots
+                   in self.elites
+                   if self.max_loss is None or loss <= self.max_loss]
+        if not parents or random.random() >= self.warm_share:
+            self.starts["random"] += 1
+            return None
+        first, snapshots = random.choice(parents)
+        for est, part in zip(ests, first):
+            est[:] = part
+        for draw_state, snapshot in zip(states, snapshots):
+            draw_state.restore(snapshot)
+        kind = "perturbed"
+        if len(parents) > 1 and random.random() < self.crossover_share:
+            second = random.choice([state for state, _ in parents
+                                    if state is not first])
+            a, b = sorted(random.sample(range(len(self.rooms) + 1), 2))
+            for part, ids, _ in self.rooms[a:b]:
+                ests[part][ids] = second[part][ids]
+            kind = "crossover"
+        self._perturb(ests)
+        self.starts[kind] += 1
+        metrics.count(f"{kind}_starts")
+        return kind
+
+    def report(self):
+        """
+        Returns a dict of elites kept, their losses, and restarts begun
+        each way
+        """
+        return {
+            "elites": len(self.elites),
+            "losses": sorted(loss for loss, _, _ in self.elites),
+            "added": self.added,
+            "starts": dict(self.starts),
+        }
@@ -0,0 +1,304 @@
+import argparse
+import heapq
+import itertools
+import multiprocessing as mp
+import time
+import numpy as np
+import decompose
+from domains import Propagator
+import round_7_backtab as r7_backtab
+from loss_engine import orders
+from results_store import ResultsStore, places, write_table
+
+# CONFIG
+max_seconds = None # give up after this many seconds (None for no limit)
+processes = 1 # processes to share the count between
+exact_filename = f"exact_output_{r7_backtab.year}.txt"
+exact_results_filename = f"exact_results_{r7_backtab.year}.db"
+
+
+class OutOfTime(Exception):
+    pass
+
+
+class ExactSolver(Propagator):
+    """
+    Depth-first search over r7 rooms for every result with zero loss
+    Each team's post-r7 points are kept as an interval [lo, hi], and a
+    room is settled once its teams' intervals are single points
+    Pruning only ever uses definite violations (see domains.Propagator),
+    so no zero-loss result is lost, and once every room is settled the
+    bounds are exact, meaning every leaf is a genuine solution
+    """
+    def __init__(self, known, r7_rooms, r8_rooms, deadline=None):
+        """
+        known (array): post-r6 points per team index
+        r7_rooms, r8_rooms (list): four team indices per room
+        deadline (float): time.time() after which to raise OutOfTime
+        """
+        super().__init__(known, known, r7_rooms, r8_rooms)
+        self.known = self.before_lo
+        self.r7_rooms, self.r8_rooms = self.rooms, self.draw
+        self.deadline = deadline
+        self.nodes = 0
+
+    def components(self, open_rooms):
+        """
+        Split open rooms into groups that can't affect each other's loss
+        (see decompose.couplings), given the current intervals
+        """
+        groups = decompose.couplings(self.lo, self.hi, self.r8_rooms,
+                                     [self.room_of])
+        return decompose.components(groups, open_rooms)
+
+    def _check_time(self):
+        self.nodes += 1
+        if self.deadline is not None and time.time() > self.deadline:
+            raise OutOfTime(f"stopped after {self.nodes} nodes")
+
+    def _count(self, open_rooms):
+        """
+        Returns (number of solutions, counts) for the given rooms, counts
+        being a dict with key team index, value solutions per place
+        Independent groups of rooms are counted separately and multiplied,
+        so solutions are never listed one by one
+        """
+        self._check_time()
+        saved = self.lo.copy(), self.hi.copy()
+        try:
+            if self.propagate(open_rooms) is None:
+                return 0, {}
+            unsettled = [room for room in open_rooms
+                         if (self.lo[self.r7_rooms[room]]
+                             < self.hi[self.r7_rooms[room]]).any()]
+            groups = self.components(unsettled) if unsettled else []
+
+            if len(groups) > 1:
+                total, parts = 1, []
+                for group in groups:
+                    num, counts = self._count(group)
+                    if num == 0:
+                        return 0, {}
+                    total *= num
+                    parts.append((num, counts))
+                counts = {}
+                for num, part in parts:
+                    for team, team_counts in part.items():
+                        counts[team] = [c * (total // num)
+                                        for c in team_counts]
+            elif len(groups) == 1:
+                total, counts = self._branch(groups[0])
+                if total == 0:
+                    return 0, {}
+            else:
+                total, counts = 1, {}
+
+            for room in open_rooms:
+                if room in unsettled:
+                    continue
+                for team in self.r7_rooms[room]:
+                    team_counts = [0] * len(places)
+                    team_counts[self.lo[team] - self.known[team]] = total
+                    counts[team] = team_counts
+            return total, counts
+        finally:
+            self.lo, self.hi = saved
+
+    def _branch(self, group):
+        """
+        Try each surviving order of the room with the fewest, and add up
+        """
+        ok = self.propagate(group)
+        options = ok.sum(axis=1)
+        pick = int(np.argmin(np.where(options == 1, len(orders) + 1,
+                                      options)))
+        room = group[pick]
+        members = self.r7_rooms[room]
+        before = self.lo.copy(), self.hi.copy()
+        total, counts = 0, {}
+        for order in np.flatnonzero(ok[pick]):
+            self.lo, self.hi = before[0].copy(), before[1].copy()
+            self.lo[members] = self.known[members] + orders[order]
+            self.hi[members] = self.lo[members]
+            num, part = self._count(group)
+            total += num
+            add_counts(counts, part)
+        self.lo, self.hi = before
+        return total, counts
+
+    def subproblems(self, size):
+        """
+        Split the search into at least size disjoint pieces (fewer if it
+        runs out of rooms to branch on)
+        The piece with the most orders left is split next, on its room
+        with the fewest, as _branch does, and pieces propagation rules out
+        are dropped, so the work is spread fairly evenly
+        Returns a list of (lo, hi) interval pairs, every solution lying in
+        exactly one of them
+        """
+        rooms = list(range(len(self.r7_rooms)))
+        root = self.lo.copy(), self.hi.copy()
+        pending, done = [], []
+        added = itertools.count() # breaks ties, so arrays aren't compared
+
+        def add(lo, hi):
+            self.lo, self.hi = lo, hi
+            ok = self.propagate(rooms)
+            if ok is None:
+                return
+            options = ok.sum(axis=1)
+            if (options == 1).all():
+                done.append((self.lo, self.hi))
+            else:
+                # heapq pops the smallest, so the biggest piece comes first
+                heapq.heappush(pending, (-np.log(options).sum(), next(added),
+                                         self.lo, self.hi, ok))
+
+        try:
+            add(*(a.copy() for a in root))
+            while pending and len(pending) + len(done) < size:
+                _, _, lo, hi, ok = heapq.heappop(pending)
+                options = ok.sum(axis=1)
+                pick = int(np.argmin(np.where(options == 1, len(orders) + 1,
+                                              options)))
+                members = self.r7_rooms[pick]
+                for order in np.flatnonzero(ok[pick]):
+                    child_lo, child_hi = lo.copy(), hi.copy()
+                    child_lo[members] = self.known[members] + orders[order]
+                    child_hi[members] = child_lo[members]
+                    add(child_lo, child_hi)
+        finally:
+            self.lo, self.hi = root
+        return done + [(lo, hi) for _, _, lo, hi, _ in pending]
+
+    def count(self, processes=1):
+        """
+        Number of zero-loss r7 results, and a dict with key team index,
+        value number of those results per place
+        processes (int): if more than one, the search is split into
+            subproblems that are counted in a pool and added up
+        """
+        rooms = list(range(len(self.r7_rooms)))
+        if processes > 1:
+            pieces = self.subproblems(4 * processes)
+            jobs = [(self.known, self.r7_rooms, self.r8_rooms, lo, hi,
+                     self.deadline) for lo, hi in pieces]
+            total, counts = 0, {}
+            with mp.Pool(processes) as pool:
+                for num, part, nodes in pool.imap_unordered(
+                        _count_subproblem, jobs):
+                    total += num
+                    add_counts(counts, part)
+                    self.nodes += nodes
+        else:
+            total, counts = self._count(rooms)
+        for team in range(len(self.known)):
+            if team not in counts:
+                # Missed r7, so a 0 in every result
+                counts[team] = [total] + [0] * (len(places) - 1)
+        return total, counts
+
+    def solutions(self):
+        """
+        Yields every zero-loss r7 result, one at a time, as an array of
+        places per team index
+        """
+        yield from self._solutions(list(range(len(self.r7_rooms))))
+
+    def _solutions(self, open_rooms):
+        self._check_time()
+        saved = self.lo.copy(), self.hi.copy()
+        try:
+            ok = self.propagate(open_rooms)
+            if ok is None:
+                return
+            options = ok.sum(axis=1)
+            if (options == 1).all():
+                yield self.lo - self.known
+                return
+            pick = int(np.argmin(np.where(options == 1, len(orders) + 1,
+                                          options)))
+            members = self.r7_rooms[open_rooms[pick]]
+            before = self.lo.copy(), self.hi.copy()
+            for order in np.flatnonzero(ok[pick]):
+                self.lo, self.hi = before[0].copy(), before[1].copy()
+                self.lo[members] = self.known[members] + orders[order]
+                self.hi[members] = self.lo[members]
+                yield from self._solutions(open_rooms)
+        finally:
+            self.lo, self.hi = saved
+
+
+def add_counts(counts, part):
+    """
+    Add one set of per-team place counts into another, in place
+    """
+    for team, team_counts in part.items():
+        current = counts.setdefault(team, [0] * len(places))
+        for place, count in enumerate(team_counts):
+            current[place] += count
+
+
+def _count_subproblem(job):
+    """
+    Pool worker: count the solutions inside one (lo, hi) piece
+    Returns (number of solutions, counts, nodes searched)
+    """
+    known, r7_rooms, r8_rooms, lo, hi, deadline = job
+    solver = ExactSolver(known, r7_rooms, r8_rooms, deadline)
+    solver.lo, solver.hi = lo, hi
+    total, counts = solver._count(list(range(len(r7_rooms))))
+    return total, counts, solver.nodes
+
+
+def run_exact(enumerate_all=False, max_seconds=None, processes=1):
+    """
+    Count (or, with enumerate_all, list) every zero-loss r7 result
+    Counting writes exact marginals to exact_filename, the count column
+    being the number of distinct results
+    Listing adds each result once to exact_results_filename
+    processes (int): processes to share a count between (listing always
+        runs in one)
+    """
+    teams, r7_rooms, r8_rooms, known, _ = r7_backtab.initialise(
+        r7_backtab.initialise_directory)
+    deadline = None if max_seconds is None else time.time() + max_seconds
+    solver = ExactSolver(known,
+                         [[t.index for t in room] for room in r7_rooms],
+                         [[t.index for t in room] for room in r8_rooms],
+                         deadline)
+    names = list(teams)
+    store = (ResultsStore(exact_results_filename, names)
+             if enumerate_all else None)
+    start = time.time()
+    try:
+        if enumerate_all:
+            found = 0
+            for r7_est in solver.solutions():
+                found = store.add_sample(names, r7_est.tolist())
+                print(f"Solution {found} ({time.time() - start:.0f}s)")
+            print(f"ALL FOUND: {found} solutions, {solver.nodes} nodes")
+        else:
+            total, counts = solver.count(processes)
+            write_table(exact_filename,
+                        {names[t]: c for t, c in sorted(counts.items())},
+                        total)
+            print(f"COUNTED: {total} solutions, {solver.nodes} nodes "
+                  f"({time.time() - start:.0f}s)")
+    except OutOfTime as e:
+        print(f"OUT OF TIME: {e}, results are incomplete")
+    finally:
+        if store is not None:
+            store.export(exact_filename, overwrite=True) # exact, not added to
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find every round 7 result consistent with the draws")
+    parser.add_argument("--enumerate", action="store_true",
+                        help="list every solution rather than counting")
+    parser.add_argument("--seconds", type=float, default=max_seconds)
+    parser.add_argument("--processes", type=int, default=processes,
+                        help="count in this many processes")
+    args = parser.parse_args()
+    run_exact(args.enumerate, args.seconds, args.processes)
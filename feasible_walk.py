@@ -0,0 +1,145 @@
+import random
+import numpy as np
+import decompose
+from loss_engine import orders
+from telemetry import metrics
+
+
+class FeasibleWalk:
+    """
+    A random walk over round 7 results with loss no more than max_loss,
+    started from one the search has found, so each restart can give many
+    samples rather than one
+    Each move picks a room and a new order for it, or (pair_share of the
+    time) a pair of linked rooms (see decompose.couplings) and new orders
+    for both; a move that would take the loss over max_loss is refused
+    Proposals are chosen so that every result the walk can reach is
+    equally likely in the long run: a single room's new order is picked
+    uniformly, and a pair move picks the first room's order uniformly,
+    then the second's uniformly among those keeping the loss down, and is
+    accepted with the Metropolis-Hastings ratio for that choice
+    Samples taken a few moves apart are still correlated, so thin them
+    """
+    def __init__(self, known, r7_rooms, r8_state, max_loss=0,
+                 allowed=None, pair_share=0.5):
+        """
+        known (array): post-r6 points per team index
+        r7_rooms (list): lists of four Teams
+        r8_state (DrawState): running r8 totals, kept in step with the walk
+        max_loss (int): the most loss a result may have, e.g. qualifier_loss
+        allowed (dict): orders left to each room (see
+            round_7_backtab.prune_rooms); rooms with one are never moved
+        pair_share (float): share of moves that change two rooms
+        """
+        self.known = known
+        self.r8_state = r8_state
+        self.undo = r8_state.snapshot() # reused for every pair move
+        self.max_loss = max_loss
+        self.pair_share = pair_share
+        self.rooms, self.options = [], []
+        for room in r7_rooms:
+            ids = tuple(team.index for team in room)
+            options = orders if allowed is None else allowed[ids]
+            if len(options) > 1:
+                self.rooms.append(np.array(ids))
+                self.options.append(options)
+
+        # Pair moves only between rooms that can affect each other's loss
+        lo, hi = known.copy(), known.copy()
+        r7_of = np.full(len(known), -1, dtype=np.int64)
+        for i, (ids, options) in enumerate(zip(self.rooms, self.options)):
+            lo[ids] += options.min(axis=0)
+            hi[ids] += options.max(axis=0)
+            r7_of[ids] = i
+        groups = decompose.couplings(lo, hi, r8_state.draw.rooms, [r7_of])
+        linked = decompose.interaction_graph(groups, len(self.rooms)) > 0
+        np.fill_diagonal(linked, False)
+        self.linked = [np.flatnonzero(row) for row in linked]
+        self.moves = 0
+        self.accepted = 0
+
+    def _keeps_loss(self, oob_delta, pullup_delta):
+        loss = self.r8_state.loss()
+        return sum(loss) + oob_delta + pullup_delta <= self.max_loss
+
+    def _single(self, r7_est):
+        """
+        A new order for one room, picked uniformly, kept if the loss stays
+        down
+        """
+        i = random.randrange(len(self.rooms))
+        ids, options = self.rooms[i], self.options[i]
+        order = options[random.randrange(len(options))]
+        candidate = self.known[ids] + order
+        oob_delta, pullup_delta = self.r8_state.batch_delta(
+            ids, candidate[None])
+        if not self._keeps_loss(oob_delta, pullup_delta).all():
+            return False
+        r7_est[ids] = order
+        self.r8_state.move(ids, candidate)
+        return True
+
+    def _pair(self, r7_est):
+        """
+        A new order for a room, picked uniformly, then one for a linked
+        room, picked uniformly among those keeping the loss down
+        As the second room's choices are narrowed by the first's, the move
+        is only accepted with probability (choices after) / (choices the
+        second room had before), which makes the walk's moves reversible
+        at equal rates
+        """
+        i = random.randrange(len(self.rooms))
+        if len(self.linked[i]) == 0:
+            return self._single(r7_est)
+        j = self.linked[i][random.randrange(len(self.linked[i]))]
+        first, second = self.rooms[i], self.rooms[j]
+        first_order = self.options[i][random.randrange(len(self.options[i]))]
+        candidates = self.known[second] + self.options[j]
+
+        before = self._keeps_loss(
+            *self.r8_state.batch_delta(second, candidates)).sum()
+        self.r8_state.snapshot(self.undo)
+        self.r8_state.move(first, self.known[first] + first_order)
+        after = np.flatnonzero(self._keeps_loss(
+            *self.r8_state.batch_delta(second, candidates)))
+        if len(after) == 0 or random.random() * before >= len(after):
+            self.r8_state.restore(self.undo)
+            return False
+        pick = after[random.randrange(len(after))]
+        r7_est[first] = first_order
+        r7_est[second] = self.options[j][pick]
+        self.r8_state.move(second, candidates[pick])
+        return True
+
+    def step(self, r7_est):
+        """
+        One proposed move, applied to r7_est (and r8_state) if accepted
+        Returns True if it was
+        """
+        if not self.rooms:
+            return False
+        with metrics.timer("walk"):
+            if random.random() < self.pair_share:
+                accepted = self._pair(r7_est)
+            else:
+                accepted = self._single(r7_est)
+        self.moves += 1
+        self.accepted += accepted
+        metrics.count("walk_moves")
+        metrics.count("walk_accepted", int(accepted))
+        return accepted
+
+    def samples(self, r7_est, num_samples, thin):
+        """
+        Walks from r7_est, which must already be within max_loss, yielding
+        after every thin moves, num_samples times; r7_est holds the sample
+        each time (modified in place, so copy it to keep it)
+        """
+        self.r8_state.reset(self.known + r7_est)
+        if sum(self.r8_state.loss()) > self.max_loss:
+            raise ValueError("the walk must start from a result within "
+                             "max_loss")
+        for _ in range(num_samples):
+            for _ in range(thin):
+                self.step(r7_est)
+            yield r7_est
@@ -0,0 +1,255 @@
+import json
+import os
+import socketserver
+import stat
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+from results_store import format_table, places
+
+# CONFIG
+host = "127.0.0.1" # TCP servers only answer this machine
+rate_window = 60 # seconds the recent throughput is measured over
+
+
+class LiveResults:
+    """
+    What a run has saved so far, held in memory by the process saving it,
+    so anyone can ask how it is going without opening the result files
+    Counts are per (team, place) for the round being searched (r8 places
+    in round 8), over every kind of sim saved; sims and distinct results
+    are kept per kind (the store they went to, e.g. "zero" or "expire")
+    The saving process updates it and the server's threads read it, each
+    under one lock, so a reader sees counts, totals and convergence that
+    agree; a read copies the counts, so is O(teams) however many sims
+    there are
+    """
+    def __init__(self, names, round_num, counts, samples, convergence,
+                 restarts=0, elapsed=0.0):
+        """
+        names (list): team names, in the row order of counts
+        counts (array): counts to start from, one row per team, one column
+            per place; kept and added to
+        samples (int): sims those counts are over
+        convergence (Convergence): updated with every sim added, and now
+            if it isn't up to date with counts
+        restarts, elapsed: carried on from, if resuming
+        """
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.round_num = round_num
+        self.counts = counts
+        self.convergence = convergence
+        self.samples = samples
+        self.restarts = restarts
+        self.sims = {}
+        self.fingerprints = {} # kind: set of fingerprints, for distinct
+        self.start = time.time() - elapsed
+        self.recent = deque() # (time, restarts, samples), oldest first
+        self.lock = threading.Lock()
+        if convergence.samples != samples:
+            convergence.update(counts, samples)
+
+    def seen(self, kind, fingerprints, sims=0):
+        """
+        Counts results already stored before this run as distinct
+        sims (int): how many sims of this kind the store already holds
+        """
+        with self.lock:
+            self.fingerprints.setdefault(kind, set()).update(fingerprints)
+            self.sims[kind] = self.sims.get(kind, 0) + sims
+
+    def distinct(self, kind):
+        with self.lock:
+            return len(self.fingerprints.get(kind, ()))
+
+    def add_restart(self):
+        with self.lock:
+            self.restarts += 1
+            self._mark()
+
+    def add(self, kind, results, fingerprint):
+        """
+        One saved sim of the given kind
+        results (array): the place of each team, in names order
+        fingerprint (bytes): identifies the result, see state_cache
+        Returns True once the marginals have settled
+        """
+        with self.lock:
+            self.counts[np.arange(len(self.names)), results] += 1
+            self.samples += 1
+            self.sims[kind] = self.sims.get(kind, 0) + 1
+            self.fingerprints.setdefault(kind, set()).add(fingerprint)
+            self._mark()
+            return self.convergence.update(self.counts, self.samples)
+
+    def _mark(self):
+        now = time.time()
+        self.recent.append((now, self.restarts, self.samples))
+        while self.recent[0][0] < now - rate_window:
+            self.recent.popleft()
+
+    def status(self):
+        """
+        Returns a dict of sims and distinct results per kind, restarts,
+        throughput overall and over the last rate_window seconds, and how
+        far the marginals are from settling
+        """
+        with self.lock:
+            now = time.time()
+            seconds = now - self.start
+            first = self.recent[0] if self.recent else (now, 0, 0)
+            recent_seconds = now - first[0]
+            convergence = self.convergence
+            widest = convergence.widths.max(axis=1)
+            target = convergence.target_width
+            return {
+                "round": self.round_num,
+                "samples": self.samples,
+                "sims": dict(self.sims),
+                "distinct": {kind: len(fingerprints) for kind, fingerprints
+                             in self.fingerprints.items()},
+                "restarts": self.restarts,
+                "seconds": seconds,
+                "restarts_per_second": self.restarts / seconds
+                                       if seconds else None,
+                "samples_per_second": self.samples / seconds
+                                      if seconds else None,
+                "recent_restarts_per_second":
+                    (self.restarts - first[1]) / recent_seconds
+                    if recent_seconds else None,
+                "recent_samples_per_second":
+                    (self.samples - first[2]) / recent_seconds
+                    if recent_seconds else None,
+                "convergence": {
+                    "settled": convergence.converged(),
+                    "widest_interval": float(widest.max())
+                                       if len(widest) else None,
+                    "target_width": target,
+                    "moved": convergence.moved,
+                    "window": convergence.window,
+                    "undetermined": None if target is None
+                                    else int((widest > target).sum()),
+                },
+            }
+
+    def marginals(self, team=None):
+        """
+        Returns a dict of samples and, per team (or just the one named),
+        the count and share of samples in each place and the widest
+        interval around those shares
+        Raises KeyError for a team not in the draw
+        """
+        rows = (np.arange(len(self.names)) if team is None
+                else np.array([self.index[team]]))
+        with self.lock:
+            counts = self.counts[rows].copy()
+            widths = self.convergence.widths.max(axis=1)[rows].copy()
+            samples = self.samples
+        shares = counts / samples if samples else np.zeros(counts.shape)
+        return {
+            "round": self.round_num,
+            "samples": samples,
+            "places": places,
+            "teams": {self.names[i]: {"counts": count.tolist(),
+                                      "shares": share.tolist(),
+                                      "interval": float(width)}
+                      for i, count, share, width
+                      in zip(rows, counts, shares, widths)},
+        }
+
+    def table(self):
+        """
+        The marginals in the output file's format, see format_table
+        """
+        with self.lock:
+            counts = self.counts.copy()
+            samples = self.samples
+        return format_table(dict(zip(self.names, counts.tolist())), samples)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    GET only, so nothing asked can change the run:
+    /status, /marginals (or /marginals?team=NAME) as JSON, and
+    /marginals.tsv as the output file would have it
+    """
+    def do_GET(self):
+        live = self.server.live
+        url = urlsplit(self.path)
+        if url.path == "/status":
+            self._send(json.dumps(live.status()), "application/json")
+        elif url.path == "/marginals":
+            team = parse_qs(url.query).get("team", [None])[0]
+            try:
+                marginals = live.marginals(team)
+            except KeyError:
+                self.send_error(404, f"no team {team}")
+                return
+            self._send(json.dumps(marginals), "application/json")
+        elif url.path == "/marginals.tsv":
+            self._send(live.table(), "text/tab-separated-values")
+        else:
+            self.send_error(404, "try /status, /marginals or /marginals.tsv")
+
+    def _send(self, body, content_type):
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass # every refresh would print a line over the run's own output
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else: # not on Windows
+    _UnixHTTPServer = None
+
+
+def serve(live, address):
+    """
+    Answers queries about live (a LiveResults) from a background thread
+    address (int or str): a TCP port on host, or the path of a Unix
+        socket to make (not on Windows); an old socket there is replaced,
+        anything else raises ValueError
+    Returns the server, for stop
+    """
+    if isinstance(address, int) or str(address).isdigit():
+        server = ThreadingHTTPServer((host, int(address)), _Handler)
+    elif _UnixHTTPServer is None:
+        raise ValueError("Unix sockets aren't available here, give a port")
+    else:
+        if os.path.exists(address):
+            if not stat.S_ISSOCK(os.stat(address).st_mode):
+                raise ValueError(f"{address} exists and isn't a socket")
+            os.remove(address) # left by a run that didn't stop cleanly
+        server = _UnixHTTPServer(address, _Handler)
+    server.live = live
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def describe(server):
+    """
+    Where the server can be asked, for the console
+    """
+    if isinstance(server.server_address, tuple):
+        address_host, port = server.server_address[:2]
+        return f"http://{address_host}:{port}/status"
+    return f"curl --unix-socket {server.server_address} http://x/status"
+
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+    if not isinstance(server.server_address, tuple):
+        os.remove(server.server_address)
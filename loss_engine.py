@@ -0,0 +1,399 @@
+import numpy as np
+from itertools import permutations
+
+# Points only ever run from 0 up to 27, same as the old pullup_dict range
+num_brackets = 28
+max_pullups = 3
+
+orders = np.array(list(permutations([0, 1, 2, 3])), dtype=np.int64)
+brackets = np.arange(num_brackets)
+
+
+class ScoreIndex:
+    """
+    Number of teams on each number of points, with prefix sums, so that
+    "how many teams sit strictly between a and b" is two lookups
+    Works on one histogram, or on one histogram per row for batches
+    """
+    __slots__ = ("counts", "_prefix")
+
+    def __init__(self, counts):
+        """
+        counts (array): teams per bracket, shape (num_brackets,) or
+            (num_rows, num_brackets)
+        """
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self._prefix = None
+
+    @classmethod
+    def from_points(cls, points):
+        """
+        points (array): team points, or one row of team points per row
+        """
+        points = np.asarray(points, dtype=np.int64)
+        if points.ndim == 1:
+            return cls(np.bincount(points, minlength=num_brackets))
+        num_rows = len(points)
+        offsets = np.arange(num_rows)[:, None] * num_brackets
+        counts = np.bincount((points + offsets).ravel(),
+                             minlength=num_rows * num_brackets)
+        return cls(counts.reshape(num_rows, num_brackets))
+
+    @property
+    def prefix(self):
+        """
+        prefix[..., v] is the number of teams on fewer than v points
+        Worked out on first use
+        """
+        if self._prefix is None:
+            shape = self.counts.shape[:-1] + (num_brackets + 1,)
+            self._prefix = np.zeros(shape, dtype=np.int64)
+            np.cumsum(self.counts, axis=-1, out=self._prefix[..., 1:])
+        return self._prefix
+
+    def between(self, lo, hi):
+        """
+        Number of teams strictly between lo and hi (zero if hi <= lo + 1)
+        For a batched index, lo and hi have one row per index row
+        """
+        start = np.minimum(lo + 1, hi)
+        if self.counts.ndim == 1:
+            return self.prefix[hi] - self.prefix[start]
+        # Rows laid end to end, so both lookups are one fancy index each
+        flat = self.prefix.reshape(-1)
+        offsets = np.arange(len(self.prefix))[:, None] * (num_brackets + 1)
+        return flat[hi + offsets] - flat[start + offsets]
+
+    def outside_between(self, lo, hi, room_points):
+        """
+        Like between, but not counting the room's own teams, which are
+        assumed to be in the index: a four-team correction rather than
+        a copy of the list with the room taken out
+        room_points (array): the room's points, last axis of length four
+        """
+        own = ((room_points > lo[..., None])
+               & (room_points < hi[..., None])).sum(axis=-1)
+        return self.between(lo, hi) - own
+
+
+class DrawLoss:
+    """
+    Loss bookkeeping for a single draw (e.g. the r8 rooms or the r9 rooms)
+    Everything is kept as integer arrays indexed by team number: the
+    rooms, the teams drawn, and the room each team is in
+    """
+    def __init__(self, rooms, num_teams):
+        """
+        rooms (list): one list of four team indices per room in the draw
+        num_teams (int): total number of teams in the tournament
+        room_of and seat_of give each drawn team's room and place in it
+        (-1 for teams not drawn)
+        """
+        self.rooms = np.array(rooms, dtype=np.int64).reshape(-1, 4)
+        self.num_teams = num_teams
+        self.drawn = np.sort(self.rooms.ravel())
+        self.room_of = np.full(num_teams, -1, dtype=np.int64)
+        self.room_of[self.rooms.ravel()] = np.repeat(
+            np.arange(len(self.rooms)), 4)
+        self.seat_of = np.full(num_teams, -1, dtype=np.int64)
+        self.seat_of[self.rooms.ravel()] = np.tile(np.arange(4),
+                                                   len(self.rooms))
+
+    def loss(self, points):
+        """
+        Returns (oob_loss, pullup_loss) for the draw given every team's
+        points going into the round, counted from scratch
+        The search keeps running totals instead (see DrawState), which
+        test_loss_engine.py checks against this
+        OOB loss: for each room, the number of teams outside it whose
+            points fall strictly between the room min and max
+        Pullup loss: +1 for each pullup over the max in a bracket
+        points (array): points per team index
+        """
+        points = np.asarray(points, dtype=np.int64)
+        room_points = points[self.rooms]
+        room_min = room_points.min(axis=1)
+        room_max = room_points.max(axis=1)
+
+        index = ScoreIndex.from_points(points[self.drawn])
+        oob_loss = index.outside_between(room_min, room_max,
+                                         room_points).sum()
+
+        pulled_up = room_points < room_max[:, None]
+        pullups = np.bincount(room_points[pulled_up],
+                              minlength=num_brackets)
+        pullup_loss = np.maximum(0, pullups - max_pullups).sum()
+        return int(oob_loss), int(pullup_loss)
+
+
+class DrawStates:
+    """
+    Running totals for one draw, kept in step with the teams' points so
+    that reordering a room costs O(rooms touched) rather than a rescan,
+    for any number of chains at once: every array has a leading chain
+    axis, so a move or a batch of candidate scores is one set of array
+    operations however many chains there are (DrawState is the one-chain
+    case)
+    Per chain: the points, the number of drawn teams on each number of
+    points, and per bracket the number of rooms whose open (min, max)
+    interval covers it and the pullup count
+    The oob loss is then sum(counts * cover) minus the teams counted
+    against their own room (inside)
+    Every chain moves the same teams at the same time (each to its own
+    points), which is what lets the candidates be shared
+    A chain's totals live in one row of one flat array, data, the other
+    arrays being views into it, so a reset clears them in one go and
+    snapshot and restore copy the whole state without allocating
+    """
+    __slots__ = ("draw", "data", "points", "counts", "cover", "pullups",
+                 "inside")
+
+    def __init__(self, draw, points):
+        """
+        draw (DrawLoss): the draw being tracked
+        points (array): one row of points per team index for each chain
+        """
+        self.draw = draw
+        sizes = [draw.num_teams, num_brackets, num_brackets, num_brackets, 1]
+        self.data = np.zeros((len(points), sum(sizes)), dtype=np.int64)
+        (self.points, self.counts, self.cover, self.pullups,
+         inside) = np.split(self.data, np.cumsum(sizes)[:-1], axis=1)
+        self.inside = inside[:, 0]
+        self.reset(slice(None), points)
+
+    def reset(self, chains, points):
+        """
+        Rebuild the totals of some chains from scratch, e.g. on a restart
+        chains (array or slice): which chains
+        points (array): one row of points per chain in chains
+        """
+        self.data[chains] = 0
+        self.points[chains] = points
+        drawn = self.points[chains][:, self.draw.drawn]
+        self.counts[chains] = ScoreIndex.from_points(drawn).counts
+        self._add_rooms(np.arange(len(self.draw.rooms)), 1, chains)
+
+    def snapshot(self, out=None):
+        """
+        A copy of every chain's state, written into out (e.g. an earlier
+        snapshot) if given, so nothing is allocated
+        """
+        if out is None:
+            return self.data.copy()
+        out[:] = self.data
+        return out
+
+    def restore(self, snapshot):
+        """
+        Go back to a state from snapshot, without allocating
+        Nothing is kept outside data (batch_delta builds its ScoreIndex
+        fresh), so copying it back is the whole of it
+        """
+        self.data[:] = snapshot
+
+    def loss(self):
+        """
+        Returns (oob_loss, pullup_loss), one entry per chain
+        """
+        oob_loss = (self.counts * self.cover).sum(axis=1) - self.inside
+        pullup_loss = np.maximum(0, self.pullups - max_pullups).sum(axis=1)
+        return oob_loss, pullup_loss
+
+    def move(self, team_ids, new_points):
+        """
+        Give the same teams new points in every chain, updating only the
+        rooms they sit in
+        new_points (array): one row per chain, new points per team_id
+        """
+        keep = self.draw.room_of[team_ids] >= 0
+        team_ids = np.asarray(team_ids)[keep]
+        if len(team_ids) == 0:
+            return
+        new_points = np.asarray(new_points, dtype=np.int64)[:, keep]
+        chains = np.arange(len(self.points))[:, None]
+        room_ids = np.unique(self.draw.room_of[team_ids])
+        self._add_rooms(room_ids, -1)
+        np.add.at(self.counts, (chains, self.points[:, team_ids]), -1)
+        np.add.at(self.counts, (chains, new_points), 1)
+        self.points[:, team_ids] = new_points
+        self._add_rooms(room_ids, 1)
+
+    def batch_delta(self, team_ids, candidates):
+        """
+        Change in loss in every chain for many candidate points for the
+        same teams, without applying any of them
+        candidates (array): one row per candidate, new points per team_id
+        Returns two arrays of shape (chains, candidates), the change in
+        oob and pullup loss
+        """
+        candidates = np.asarray(candidates, dtype=np.int64)
+        num_chains, num_rows = len(self.points), len(candidates)
+        keep = self.draw.room_of[team_ids] >= 0
+        team_ids = np.asarray(team_ids)[keep]
+        candidates = candidates[:, keep]
+        if len(team_ids) == 0:
+            zeros = np.zeros((num_chains, num_rows), dtype=np.int64)
+            return zeros, zeros
+        before = self.loss()
+        chains = np.arange(num_chains)
+
+        # Totals with the touched rooms and moved teams taken out
+        room_of = self.draw.room_of[team_ids]
+        room_ids = np.unique(room_of)
+        room_points = self.points[:, self.draw.rooms[room_ids]]
+        lo, hi = room_points.min(axis=2), room_points.max(axis=2)
+        cover = self.cover - self._cover_of(lo, hi)
+        pullups = self.pullups - self._pullups_of(room_points, hi)
+        inside = self.inside - self._inside_of(room_points, lo, hi)
+        counts = self.counts.copy()
+        np.add.at(counts, (chains[:, None], self.points[:, team_ids]), -1)
+        index = ScoreIndex(counts)
+
+        # Touched rooms under each candidate
+        room_points = np.repeat(room_points[:, None], num_rows, axis=1)
+        room_points[:, :, np.searchsorted(room_ids, room_of),
+                    self.draw.seat_of[team_ids]] = candidates
+        lo, hi = room_points.min(axis=3), room_points.max(axis=3)
+
+        # OOB: rest of draw sees the moved teams through cover, touched
+        # rooms count everyone else strictly inside their range, with the
+        # moved teams added back onto the index as a correction
+        shape = (num_chains, -1)
+        between = index.outside_between(
+            lo.reshape(shape), hi.reshape(shape),
+            room_points.reshape(shape + (4,))).reshape(lo.shape)
+        between += ((candidates[None, :, None, :] > lo[..., None])
+                    & (candidates[None, :, None, :] < hi[..., None])).sum(
+                        axis=3)
+        oob_loss = ((counts * cover).sum(axis=1) - inside)[:, None]
+        oob_loss = (oob_loss + cover[:, candidates].sum(axis=2)
+                    + between.sum(axis=2))
+
+        pullups = pullups[:, None, :] + self._pullups_of(
+            room_points, hi).reshape(num_chains, num_rows, num_brackets)
+        pullup_loss = np.maximum(0, pullups - max_pullups).sum(axis=2)
+        return (oob_loss - before[0][:, None],
+                pullup_loss - before[1][:, None])
+
+    @staticmethod
+    def _pullups_of(room_points, hi):
+        """
+        Per leading index (chain, or chain and candidate), the number of
+        teams pulled up onto each number of points in the given rooms
+        Returns an array of shape (rows, num_brackets)
+        """
+        num_rows = room_points[..., 0, 0].size
+        offsets = (np.arange(num_rows).reshape(room_points.shape[:-2]
+                                               + (1, 1)) * num_brackets)
+        pulled_up = room_points < hi[..., None]
+        return np.bincount((room_points + offsets)[pulled_up],
+                           minlength=num_rows * num_brackets).reshape(
+                               num_rows, num_brackets)
+
+    @staticmethod
+    def _cover_of(lo, hi):
+        """
+        Per chain, the number of the given rooms covering each bracket
+        strictly inside their (lo, hi) range
+        """
+        # A handful of rooms per move, so comparing every room with every
+        # bracket beats a difference array and its cumsum
+        return ((lo[..., None] < brackets)
+                & (brackets < hi[..., None])).sum(axis=-2)
+
+    @staticmethod
+    def _inside_of(room_points, lo, hi):
+        """
+        Per chain, the number of teams strictly inside their own room's
+        (lo, hi) range, over the given rooms
+        """
+        return ((room_points > lo[:, :, None])
+                & (room_points < hi[:, :, None])).sum(axis=(1, 2))
+
+    def _add_rooms(self, room_ids, sign, chains=slice(None)):
+        """
+        Add (sign 1) or remove (sign -1) rooms' share of the totals, in
+        the given chains (all of them by default)
+        """
+        room_points = self.points[chains][:, self.draw.rooms[room_ids]]
+        lo, hi = room_points.min(axis=2), room_points.max(axis=2)
+        self.cover[chains] += sign * self._cover_of(lo, hi)
+        self.pullups[chains] += sign * self._pullups_of(room_points, hi)
+        self.inside[chains] += sign * self._inside_of(room_points, lo, hi)
+
+
+class DrawState:
+    """
+    The running totals of DrawStates for a single chain, taking one row
+    of points and giving plain losses, for the search that runs one
+    restart at a time
+    """
+    __slots__ = ("states",)
+
+    def __init__(self, draw, points):
+        """
+        draw (DrawLoss): the draw being tracked
+        points (array): points per team index going into the round
+        """
+        self.states = DrawStates(draw, np.asarray(points)[None])
+
+    @property
+    def draw(self):
+        return self.states.draw
+
+    @property
+    def points(self):
+        return self.states.points[0]
+
+    def reset(self, points):
+        """
+        Rebuild every total from scratch, e.g. after a restart
+        """
+        self.states.reset(slice(None), np.asarray(points)[None])
+
+    def update(self, points):
+        """
+        Catch up with new points by moving only the teams whose points
+        differ, e.g. after restoring a snapshot of a nearby state
+        """
+        changed = np.flatnonzero(self.points != points)
+        self.move(changed, np.asarray(points)[changed])
+
+    def snapshot(self, out=None):
+        """
+        See DrawStates.snapshot
+        """
+        return self.states.snapshot(out)
+
+    def restore(self, snapshot):
+        self.states.restore(snapshot)
+
+    def loss(self):
+        """
+        Returns (oob_loss, pullup_loss) for the current points
+        Untimed: reading the totals is a dot product and a clip over the
+        brackets, and the work of keeping them is timed where it is done,
+        as part of order_scoring, move and global_loss
+        """
+        oob_loss = int(self.states.counts[0] @ self.states.cover[0]
+                       - self.states.inside[0])
+        pullup_loss = int(np.maximum(0, self.states.pullups[0]
+                                     - max_pullups).sum())
+        return oob_loss, pullup_loss
+
+    def move(self, team_ids, new_points):
+        """
+        Give some teams new points, updating only the rooms they sit in
+        """
+        self.states.move(team_ids, np.asarray(new_points)[None])
+
+    def batch_delta(self, team_ids, candidates):
+        """
+        Change in loss for many candidate points for the same teams,
+        without applying any of them
+        candidates (array): one row per candidate, new points per team_id
+        Returns two arrays, the change in oob and pullup loss per candidate
+        """
+        oob_delta, pullup_delta = self.states.batch_delta(team_ids,
+                                                          candidates)
+        return oob_delta[0], pullup_delta[0]
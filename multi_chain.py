@@ -0,0 +1,186 @@
+import random
+import time
+import numpy as np
+from loss_engine import DrawStates, orders
+from state_cache import fingerprint
+from telemetry import metrics
+
+
+class MultiChain:
+    """
+    Round 7 restarts run as num_chains chains side by side: the results
+    are one (chains x teams) array, every chain takes its turn on the same
+    room at the same time, and the orders for all of them are scored in
+    one batch, so the interpreter's cost per room is paid once, not once
+    per chain
+    A chain that reaches zero loss, fails the cutoff or runs out of sweeps
+    is handed back and restarted on the spot, so all chains stay busy
+    Each chain is a restart as run_restart would do it, except that all
+    chains visit rooms in the same (reshuffled every sweep) order
+    Descent and annealing are supported (tabu keeps per-room history,
+    which doesn't batch)
+    """
+    def __init__(self, known, r7_rooms, r8_loss, num_chains, strategy,
+                 schedule, qualifier_loss=0, cache=None, allowed=None,
+                 elites=None):
+        """
+        known (array): post-r6 points per team index
+        r7_rooms (list): rooms, each a list of four Teams
+        r8_loss (DrawLoss): the r8 draw
+        strategy (Descent or Annealing): how each chain picks an order;
+            its stats get one record per restart
+        schedule (FixedSchedule): each chain's sweep limit and cutoffs (see
+            schedules.py), told how each restart went
+        cache (StateCache): as in run_restart
+        allowed (dict): orders left to each room, see prune_rooms
+        elites (ElitePool): as in run_restart, each chain's start drawn
+            from it on its own
+        """
+        if strategy.name not in ("descent", "annealing"):
+            raise ValueError(f"{strategy.name} can't be run as a batch")
+        self.known = known
+        self.strategy = strategy
+        self.schedule = schedule
+        self.qualifier_loss = qualifier_loss
+        self.cache = cache
+        self.elites = elites
+        self.rooms = []
+        for room in r7_rooms:
+            ids = np.array([team.index for team in room])
+            options = orders if allowed is None else allowed[tuple(ids)]
+            self.rooms.append((ids, options))
+        self.rng = np.random.default_rng(random.getrandbits(64))
+
+        self.est = np.zeros((num_chains, len(known)), dtype=np.int64)
+        self.sweeps = np.zeros(num_chains, dtype=np.int64)
+        self.paths = [[] for _ in range(num_chains)]
+        self.clocks = np.zeros(num_chains)
+        self.budgets = [None] * num_chains
+        self._reset_results(np.arange(num_chains))
+        self.states = DrawStates(r8_loss, known + self.est)
+
+    def _reset_results(self, chains):
+        """
+        A fresh random result for each given chain, as reset_team_results,
+        or a warm start from the elites
+        """
+        self.est[chains] = 0
+        for ids, options in self.rooms:
+            picks = self.rng.integers(len(options), size=len(chains))
+            self.est[np.ix_(chains, ids)] = options[picks]
+        if self.elites is not None:
+            for chain in chains:
+                self.elites.start(self.est[chain])
+        self.sweeps[chains] = 0
+        for chain in chains:
+            self.paths[chain] = []
+            self.budgets[chain] = self.schedule.start()
+        self.clocks[chains] = time.process_time()
+
+    def _choose(self, scores):
+        """
+        One order per chain: descent takes the lowest score, annealing
+        samples by heat-bath at each chain's own temperature, ties broken
+        at random either way (by the Gumbel trick, so no loop over chains)
+        """
+        noise = self.rng.gumbel(size=scores.shape)
+        if self.strategy.name == "descent":
+            lowest = scores == scores.min(axis=1, keepdims=True)
+            return np.where(lowest, noise, -np.inf).argmax(axis=1)
+        temperatures = np.empty(len(scores))
+        for chain, sweep in enumerate(self.sweeps):
+            self.strategy.sweep = int(sweep)
+            temperatures[chain] = self.strategy.temperature()
+        return (noise - scores / temperatures[:, None]).argmax(axis=1)
+
+    def sweep(self):
+        """
+        Every chain takes one sweep over the rooms
+        """
+        for i in self.rng.permutation(len(self.rooms)):
+            ids, options = self.rooms[i]
+            if len(options) == 1:
+                continue # locked in by _reset_results
+            candidates = self.known[ids] + options
+            with metrics.timer("order_scoring"):
+                oob_delta, pullup_delta = self.states.batch_delta(
+                    ids, candidates)
+                best = self._choose(oob_delta + pullup_delta)
+            metrics.count("rooms_scored", len(best))
+            metrics.count("orders_scored", len(best) * len(candidates))
+            self.est[:, ids] = options[best]
+            with metrics.timer("move"):
+                self.states.move(ids, candidates[best])
+        self.sweeps += 1
+
+    def _finished(self):
+        """
+        Each chain's outcome after a sweep (None to carry on), and losses
+        """
+        oob_loss, pullup_loss = self.states.loss()
+        total = oob_loss + pullup_loss
+        outcomes = [None] * len(total)
+        for chain in range(len(total)):
+            budget = self.budgets[chain]
+            cut = self.schedule.check(budget, int(total[chain]))
+            if total[chain] <= self.qualifier_loss:
+                outcomes[chain] = "ACHIEVED"
+            elif cut:
+                outcomes[chain] = "CUTOFF FAILED"
+            elif self.cache is not None:
+                key = fingerprint(self.est[chain])
+                seen, solution = self.cache.lookup(key)
+                if seen and solution is None:
+                    outcomes[chain] = "KNOWN DEAD END"
+                elif seen:
+                    self.est[chain] = solution
+                    self.states.reset([chain], self.known + solution)
+                    # Within qualifier_loss, not necessarily zero
+                    reset_oob, reset_pullup = self.states.loss()
+                    oob_loss[chain] = reset_oob[chain]
+                    pullup_loss[chain] = reset_pullup[chain]
+                    outcomes[chain] = "ACHIEVED"
+                else:
+                    self.paths[chain].append(key)
+            if (outcomes[chain] is None
+                    and self.sweeps[chain] >= budget.limit):
+                outcomes[chain] = "EXPIRED"
+        return outcomes, oob_loss, pullup_loss
+
+    def restarts(self):
+        """
+        Runs chains until the caller stops asking, yielding every finished
+        restart as (outcome, loss, r7_est), with r7_est a fresh array
+        """
+        num_chains = len(self.est)
+        while True:
+            self.sweep()
+            outcomes, oob_loss, pullup_loss = self._finished()
+            done = [chain for chain in range(num_chains)
+                    if outcomes[chain] is not None]
+            now = time.process_time()
+            for chain in done:
+                outcome = outcomes[chain]
+                r7_est = self.est[chain].copy()
+                if self.cache is not None:
+                    self.cache.record(self.paths[chain],
+                                      r7_est if outcome == "ACHIEVED"
+                                      else None)
+                if self.elites is not None:
+                    self.elites.add(int(oob_loss[chain] + pullup_loss[chain]),
+                                    r7_est)
+                # Chains share the CPU, so each is charged its share
+                seconds = (now - self.clocks[chain]) / num_chains
+                self.strategy.stats.record(outcome, int(self.sweeps[chain]),
+                                           seconds)
+                self.schedule.finish(self.budgets[chain], outcome, seconds)
+                metrics.count("restarts")
+                metrics.count("sweeps", int(self.sweeps[chain]))
+                metrics.count(outcome)
+                yield outcome, (int(oob_loss[chain]),
+                                int(pullup_loss[chain])), r7_est
+            if done:
+                chains = np.array(done)
+                self._reset_results(chains)
+                self.states.reset(chains, self.known + self.est[chains])
+            metrics.tick()
@@ -0,0 +1,492 @@
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import random
+import time
+import numpy as np
+import round_7_backtab as r7_backtab
+import round_8_backtab as r8_backtab
+import live_server
+from checkpoint import Checkpointer
+from convergence import Convergence
+from feasible_walk import FeasibleWalk
+from loss_engine import DrawState
+from schedules import make_schedule, schedules
+from sim_store import SimStore
+from state_cache import StateCache, fingerprint
+from strategies import make_strategy, strategies
+from telemetry import metrics
+
+# CONFIG (each can be overridden on the command line)
+round_num = 7 # which backtab to run, 7 or 8
+num_workers = os.cpu_count()
+max_sims = None # stop after this many saved simulations (None for no limit)
+max_seconds = None # stop after this many seconds (None for no limit)
+base_seed = 0 # worker n is seeded with base_seed + n
+strategy_name = "descent" # search strategy, see strategies.py
+schedule_name = "fixed" # restart cutoffs, see schedules.py
+metrics_filename = None # JSONL timings from every process, see telemetry.py
+metrics_interval = 10 # seconds between each process's metrics lines
+checkpoint_filename = None # e.g. "checkpoint.ckpt" to be able to --resume
+checkpoint_interval = 300 # seconds between checkpoints
+serve_address = None # e.g. 8765 or "backtab.sock" to answer live queries
+
+
+def r7_worker(seed, results, stop, strategy_name="descent", chains=None,
+              walk_samples=0, schedule_name="fixed", warm_share=None,
+              state=None, checkpoints=None, metrics_filename=None,
+              metrics_interval=10):
+    """
+    Runs round 7 restarts until told to stop
+    Every finished restart is sent back as (seed, outcome, loss, r7_est),
+    and after each zero-loss one, walk_samples results walked to from it
+    (see feasible_walk.py) with outcome "WALKED"
+    warm_share (float): share of restarts started near the best states
+        this worker has found (r7_backtab.warm_share if None)
+    state (dict): r7_backtab.job_state to carry on from, if resuming
+    checkpoints (Value): bumped by the parent to ask for this worker's
+        job_state, sent back between restarts with outcome "CHECKPOINT"
+    """
+    random.seed(seed)
+    metrics.configure(metrics_filename, metrics_interval,
+                      f"round 7 worker {seed}")
+    strategy = make_strategy(strategy_name)
+    cache = StateCache(r7_backtab.cache_size)
+    teams, r7_rooms, r8_rooms, known, r8_loss = r7_backtab.initialise(
+        r7_backtab.initialise_directory)
+    r7_est = np.zeros(len(teams), dtype=np.int64)
+    r8_state = DrawState(r8_loss, known + r7_est)
+    allowed = r7_backtab.prune_rooms(known, r7_rooms, r8_rooms)
+    walk = FeasibleWalk(known, r7_rooms, r8_state, r7_backtab.qualifier_loss,
+                        allowed)
+    schedule = make_schedule(schedule_name, r7_backtab.max_search_len,
+                             r7_backtab.cutoff_point,
+                             r7_backtab.cutoff_threshold)
+    elites = r7_backtab.make_elites(r7_rooms, allowed)
+    if state is not None:
+        strategy, schedule, cache, elites, _ = r7_backtab.restore_job(
+            state, r7_rooms)
+    if warm_share is not None:
+        elites.warm_share = warm_share
+    answered = checkpoints.value if checkpoints is not None else 0
+    for outcome, loss in r7_backtab.restarts(known, r7_est, r8_state,
+                                             r7_rooms, r8_loss, strategy,
+                                             False, cache, allowed, chains,
+                                             schedule, elites):
+        results.put((seed, outcome, sum(loss), r7_est.tolist(), None))
+        if outcome == "ACHIEVED":
+            for _ in walk.samples(r7_est, walk_samples,
+                                  r7_backtab.walk_thin):
+                results.put((seed, "WALKED", sum(loss), r7_est.tolist(),
+                             None))
+        if checkpoints is not None and checkpoints.value > answered:
+            answered = checkpoints.value
+            results.put((seed, "CHECKPOINT", None, r7_backtab.job_state(
+                r7_rooms, strategy, schedule, cache, elites), None))
+        if stop.is_set():
+            break
+    metrics.write()
+
+
+def r8_worker(seed, results, stop, strategy_name="descent", joint=False,
+              schedule_name="fixed", warm_share=None, state=None,
+              checkpoints=None, metrics_filename=None, metrics_interval=10):
+    """
+    Runs round 8 restarts until told to stop
+    Every finished restart is sent back as
+    (seed, outcome, loss, r7_est, r8_est)
+    warm_share, state, checkpoints: as for r7_worker, with r8_backtab
+    """
+    random.seed(seed)
+    metrics.configure(metrics_filename, metrics_interval,
+                      f"round 8 worker {seed}")
+    strategy = make_strategy(strategy_name)
+    cache = StateCache(r8_backtab.cache_size)
+    teams, r7_rooms, r8_rooms, r9_rooms, known, r8_loss, r9_loss = (
+        r8_backtab.initialise(r8_backtab.initialise_directory))
+    r8_backtab.set_r7_options(teams, r7_rooms, joint)
+    r8_backtab.prune_options(known, r7_rooms, r8_rooms, r9_rooms)
+    r7_est = np.zeros(len(teams), dtype=np.int64)
+    r8_est = np.zeros(len(teams), dtype=np.int64)
+    r8_state = DrawState(r8_loss, known + r7_est)
+    r9_state = DrawState(r9_loss, known + r7_est + r8_est)
+    schedule = make_schedule(schedule_name, r8_backtab.max_search_len,
+                             r8_backtab.cutoff_point,
+                             r8_backtab.cutoff_threshold, "ZERO")
+    elites = r8_backtab.make_elites(r7_rooms, r8_rooms)
+    if state is not None:
+        strategy, schedule, cache, elites, _, _ = r8_backtab.restore_job(
+            state, r7_rooms, r8_rooms)
+    if warm_share is not None:
+        elites.warm_share = warm_share
+    answered = checkpoints.value if checkpoints is not None else 0
+    while not stop.is_set():
+        outcome, loss = r8_backtab.run_restart(
+            known, r7_est, r8_est, r7_rooms, r8_rooms, r8_state, r9_state,
+            strategy, verbose=False, joint=joint, cache=cache,
+            schedule=schedule, elites=elites)
+        results.put((seed, outcome, sum(loss), r7_est.tolist(),
+                     r8_est.tolist()))
+        if checkpoints is not None and checkpoints.value > answered:
+            answered = checkpoints.value
+            results.put((seed, "CHECKPOINT", None, r8_backtab.job_state(
+                r7_rooms, r8_rooms, strategy, schedule, cache, elites),
+                None))
+    metrics.write()
+
+
+def save_result(round_num, teams, stores, result):
+    """
+    The parent is the only process that writes files, so there are no
+    races between workers
+    stores (dict): the ResultsStore ("r7") or the SimStores ("expire",
+        "zero") being written to
+    Returns the name of the store the result was saved to, or None if it
+    wasn't saved as a simulation
+    """
+    _, outcome, loss, r7_est, r8_est = result
+    metrics.count("results_received")
+    if round_num == 7:
+        if outcome not in ("ACHIEVED", "WALKED"):
+            return None
+        r7_backtab.save_sample(stores["r7"], teams, np.array(r7_est),
+                               r7_backtab.output_filename)
+        return "r7"
+    if outcome == "ZERO":
+        r8_backtab.print_zero(stores["zero"], r7_est, r8_est)
+        return "zero"
+    if outcome == "EXPIRED":
+        r8_backtab.expire_save(stores["expire"], r7_est, r8_est, loss)
+        return "expire"
+    return None
+
+
+def run(round_num, num_workers, max_sims=None, max_seconds=None,
+        base_seed=0, strategy_name="descent", joint=False, settle=True,
+        metrics_filename=None, metrics_interval=10, quiet=False,
+        chains=None, walk_samples=None, schedule_name="fixed",
+        checkpoint_filename=None, checkpoint_interval=300, resume=False,
+        warm_share=None, serve_address=None):
+    """
+    Starts the workers and aggregates their results until a budget runs
+    out or, if settle, the marginals settle (or forever, if neither)
+    Convergence settings come from the round script's stop_width,
+    stable_window and stable_tolerance; round 8 tracks r8 results
+    Budgets are checked as results come in, so a run can overshoot by at
+    most one restart per worker: restarts already finished are still saved
+    Given a metrics_filename, the parent and every worker append their
+    counters and timers to it (each line labelled with who wrote it)
+    quiet (bool): only print the final summary
+    chains (int): round 7 only, restarts each worker runs side by side
+        (round_7_backtab.num_chains if None)
+    walk_samples (int): round 7 only, samples walked to from each
+        zero-loss result (round_7_backtab.walk_samples if None); these
+        count as sims but not restarts
+    schedule_name (str): when workers give up on a restart, see
+        schedules.py; each worker learns its own
+    warm_share (float): share of restarts started near the best states
+        found so far (see elites.py), the round script's warm_share if
+        None; each worker keeps its own elites
+    checkpoint_filename (str): every checkpoint_interval seconds, and at
+        the end, the whole job (stores, counts, budgets used, and each
+        worker's job_state, keyed by seed) is saved here; with resume, the
+        run carries on from it, stores going back to the checkpoint (so
+        they must not be shared with another run in the meantime, as
+        whatever it added is dropped)
+    Budgets (max_sims, max_seconds) are for the whole job, resumes
+    included, not for each run: to carry on past one, raise it
+    Worker n resumes the state of seed base_seed + n, so the worker count
+    can change: extra workers start afresh and states of seeds no longer
+    running are kept for later
+    serve_address (int or str): a port or Unix socket to answer queries
+        on (marginals, counts, throughput, convergence) from what the
+        parent holds in memory, see live_server.py
+    """
+    metrics.configure(metrics_filename, metrics_interval, "parent")
+    backtab = r7_backtab if round_num == 7 else r8_backtab
+    if round_num == 7:
+        teams = r7_backtab.initialise(r7_backtab.initialise_directory)[0]
+        stores = {"r7": r7_backtab.open_store(list(teams))}
+        target = r7_worker
+        if walk_samples is None:
+            walk_samples = r7_backtab.walk_samples
+        worker_kwargs = {"strategy_name": strategy_name, "chains": chains,
+                         "walk_samples": walk_samples,
+                         "schedule_name": schedule_name,
+                         "warm_share": warm_share}
+    else:
+        teams = r8_backtab.initialise(r8_backtab.initialise_directory)[0]
+        stores = {
+            "expire": SimStore(r8_backtab.expire_filename, list(teams)),
+            "zero": SimStore(r8_backtab.zero_filename, list(teams)),
+        }
+        target = r8_worker
+        worker_kwargs = {"strategy_name": strategy_name, "joint": joint,
+                         "schedule_name": schedule_name,
+                         "warm_share": warm_share}
+    convergence = Convergence(list(teams), backtab.stop_width,
+                              backtab.stable_window, backtab.stable_tolerance)
+    r8_counts = np.zeros((len(teams), 4), dtype=np.int64)
+    restarts, sims, elapsed = 0, 0, 0.0
+    worker_states = {} # seed: job_state, from the last checkpoint
+
+    checkpointer = Checkpointer(checkpoint_filename, checkpoint_interval)
+    state = checkpointer.load() if resume else None
+    if state is not None:
+        if state["round"] != round_num:
+            raise ValueError(f"{checkpoint_filename} is a round "
+                             f"{state['round']} checkpoint")
+        if round_num == 7:
+            dropped = stores["r7"].restore(state["stores"]["r7"])
+            if dropped:
+                print(f"Dropped {dropped} samples stored after the "
+                      f"checkpoint")
+            stores["r7"].export(r7_backtab.output_filename,
+                                overwrite=True)
+        else:
+            for name, num_sims in state["stores"].items():
+                stores[name].truncate(num_sims)
+        convergence = state["convergence"]
+        r8_counts = state["r8_counts"]
+        restarts, sims, elapsed = (state["restarts"], state["sims"],
+                                   state["seconds"])
+        worker_states = state["workers"]
+        print(f"Resumed from {checkpoint_filename}: {restarts} restarts, "
+              f"{sims} sims, {elapsed:.0f}s")
+        if ((max_sims is not None and sims >= max_sims)
+                or (max_seconds is not None and elapsed >= max_seconds)):
+            print("The budget is for the whole job and is already used "
+                  "up; raise --sims or --seconds to carry on")
+    first_sims = sims # the export at the end is skipped if none are added
+
+    # Marginals kept in memory from here on: round 7 starts from what the
+    # store holds, round 8 from the r8 counts (as before, only this job's)
+    if round_num == 7:
+        counts, samples = stores["r7"].snapshot()
+        counts = np.array(list(counts.values()), dtype=np.int64)
+        live = live_server.LiveResults(list(teams), 7, counts, samples,
+                                       convergence, restarts, elapsed)
+        live.seen("r7", stores["r7"].fingerprints(), samples)
+    else:
+        live = live_server.LiveResults(list(teams), 8, r8_counts,
+                                       int(r8_counts[0].sum()), convergence,
+                                       restarts, elapsed)
+        for name, store in stores.items():
+            stored = store.read()
+            live.seen(name, {fingerprint(sim["r7"], sim["r8"])
+                             for sim in stored}, len(stored))
+    server = None
+    if serve_address is not None:
+        server = live_server.serve(live, serve_address)
+        print(f"Serving live results: {live_server.describe(server)}")
+
+    results = mp.Queue()
+    stop = mp.Event()
+    checkpoints = mp.Value("i", 0)
+    workers = [
+        mp.Process(target=target, args=(base_seed + n, results, stop),
+                   kwargs=dict(worker_kwargs,
+                               state=worker_states.get(base_seed + n),
+                               checkpoints=checkpoints,
+                               metrics_filename=metrics_filename,
+                               metrics_interval=metrics_interval))
+        for n in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    seeds = [base_seed + n for n in range(num_workers)]
+
+    collecting = None # worker states sent back for the checkpoint under way
+    held = [] # results from workers that have sent theirs, saved after it
+
+    def write_checkpoint():
+        """
+        Saves the job once every running worker has sent its state, so
+        the stores hold exactly the results sent before those states
+        """
+        if round_num == 7:
+            store_state = {"r7": stores["r7"].state()}
+        else:
+            store_state = {name: len(store) for name, store in stores.items()}
+        worker_states.update(collecting)
+        with metrics.timer("checkpoint"):
+            checkpointer.save({
+                "round": round_num,
+                "stores": store_state,
+                "convergence": convergence,
+                "r8_counts": r8_counts.copy(),
+                "restarts": restarts,
+                "sims": sims,
+                "seconds": time.time() - start,
+                "workers": worker_states,
+            })
+
+    def checkpoint_complete():
+        return all(seed in collecting for seed, worker in zip(seeds, workers)
+                   if worker.is_alive())
+
+    def take(result):
+        """
+        Saves one result, returning True if it was a sim
+        """
+        nonlocal restarts, sims
+        _, outcome, _, r7_est, r8_est = result
+        if outcome != "WALKED":
+            restarts += 1
+            live.add_restart()
+        kind = save_result(round_num, teams, stores, result)
+        if kind is None:
+            return False
+        sims += 1
+        if round_num == 7:
+            live.add(kind, r7_est, fingerprint(r7_est))
+        else:
+            live.add(kind, r8_est, fingerprint(r7_est, r8_est))
+        return True
+
+    start = time.time() - elapsed
+    try:
+        while any(worker.is_alive() for worker in workers):
+            if max_sims is not None and sims >= max_sims:
+                break
+            if max_seconds is not None and time.time() - start > max_seconds:
+                break
+            if collecting is None and checkpointer.due():
+                collecting = {}
+                checkpointer.last = time.time()
+                checkpoints.value += 1
+            if collecting is not None and checkpoint_complete():
+                write_checkpoint()
+                collecting = None
+                for result in held:
+                    take(result)
+                held = []
+                continue
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                continue
+            if result[1] == "CHECKPOINT":
+                if collecting is not None:
+                    collecting[result[0]] = result[3]
+                continue
+            if collecting is not None and result[0] in collecting:
+                held.append(result)
+                continue
+            saved = take(result)
+            metrics.tick()
+            if not quiet:
+                print(f"{restarts} restarts, {sims} sims "
+                      f"({time.time() - start:.0f}s) seed {result[0]}: "
+                      f"{result[1]} {result[2]}")
+            if not (saved and settle):
+                continue
+            if not quiet:
+                print(convergence.report())
+            if not quiet and round_num == 7:
+                print(f"{live.distinct('r7')} distinct solutions")
+            if convergence.converged():
+                print("SETTLED")
+                break
+    finally:
+        # Let workers finish their restart, keeping what they send back,
+        # and have each send its state for a last checkpoint
+        collecting = {}
+        checkpoints.value += 1
+        stop.set()
+        for result in held:
+            take(result)
+        while any(worker.is_alive() for worker in workers):
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                continue
+            if result[1] == "CHECKPOINT":
+                collecting[result[0]] = result[3]
+            else:
+                take(result)
+        while True:
+            try:
+                result = results.get_nowait()
+            except queue.Empty:
+                break
+            if result[1] == "CHECKPOINT":
+                collecting[result[0]] = result[3]
+            else:
+                take(result)
+        for worker in workers:
+            worker.join()
+        if round_num == 7 and sims > first_sims:
+            stores["r7"].export(r7_backtab.output_filename)
+        # Not if a worker died without sending its state (e.g. on Ctrl-C),
+        # as its last saved state would repeat results already stored
+        if checkpointer.filename is not None and all(
+                seed in collecting for seed in seeds):
+            write_checkpoint()
+        metrics.write()
+        if server is not None:
+            live_server.stop(server)
+    print(f"Done: {restarts} restarts, {sims} sims "
+          f"in {time.time() - start:.0f}s")
+    return restarts, sims
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run backtab restarts on several cores at once")
+    parser.add_argument("--round", type=int, default=round_num,
+                        choices=[7, 8])
+    parser.add_argument("--workers", type=int, default=num_workers)
+    parser.add_argument("--sims", type=int, default=max_sims,
+                        help="stop after this many sims in the whole job, "
+                             "counting those before a --resume")
+    parser.add_argument("--seconds", type=float, default=max_seconds,
+                        help="stop after this long in the whole job, "
+                             "counting the time before a --resume")
+    parser.add_argument("--seed", type=int, default=base_seed)
+    parser.add_argument("--strategy", default=strategy_name,
+                        choices=list(strategies))
+    parser.add_argument("--schedule", default=schedule_name,
+                        choices=list(schedules))
+    parser.add_argument("--metrics", default=metrics_filename,
+                        help="append JSONL counters and timers here")
+    parser.add_argument("--metrics-interval", type=float,
+                        default=metrics_interval)
+    parser.add_argument("--quiet", action="store_true",
+                        help="no per-restart output")
+    parser.add_argument("--no-settle", action="store_true",
+                        help="don't stop when the marginals settle")
+    parser.add_argument("--joint", action="store_true",
+                        help="round 8 only: search r7 and r8 together, "
+                             "without a finished round 7 run")
+    parser.add_argument("--chains", type=int, default=None,
+                        help="round 7 only: restarts per worker run side "
+                             "by side as one array")
+    parser.add_argument("--checkpoint", default=checkpoint_filename,
+                        help="save the whole job here now and then")
+    parser.add_argument("--checkpoint-interval", type=float,
+                        default=checkpoint_interval)
+    parser.add_argument("--resume", action="store_true",
+                        help="carry on from --checkpoint; the result "
+                             "stores go back to it, so mustn't be shared "
+                             "with another run")
+    parser.add_argument("--walk", type=int, default=None,
+                        help="round 7 only: samples walked to from each "
+                             "zero-loss result")
+    parser.add_argument("--serve", default=serve_address,
+                        help="answer live queries on this port, or Unix "
+                             "socket path, see live_server.py")
+    parser.add_argument("--warm-share", type=float, default=None,
+                        help="share of restarts started near the best "
+                             "states found so far, see elites.py")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(args.round, args.workers, args.sims, args.seconds, args.seed,
+        args.strategy, args.joint, not args.no_settle, args.metrics,
+        args.metrics_interval, args.quiet, args.chains, args.walk,
+        args.schedule, args.checkpoint, args.checkpoint_interval,
+        args.resume, args.warm_share, args.serve)
@@ -0,0 +1,299 @@
+import argparse
+import csv
+import os
+import sqlite3
+
+places = [0, 1, 2, 3]
+
+
+def format_table(counts, samples):
+    """
+    A marginal table in the usual tab-separated format:
+    name, share of samples in each place, sample count
+    counts (dict): key is team name, value is a list of counts per place
+    """
+    lines = ["\t".join(["name"] + [str(p) for p in places] + ["count"])]
+    for team, team_counts in counts.items():
+        shares = [count / samples if samples else 0.0
+                  for count in team_counts]
+        lines.append("\t".join([team] + [str(share) for share in shares]
+                               + [str(samples)]))
+    return "\n".join(lines) + "\n"
+
+
+def write_table(filename, counts, samples):
+    """
+    Write the marginal table (see format_table) to filename
+    Written to a temporary file and moved into place, so anyone reading
+    filename sees either the old table or the new one
+    """
+    temp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temp_filename, "w") as f:
+        f.write(format_table(counts, samples))
+    os.replace(temp_filename, filename)
+
+
+def read_table(filename):
+    """
+    Read a marginal table back, as written by write_table or by the
+    pandas code before it (same columns)
+    Counts are rebuilt from the shares and the sample count
+    Returns (counts, samples) in write_table's form
+    """
+    with open(filename, newline="") as f:
+        header, *rows = [row for row in csv.reader(f, delimiter="\t")
+                         if row]
+    columns = [header.index(str(p)) for p in places]
+    samples = int(float(rows[0][header.index("count")])) if rows else 0
+    counts = {row[0]: [round(float(row[c]) * samples) for c in columns]
+              for row in rows}
+    return counts, samples
+
+
+class ResultsStore:
+    """
+    Integer counts per (team, round, place) in an SQLite database
+    Runs in WAL mode and each sample is one transaction, so any number of
+    processes can add samples to the same file without losing updates,
+    and readers never see half a sample
+    Samples given a fingerprint are also counted once per distinct
+    solution, in distinct_count, alongside the plain sample frequency
+    """
+    def __init__(self, filename, names=None):
+        """
+        filename (str): the database file, made if it doesn't exist
+        names (list): team names, in the order the export should use
+        """
+        self.filename = filename
+        self.conn = sqlite3.connect(filename, timeout=60,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS counts ("
+            "team TEXT, round INTEGER, place INTEGER, "
+            "count INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (team, round, place))")
+        columns = [row[1] for row in
+                   self.conn.execute("PRAGMA table_info(counts)")]
+        if "distinct_count" not in columns: # made before distinct counts
+            self.conn.execute(
+                "ALTER TABLE counts ADD COLUMN "
+                "distinct_count INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS solutions ("
+            "fingerprint BLOB, round INTEGER, "
+            "count INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (fingerprint, round))")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta ("
+            "key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO meta VALUES (?, 0)",
+            [("samples",), ("distinct",)])
+        if names is not None:
+            self.register(names)
+
+    def register(self, names, round=7):
+        """
+        Make zero rows for every team, so the export keeps standings order
+        and lists teams that haven't placed yet
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO counts (team, round, place) "
+            "VALUES (?, ?, ?)",
+            [(name, round, place) for name in names for place in places])
+        self.conn.execute("COMMIT")
+
+    def add_sample(self, names, results, round=7, fingerprint=None):
+        """
+        Record one simulation: team names[i] got place results[i]
+        fingerprint (bytes): identifies the solution (see state_cache),
+            so that a repeat adds to count but not to distinct_count
+        Returns the number of samples stored, this one included
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            new = 0
+            if fingerprint is not None:
+                new = self.conn.execute(
+                    "INSERT OR IGNORE INTO solutions VALUES (?, ?, 0)",
+                    (fingerprint, round)).rowcount
+                self.conn.execute(
+                    "UPDATE solutions SET count = count + 1 "
+                    "WHERE fingerprint = ? AND round = ?",
+                    (fingerprint, round))
+            self.conn.executemany(
+                "INSERT INTO counts VALUES (?, ?, ?, 1, ?) "
+                "ON CONFLICT (team, round, place) "
+                "DO UPDATE SET count = count + 1, "
+                "distinct_count = distinct_count + excluded.distinct_count",
+                [(name, round, int(result), new)
+                 for name, result in zip(names, results)])
+            self.conn.execute(
+                "UPDATE meta SET value = value + 1 WHERE key = 'samples'")
+            self.conn.execute(
+                "UPDATE meta SET value = value + ? WHERE key = 'distinct'",
+                (new,))
+            samples = self.samples()
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return samples
+
+    def samples(self):
+        return self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'samples'").fetchone()[0]
+
+    def distinct(self):
+        """
+        Number of distinct solutions among the fingerprinted samples
+        """
+        return self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'distinct'").fetchone()[0]
+
+    def fingerprints(self, round=7):
+        """
+        The fingerprints of every distinct solution stored
+        """
+        return [row[0] for row in self.conn.execute(
+            "SELECT fingerprint FROM solutions WHERE round = ?", (round,))]
+
+    def counts(self, round=7, distinct=False):
+        """
+        Returns a dict, key is team name, value is a list of counts per
+        place, in registration order
+        distinct (bool): count each distinct solution once, rather than
+            every sample
+        """
+        column = "distinct_count" if distinct else "count"
+        counts = {}
+        rows = self.conn.execute(
+            f"SELECT team, place, {column} FROM counts WHERE round = ? "
+            "ORDER BY rowid", (round,))
+        for team, place, count in rows:
+            counts.setdefault(team, [0] * len(places))[place] = count
+        return counts
+
+    def snapshot(self, round=7, distinct=False):
+        """
+        Returns (counts, samples) read together, so they agree even while
+        other processes are adding samples
+        With distinct, samples is the number of distinct solutions
+        """
+        self.conn.execute("BEGIN")
+        counts = self.counts(round, distinct)
+        samples = self.distinct() if distinct else self.samples()
+        self.conn.execute("COMMIT")
+        return counts, samples
+
+    def import_table(self, filename, round=7, if_empty=False):
+        """
+        Add the samples in a marginal table the store didn't write (e.g.
+        one from before there was a store), so its exports carry on from
+        them rather than overwrite them
+        Their solutions aren't known, so distinct counts are left alone
+        if_empty (bool): only if the store holds no samples yet, checked
+            in the same transaction, so of several processes opening a
+            new store at once exactly one imports the table
+        Returns the number of samples added
+        """
+        counts, samples = read_table(filename)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if if_empty and self.samples() > 0:
+                self.conn.execute("COMMIT")
+                return 0
+            self.conn.executemany(
+                "INSERT INTO counts VALUES (?, ?, ?, ?, 0) "
+                "ON CONFLICT (team, round, place) "
+                "DO UPDATE SET count = count + excluded.count",
+                [(name, round, place, count)
+                 for name, team_counts in counts.items()
+                 for place, count in zip(places, team_counts)])
+            self.conn.execute(
+                "UPDATE meta SET value = value + ? WHERE key = 'samples'",
+                (samples,))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return samples
+
+    def export(self, filename, round=7, distinct=False, overwrite=False):
+        """
+        Write the marginal table for the stored samples, see write_table
+        Refuses (ValueError) to replace a table over more samples than the
+        store holds, as those would be lost; see import_table
+        overwrite (bool): replace it anyway, e.g. after going back to a
+            checkpoint taken before the table was written
+        """
+        counts, samples = self.snapshot(round, distinct)
+        if not overwrite and os.path.exists(filename):
+            _, existing = read_table(filename)
+            if existing > samples:
+                raise ValueError(
+                    f"{filename} has {existing} samples and {self.filename} "
+                    f"only {samples}, import it first")
+        write_table(filename, counts, samples)
+
+    def state(self):
+        """
+        Everything in the store (counts, distinct solutions and totals) as
+        one dict, read together, e.g. for a checkpoint
+        """
+        self.conn.execute("BEGIN")
+        state = {table: self.conn.execute(
+                     f"SELECT * FROM {table} ORDER BY rowid").fetchall()
+                 for table in ["counts", "solutions", "meta"]}
+        self.conn.execute("COMMIT")
+        return state
+
+    def restore(self, state):
+        """
+        Put the store back as it was when state was taken, dropping any
+        samples added since, by anyone: only safe if nothing else has
+        written to it since state was taken, nor is writing now
+        Returns the number of samples dropped
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = self.samples()
+            for table, rows in state.items():
+                self.conn.execute(f"DELETE FROM {table}")
+                if rows:
+                    marks = ", ".join("?" * len(rows[0]))
+                    self.conn.executemany(
+                        f"INSERT INTO {table} VALUES ({marks})", rows)
+            dropped = before - self.samples()
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return dropped
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export a results database as a marginal table")
+    parser.add_argument("database")
+    parser.add_argument("output")
+    parser.add_argument("--round", type=int, default=7)
+    parser.add_argument("--distinct", action="store_true",
+                        help="count each distinct solution once")
+    parser.add_argument("--import", dest="import_table", action="store_true",
+                        help="first add the samples in an existing output "
+                             "table to the database")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="replace an output table over more samples")
+    args = parser.parse_args()
+    store = ResultsStore(args.database)
+    if args.import_table:
+        print(f"Imported {store.import_table(args.output, args.round)} "
+              f"samples from {args.output}")
+    store.export(args.output, args.round, args.distinct, args.overwrite)
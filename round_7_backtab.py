@@ -1,6 +1,19 @@
-import pandas as pd
+import numpy as np
 import random
-from itertools import permutations
+import os
+import domains
+from checkpoint import Checkpointer
+from convergence import Convergence
+from elites import ElitePool
+from feasible_walk import FeasibleWalk
+from loss_engine import DrawLoss, DrawState, orders
+from multi_chain import MultiChain
+from results_store import ResultsStore
+from schedules import make_schedule
+from snapshot import load_snapshot
+from state_cache import StateCache, fingerprint
+from strategies import make_strategy
+from telemetry import metrics
 
 # CONFIG
 year = 2025
@@ -10,225 +23,418 @@ cutoff_threshold = 25
 cutoff_point = 20
 initialise_directory = f"data/{year}"
 output_filename = f"output_{year}.txt"
+results_filename = f"results_{year}.db"
+export_every = 10 # rewrite output_filename after this many samples
+strategy_name = "descent" # or "annealing" or "tabu", see strategies.py
+schedule_name = "fixed" # or "luby" or "learned" cutoffs, see schedules.py
+stop_width = 0.1 # stop once every marginal's interval is this narrow
+stable_window = 500 # or once no marginal has moved much in this many
+stable_tolerance = 0.01 # samples (None for either to not stop that way)
+cache_size = 100000 # states remembered to stop repeat restarts early
+quiet = False # True for no per-sweep or per-restart console output
+metrics_filename = None # e.g. f"metrics_{year}.jsonl" for timings
+metrics_interval = 10 # seconds between lines in metrics_filename
+prune_orders = True # rule out impossible orders first, see domains.py
+num_chains = 1 # restarts run side by side as one array, see multi_chain.py
+walk_samples = 0 # further samples per zero-loss restart, by a random walk
+walk_thin = 20 # through zero-loss results taking this many moves a sample
+elite_size = 20 # best distinct states kept to start restarts near
+warm_share = 0.0 # share of restarts started near them, see elites.py
+elite_max_loss = 0 # only near those with at most this loss (None for any)
+checkpoint_filename = f"checkpoint_r7_{year}.ckpt" # None for no checkpoints
+checkpoint_interval = 300 # seconds between checkpoints
+resume = False # carry on from checkpoint_filename rather than start afresh
 
 
-orders = [order for order in permutations([0, 1, 2, 3])]
-
 class Team:
-    def __init__(self, name, known):
+    __slots__ = ("name", "known", "index", "r7_room", "r8_room")
+
+    def __init__(self, name, known, index):
         self.name = name
         self.known = known
-        self.r7_est = 0
+        self.index = index # position in the points/estimate arrays
         self.r7_room = None # a room here is just a list of four teams
         self.r8_room = None
 
 
 def initialise(directory):
     """
-    Returns three things:
+    Returns five things:
     1. teams (dict): Team objects, key is name
     2. r7_rooms (list): list of rooms, rooms being a list of four Teams
     3. r8_rooms (list): same as r7_rooms, but for round 8
+    4. known (array): post-r6 points, indexed by team.index
+    5. r8_loss (DrawLoss): loss bookkeeping for the r8 draw
+    The text files are read through a binary snapshot (see snapshot.py),
+    made the first time and whenever they change
     """
     # Make the teams
-    standings = pd.read_csv(f"{directory}/standings.txt", sep="\t")
+    snapshot = load_snapshot(directory)
     teams = {}
-    for _, row in standings.iterrows():
-        teams[row["team"]] = Team(row["team"], row["points"])
+    for name, points in zip(snapshot["names"], snapshot["points"]):
+        teams[name] = Team(name, int(points), len(teams))
+    team_list = list(teams.values())
+    known = snapshot["points"].copy()
 
     # Then get r7 info
-    r7_draw = pd.read_csv(f"{directory}/r7_draw.txt", sep="\t")
     r7_rooms = []
-    for _, row in r7_draw.iterrows():
-        room = [teams[name] for name in row]
+    for row in snapshot["r7"]:
+        room = [team_list[i] for i in row]
         r7_rooms.append(room)
         for team in room:
             team.r7_room = room
 
     # Then get r8 info
-    r8_draw = pd.read_csv(f"{directory}/r8_draw.txt", sep="\t")
     r8_rooms = []
-    for _, row in r8_draw.iterrows():
-        room = [teams[name] for name in row]
+    for row in snapshot["r8"]:
+        room = [team_list[i] for i in row]
         r8_rooms.append(room)
         for team in room:
             team.r8_room = room
+    r8_loss = DrawLoss([[t.index for t in room] for room in r8_rooms],
+                       len(teams))
+
+    return teams, r7_rooms, r8_rooms, known, r8_loss
 
-    reset_team_results(teams, r7_rooms)
 
-    return teams, r7_rooms, r8_rooms
+def prune_rooms(known, r7_rooms, r8_rooms):
+    """
+    Works out once, from the draws alone, which orders each r7 room can
+    take in a zero-loss result (see domains.py)
+    Returns a dict with key the room's team indices as a tuple, value the
+    orders left to it, or None if prune_orders is off
+    """
+    if not prune_orders:
+        return None
+    r7_ok, _ = domains.prune(known, [[t.index for t in room]
+                                     for room in r7_rooms],
+                             [[t.index for t in room] for room in r8_rooms])
+    return {tuple(t.index for t in room): orders[ok]
+            for room, ok in zip(r7_rooms, r7_ok)}
 
 
-def reset_team_results(teams, r7_rooms):
+def reset_team_results(r7_est, r7_rooms, allowed=None):
     """
     For each r7 room, assign a random result
     If a team isn't in an r7 room, give it a 0
+    allowed (dict): orders left to each room (see prune_rooms), so rooms
+        with only one are locked in here
     """
     # Teams that miss r7 get 0
-    for team in teams.values():
-        if team.r7_room is None:
-            team.r7_est = 0
+    r7_est[:] = 0
 
     # Choose a random result per room
     for room in r7_rooms:
-        for team, result in zip(room, random.choice(orders)):
-            team.r7_est = result
-
-
-def choose_order_for_r7_room(teams, r7_rooms, r8_rooms, r7_room):
-    """
-    Runs through each room
-    For each possible order, calculates the loss
-    Assigns the order with the lowest loss
-    """
-    team_r8_room = [team.r8_room for team in r7_room
-                    if team.r8_room is not None]
-        # A list of which r8_rooms the teams end up in
-    scores_outside_room = []
-        # A list, one element for each room
-        # That element is a Series of every team score outside that room
-    for room in team_r8_room:
-        if room is None:
-            scores_outside_room.append(None)
-        else:
-            scores = pd.Series([t.known + t.r7_est
-                                for t in teams.values()
-                                if t not in r7_room
-                                and t.r8_room is not None])
-            scores_outside_room.append(scores)
-
-    best_score = 10**10
-    best_order = None
-    random.shuffle(orders)
-    for order in orders:
-        for team, result in zip(r7_room, order):
-            team.r7_est = result
-
-        # Get OOB loss: num of teams that fall in between room min and max
-        oob_loss = 0
-        iters = zip(r7_room, team_r8_room, scores_outside_room)
-        for team, room, scores in iters:
-            if room is None:
-                continue
-            room_scores = [t.known + t.r7_est for t in room]
-            room_min, room_max = min(room_scores), max(room_scores)
-            oob_loss += ((scores > room_min) & (scores < room_max)).sum()
-
-        # Get pullup loss: +1 for each pullup over 4
-        pullup_dict = dict(zip(range(28), [0]*28))
-        for room in r8_rooms:
-            room_max = max([t.known + t.r7_est for t in room])
-            for team in room:
-                team_points = team.known + team.r7_est
-                if team_points < room_max:
-                    pullup_dict[team_points] += 1
-        pullup_loss = sum([max(0, val - 3) for val in pullup_dict.values()])
-
-        total_loss = oob_loss + pullup_loss
-        if total_loss < best_score:
-            best_score = total_loss
-            best_order = order
-
-    for team, result in zip(r7_room, best_order):
-        team.r7_est = result
-
-
-def global_objective_function(teams, r8_rooms):
+        options = (orders if allowed is None
+                   else allowed[tuple(t.index for t in room)])
+        order = random.choice(options)
+        for team, result in zip(room, order):
+            r7_est[team.index] = result
+
+
+def make_elites(r7_rooms, allowed=None):
+    """
+    The ElitePool (see elites.py) of elite_size states that restarts start
+    near warm_share of the time, if their loss is at most elite_max_loss
+    Made before the rooms are first shuffled
+    allowed (dict): orders left to each room, see prune_rooms
+    """
+    rooms = []
+    for room in r7_rooms:
+        ids = tuple(team.index for team in room)
+        rooms.append((0, ids, orders if allowed is None else allowed[ids]))
+    return ElitePool(rooms, elite_size, warm_share=warm_share,
+                     max_loss=elite_max_loss)
+
+
+def choose_order_for_r7_room(known, r7_est, r8_state, r7_room, strategy,
+                             allowed=None):
+    """
+    Scores the change in loss for every possible order in one batch
+    The strategy picks which to assign: for descent, the lowest loss, ties
+    broken at random
+    r8_state (DrawState): running r8 totals, moved along with the room
+    allowed (dict): orders left to each room (see prune_rooms); only those
+        are scored, and a room with one left is skipped
+    """
+    team_ids = [team.index for team in r7_room]
+    options = orders if allowed is None else allowed[tuple(team_ids)]
+    if len(options) == 1:
+        return # locked in by reset_team_results
+    candidates = known[team_ids] + options
+    with metrics.timer("order_scoring"):
+        oob_delta, pullup_delta = r8_state.batch_delta(team_ids, candidates)
+        current = np.flatnonzero((options == r7_est[team_ids]).all(axis=1))
+        best = strategy.choose(tuple(team_ids), oob_delta + pullup_delta,
+                               int(current[0]) if len(current) else None)
+    metrics.count("rooms_scored")
+    metrics.count("orders_scored", len(candidates))
+    r7_est[team_ids] = options[best]
+    with metrics.timer("move"):
+        r8_state.move(team_ids, candidates[best])
+
+
+def global_objective_function(r8_state):
     """
     This calculates oob loss and pullup loss across ALL teams
     When this is zero (i.e., a possible r7 result has been found)
     the programme will print to file and go on running simulations
+    The totals are kept up to date by r8_state, so this is just a read
     """
-    oob_loss = 0
-    post_r7_scores = [team.known + team.r7_est for team in teams.values()
-                    if team.r8_room is not None]
-    for room in r8_rooms:
-        other_scores = [i for i in post_r7_scores]
-        room_scores = [team.known + team.r7_est for team in room]
-        for room_score in room_scores:
-            other_scores.remove(room_score)
-        scores = pd.Series(other_scores)
-        room_min, room_max = min(room_scores), max(room_scores)
-        oob_loss += ((scores > room_min) & (scores < room_max)).sum()
-
-    pullup_loss = 0
-    pullup_dict = dict(zip(range(28), [0]*28))
-    for room in r8_rooms:
-        room_scores = [team.known + team.r7_est for team in room]
-        room_max = max(room_scores)
-        for team in room:
-            if team.known + team.r7_est < room_max:
-                pullup_dict[team.known + team.r7_est] += 1
-    pullup_loss = sum([max(0, val - 3) for val in pullup_dict.values()])
-    return oob_loss, pullup_loss
+    with metrics.timer("global_loss"):
+        return r8_state.loss()
+
+
+def open_store(names):
+    """
+    The results store in results_filename; a new one first takes in the
+    samples already in output_filename (e.g. from before there was a
+    store), so its exports add to that table rather than replace it
+    """
+    store = ResultsStore(results_filename, names)
+    if store.samples() == 0 and os.path.exists(output_filename):
+        imported = store.import_table(output_filename, if_empty=True)
+        if imported:
+            print(f"Imported {imported} samples from {output_filename} "
+                  f"into {results_filename}")
+    return store
 
 
-def make_blank_file(teams, filename):
+def save_sample(store, teams, r7_est, filename):
     """
-    Makes the output file
-    Want to do this only for the FIRST instance of backtab you launch
+    Adds a new simulation to the results store, which keeps integer counts
+    and is safe to share between several programmes at once
+    Every export_every samples the marginal table in filename is rewritten
+    (in one go, never half-written), so as you generate results you can
+    check on how they are going by having a peek at that file
+    Each sample is fingerprinted, so repeats of a solution are counted as
+    samples but not as distinct solutions
+    Returns the number of samples in the store
     """
     names = [team.name for team in teams.values()]
-    df = pd.DataFrame(names, columns=["names"])
-    for header in ["0", "1", "2", "3", "count"]:
-        df[header] = 0
-    open(filename, "w").write(df.to_csv(index=False, sep="\t"))
+    with metrics.timer("file_io"):
+        samples = store.add_sample(names, r7_est.tolist(),
+                                   fingerprint=fingerprint(r7_est))
+        if samples % export_every == 0:
+            store.export(filename)
+    metrics.count("samples_saved")
+    return samples
 
 
-def file_edit(teams, filename):
+def run_restart(known, r7_est, r8_state, r7_rooms, strategy, verbose=True,
+                cache=None, allowed=None, schedule=None, elites=None):
     """
-    Opens the file, edits it to add a new simulation, closes it
-    This means as you generate results, you can check on how they are going
-    by going to that file and having a peek, without interrupting the
-    programme at all
-    Also you can run multiple of this programme in the same directory
-    and the odds of them both editing the file and the same time are very
-    small, so you can speed up result generation ~4x
+    One full run of the search from a fresh random start, or a warm one
+    Returns (outcome, loss), outcome being "ACHIEVED", "CUTOFF FAILED",
+    "EXPIRED" or "KNOWN DEAD END"; on "ACHIEVED" r7_est holds the
+    accepted result
+    The outcome and number of sweeps are added to strategy.stats
+    cache (StateCache): states from earlier restarts; reaching one stops
+        the restart early, with the solution it led to or as a dead end
+    allowed (dict): orders left to each room, see prune_rooms
+    schedule (FixedSchedule): how long to go on and when to cut (see
+        schedules.py), max_search_len and the cutoffs above if None
+    elites (ElitePool): the best states so far, to start near now and
+        then (see make_elites), offered where this restart ended
     """
-    for _ in range(2):
-        try:
-            last_results = pd.read_csv(filename, sep="\t", index_col=0)
+    if schedule is None:
+        schedule = make_schedule("fixed", max_search_len, cutoff_point,
+                                 cutoff_threshold)
+    budget = schedule.start()
+    if elites is None or elites.start(r7_est, states=(r8_state,)) is None:
+        reset_team_results(r7_est, r7_rooms, allowed)
+        r8_state.reset(known + r7_est)
+    else:
+        r8_state.update(known + r7_est)
+    strategy.start()
+    path = []
+    for j in range(budget.limit):
+        if verbose: print(f"Iteration {j+1}")
+        strategy.start_sweep(j)
+        random.shuffle(r7_rooms)
+        for r7_room in r7_rooms:
+            choose_order_for_r7_room(known, r7_est, r8_state, r7_room,
+                                     strategy, allowed)
+        loss = global_objective_function(r8_state)
+        if verbose: print(f"\t{sum(loss)} ({loss})")
+        cut = schedule.check(budget, sum(loss))
+        if sum(loss) <= qualifier_loss:
+            outcome = "ACHIEVED"
             break
-        except FileNotFoundError:
-            make_blank_file(teams, filename)
-    count = last_results["count"].iloc[0]
-    last_results *= count
-    for team in teams.values():
-        last_results.loc[team.name, f"{team.r7_est}"] += 1
-    last_results /= count + 1
-    last_results["count"] = count + 1
-    open(filename, "w").write(last_results.to_csv(sep="\t"))
+        if cut:
+            outcome = "CUTOFF FAILED"
+            break
+        if cache is not None:
+            key = fingerprint(r7_est)
+            seen, solution = cache.lookup(key)
+            if seen and solution is None:
+                outcome = "KNOWN DEAD END"
+                break
+            if seen:
+                r7_est[:] = solution
+                r8_state.reset(known + r7_est)
+                loss = global_objective_function(r8_state)
+                outcome = "ACHIEVED"
+                break
+            path.append(key)
+        outcome = "EXPIRED"
+    if cache is not None:
+        cache.record(path, r7_est.copy() if outcome == "ACHIEVED" else None)
+    if elites is not None:
+        elites.add(sum(loss), r7_est, states=(r8_state,))
+    strategy.finish(outcome, j + 1)
+    schedule.finish(budget, outcome)
+    metrics.count("restarts")
+    metrics.count("sweeps", j + 1)
+    metrics.count(outcome)
+    metrics.tick()
+    if verbose: print(outcome)
+    return outcome, loss
+
+
+def restarts(known, r7_est, r8_state, r7_rooms, r8_loss, strategy,
+             verbose=True, cache=None, allowed=None, chains=None,
+             schedule=None, elites=None):
+    """
+    Runs restarts for as long as the caller keeps asking, yielding
+    (outcome, loss) for each and leaving its result in r7_est
+    One at a time through run_restart, or, if chains is more than one,
+    that many side by side (see multi_chain.py), which gets through many
+    more per second; only descent and annealing can be run that way
+    chains (int): num_chains if None
+    schedule (FixedSchedule): see run_restart, one made from
+        schedule_name if None
+    elites (ElitePool): see run_restart, no warm starts if None
+    """
+    if chains is None:
+        chains = num_chains
+    if schedule is None:
+        schedule = make_schedule(schedule_name, max_search_len, cutoff_point,
+                                 cutoff_threshold)
+    if chains > 1:
+        engine = MultiChain(known, r7_rooms, r8_loss, chains, strategy,
+                            schedule, qualifier_loss, cache, allowed, elites)
+        for outcome, loss, result in engine.restarts():
+            r7_est[:] = result
+            if verbose: print(f"{outcome} ({sum(loss)})")
+            yield outcome, loss
+        return
+    i = 0
+    while True:
+        if verbose:
+            top = "*" * (13 + len(str(i+1)))
+            print(f"{top}\n* FULL RUN {i+1} *\n{top}")
+        yield run_restart(known, r7_est, r8_state, r7_rooms, strategy,
+                          verbose, cache, allowed, schedule, elites)
+        i += 1
 
 
-def do_sims():
+def job_state(r7_rooms, strategy, schedule, cache, elites=None,
+              convergence=None, store=None):
+    """
+    Everything a run needs to carry on exactly from here (see
+    checkpoint.py): random state, room order, the strategy, schedule,
+    cache and elites, and, for the process keeping the results, the convergence
+    tracker and the stored counts and solutions
     """
-    Run simulations over and over and over
-    Can run multiple ones and they will all output to the same file
+    return {
+        "random": random.getstate(),
+        "room_order": [room[0].index for room in r7_rooms],
+        "strategy": strategy,
+        "schedule": schedule,
+        "cache": cache,
+        "elites": elites,
+        "convergence": convergence,
+        "store": None if store is None else store.state(),
+    }
+
+
+def restore_job(state, r7_rooms, store=None):
     """
-    teams, r7_rooms, r8_rooms = initialise(initialise_directory)
+    Goes back to a job_state: the store loses any samples saved after it,
+    as the resumed run will find them again, and output_filename is
+    rewritten to match
+    The whole store goes back, so this needs the store to have been this
+    job's alone since the checkpoint: samples other instances added
+    meanwhile are dropped too
+    Returns (strategy, schedule, cache, elites, convergence)
+    """
+    random.setstate(state["random"])
+    position = {team: i for i, team in enumerate(state["room_order"])}
+    r7_rooms.sort(key=lambda room: position[room[0].index])
+    if store is not None:
+        dropped = store.restore(state["store"])
+        if dropped:
+            print(f"Dropped {dropped} samples stored after the checkpoint")
+        store.export(output_filename, overwrite=True)
+    return (state["strategy"], state["schedule"], state["cache"],
+            state["elites"], state["convergence"])
 
-    i = 0
-    while True:
-        top = "*" * (13 + len(str(i+1)))
-        print(f"{top}\n* FULL RUN {i+1} *\n{top}")
-        for j in range(max_search_len):
-            print(f"Iteration {j+1}")
-            random.shuffle(r7_rooms)
-            for r7_room in r7_rooms:
-                choose_order_for_r7_room(teams, r7_rooms, r8_rooms, r7_room)
-            loss = global_objective_function(teams, r8_rooms)
-            print(f"\t{sum(loss)} ({loss})")
-            if sum(loss) <= qualifier_loss:
-                print("ACHIEVED")
-                file_edit(teams, output_filename)
-                break
-            if sum(loss) > cutoff_threshold and j >= cutoff_point - 1:
-                print("CUTOFF FAILED")
+
+def do_sims():
+    """
+    Run simulations over and over and over, until the marginals settle
+    (see stop_width and stable_window)
+    Can run multiple ones and they will all output to the same file,
+    though parallel_runner.py is the safer way to use several cores; but
+    not with resume, which puts the whole store back to its checkpoint
+    (see restore_job)
+    Each zero-loss restart is followed by walk_samples more samples, taken
+    by walking through zero-loss results from it (see feasible_walk.py)
+    Restarts start near the best states found so far warm_share of the
+    time (see elites.py)
+    Every checkpoint_interval seconds the whole job is saved to
+    checkpoint_filename, and with resume set it carries on from there
+    """
+    teams, r7_rooms, r8_rooms, known, r8_loss = initialise(
+        initialise_directory)
+    r7_est = np.zeros(len(teams), dtype=np.int64)
+    r8_state = DrawState(r8_loss, known + r7_est)
+    allowed = prune_rooms(known, r7_rooms, r8_rooms)
+    store = open_store(list(teams))
+    strategy = make_strategy(strategy_name)
+    cache = StateCache(cache_size)
+    walk = FeasibleWalk(known, r7_rooms, r8_state, qualifier_loss, allowed)
+    elites = make_elites(r7_rooms, allowed)
+    schedule = make_schedule(schedule_name, max_search_len, cutoff_point,
+                             cutoff_threshold)
+    metrics.configure(metrics_filename, metrics_interval, "round 7")
+    convergence = Convergence(list(teams), stop_width, stable_window,
+                              stable_tolerance)
+    checkpointer = Checkpointer(checkpoint_filename, checkpoint_interval)
+    state = checkpointer.load() if resume else None
+    if state is not None:
+        strategy, schedule, cache, elites, convergence = restore_job(
+            state, r7_rooms, store)
+        print(f"Resumed from {checkpoint_filename} at {store.samples()} "
+              f"samples")
+
+    for outcome, _ in restarts(known, r7_est, r8_state, r7_rooms, r8_loss,
+                               strategy, not quiet, cache, allowed,
+                               schedule=schedule, elites=elites):
+        if outcome == "ACHIEVED":
+            save_sample(store, teams, r7_est, output_filename)
+            for _ in walk.samples(r7_est, walk_samples, walk_thin):
+                save_sample(store, teams, r7_est, output_filename)
+            counts, samples = store.snapshot()
+            settled = convergence.update(list(counts.values()), samples)
+            if not quiet:
+                print(convergence.report())
+                print(f"{store.distinct()} distinct solutions, "
+                      f"{cache.solution_hits} restarts cut short by a known "
+                      f"solution, {cache.dead_end_hits} by a dead end")
+                print(schedule.describe())
+            if settled:
+                store.export(output_filename)
+                metrics.write()
+                print("SETTLED")
                 break
-            if j == max_search_len - 1:
-                print("EXPIRED")
-        reset_team_results(teams, r7_rooms)
-        i += 1
+        if checkpointer.due():
+            with metrics.timer("checkpoint"):
+                checkpointer.save(job_state(r7_rooms, strategy, schedule,
+                                            cache, elites, convergence,
+                                            store))
 
 
-do_sims()
+if __name__ == "__main__":
+    do_sims()
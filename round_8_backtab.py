@@ -1,6 +1,17 @@
-import pandas as pd
+import numpy as np
 import random
-from itertools import permutations, product
+from itertools import product
+import domains
+from checkpoint import Checkpointer
+from convergence import Convergence
+from elites import ElitePool
+from loss_engine import DrawLoss, DrawState, orders
+from schedules import make_schedule
+from sim_store import SimStore
+from snapshot import load_snapshot
+from state_cache import StateCache, fingerprint
+from strategies import make_strategy
+from telemetry import metrics
 
 # CONFIG
 year = 2025
@@ -10,17 +21,38 @@ max_search_len = 50 # max length for earch to go on
 make_empty_files = True
 initialise_directory = f"data/{year}"
 r7_filename = f"r7_output_{year}.txt"
+joint = False # search r7 and r8 together, without needing r7_filename
+r7_sweeps = 5 # sweeps that re-choose r7 rooms (every sweep when joint)
+stop_width = 0.1 # stop once every r8 marginal's interval is this narrow
+stable_window = 500 # or once no marginal has moved much in this many
+stable_tolerance = 0.01 # sims (None for either to not stop that way)
+cache_size = 100000 # states remembered to stop repeat restarts early
+quiet = False # True for no per-sweep or per-restart console output
+metrics_filename = None # e.g. f"metrics_r8_{year}.jsonl" for timings
+metrics_interval = 10 # seconds between lines in metrics_filename
+pullup_weight = 2 # pullup loss counts double here
+expire_filename = "expire_file" # SimStore names, see sim_store.py
+zero_filename = "zero_file"
+strategy_name = "descent" # or "annealing" or "tabu", see strategies.py
+schedule_name = "fixed" # or "luby" or "learned" cutoffs, see schedules.py
+checkpoint_filename = f"checkpoint_r8_{year}.ckpt" # None for no checkpoints
+checkpoint_interval = 300 # seconds between checkpoints
+resume = False # carry on from checkpoint_filename rather than start afresh
+prune_orders = True # rule out impossible orders first, see domains.py
+elite_size = 20 # best distinct states kept to start restarts near
+warm_share = 0.0 # share of restarts started near them, see elites.py
+elite_max_loss = None # only near those with at most this loss (None for any)
 
 
 
-orders = [order for order in permutations([0, 1, 2, 3])]
-
 class Team:
-    def __init__(self, name, known):
+    __slots__ = ("name", "known", "index", "r7_room", "r8_room", "r9_room",
+                 "r7_poss")
+
+    def __init__(self, name, known, index):
         self.name = name
         self.known = known
-        self.r7_est = 0
-        self.r8_est = 0
+        self.index = index # position in the points/estimate arrays
         self.r7_room = None
         self.r8_room = None
         self.r9_room = None
@@ -31,21 +63,25 @@ class Team:
 
 
 class Room:
+    __slots__ = ("teams", "round_num", "ids", "r7_options", "r8_options")
+
     def __init__(self, teams, round_num):
         self.teams = teams
         self.round_num = round_num
+        self.ids = [team.index for team in teams]
+        self.r7_options = None # r7 rooms: results it can take
+        self.r8_options = None # r8 rooms: orders it can take (None for all)
 
-    def set_order(self, order):
-        for team, score in zip(self.teams, order):
-            if self.round_num == 7:
-                team.r7_est = score
-            if self.round_num == 8:
-                team.r8_est = score
+    def set_order(self, est, order):
+        """
+        est (array): the estimate array for this room's round
+        """
+        est[self.ids] = order
 
     def __str__(self):
         room_string = f"ROOM (round {self.round_num})"
         for team in self.teams:
-            room_string += f"\n\t{team.r7_est} {team.r8_est} {team.name}"
+            room_string += f"\n\t{team.index} {team.name}"
         return room_string
 
 
@@ -56,240 +92,146 @@ def initialise(directory):
     2. r7_rooms (list): list of Room objects
     3. r8_rooms (list): list of Room objects
     4. r9_rooms (list): list of Room objects
+    5. known (array): post-r6 points, indexed by team.index
+    6. r8_loss (DrawLoss): loss bookkeeping for the r8 draw
+    7. r9_loss (DrawLoss): loss bookkeeping for the r9 draw
+    The text files are read through a binary snapshot (see snapshot.py),
+    made the first time and whenever they change
     """
     # Make the teams
-    standings = pd.read_csv(f"{directory}/standings.txt", sep="\t")
+    snapshot = load_snapshot(directory)
     teams = {}
-    for _, row in standings.iterrows():
-        teams[row["team"]] = Team(row["team"], row["points"])
+    for name, points in zip(snapshot["names"], snapshot["points"]):
+        teams[name] = Team(name, int(points), len(teams))
+    team_list = list(teams.values())
+    known = snapshot["points"].copy()
 
     # Then get r7 info
-    r7_draw = pd.read_csv(f"{directory}/r7_draw.txt", sep="\t")
     r7_rooms = []
-    for _, row in r7_draw.iterrows():
-        room_teams = [teams[name] for name in row]
+    for row in snapshot["r7"]:
+        room_teams = [team_list[i] for i in row]
         room = Room(room_teams, 7)
         r7_rooms.append(room)
         for team in room_teams:
             team.r7_room = room
 
     # Then get r8 info
-    r8_draw = pd.read_csv(f"{directory}/r8_draw.txt", sep="\t")
     r8_rooms = []
-    for _, row in r8_draw.iterrows():
-        room_teams = [teams[name] for name in row]
+    for row in snapshot["r8"]:
+        room_teams = [team_list[i] for i in row]
         room = Room(room_teams, 8)
         r8_rooms.append(room)
         for team in room_teams:
             team.r8_room = room
 
     # Then get r9 info
-    r9_draw = pd.read_csv(f"{directory}/r9_draw.txt", sep="\t")
     r9_rooms = []
-    for _, row in r9_draw.iterrows():
-        room_teams = [teams[name] for name in row]
+    for row in snapshot["r9"]:
+        room_teams = [team_list[i] for i in row]
         room = Room(room_teams, 9)
         r9_rooms.append(room)
         for team in room_teams:
             team.r9_room = room
 
-    reset_results(r7_rooms, r8_rooms)
+    r8_loss = DrawLoss([room.ids for room in r8_rooms], len(teams))
+    r9_loss = DrawLoss([room.ids for room in r9_rooms], len(teams))
 
-    return teams, r7_rooms, r8_rooms, r9_rooms
+    return teams, r7_rooms, r8_rooms, r9_rooms, known, r8_loss, r9_loss
 
 
-def reset_results(r7_rooms, r8_rooms):
+def reset_results(r7_est, r8_est, r7_rooms, r8_rooms, joint=False):
     """
     Does what it says on the tin: before running a simulation it chooses
     a random point in parameter space whence to begin
+    When joint, each r7 room starts on a random order, as in round 7
     """
     for room in r7_rooms:
+        if joint:
+            room.set_order(r7_est, random.choice(room.r7_options))
+            continue
         for team in room.teams:
-            team.r7_est = random.choice([0, 1, 2, 3])
+            r7_est[team.index] = random.choice([0, 1, 2, 3])
     for room in r8_rooms:
+        if room.r8_options is not None:
+            room.set_order(r8_est, random.choice(room.r8_options))
+            continue
         for team in room.teams:
-            team.r8_est = random.choice([0, 1, 2, 3])
+            r8_est[team.index] = random.choice([0, 1, 2, 3])
 
 
-def get_oob_loss(round, round_room, outside_scores):
+def get_collision_loss(candidates):
     """
-    Get the number of teams whose scores are between room max and min
-    round (int): round number
-    round_room (Room): the room being scored
-    outside_scores (Series): other scores in the draw
-    NOTE: might need to adjust for very extreme rooms, e.g., the 66666543 case
+    Number of teams in a room who share a result with another team
+    candidates (array): one row of four results per candidate order
     """
-    if round == 8:
-        team_scores = [team.known + team.r7_est for team in round_room.teams]
-    if round == 9:
-        team_scores = [team.known + team.r7_est + team.r8_est
-                        for team in round_room.teams]
-    room_min, room_max = min(team_scores), max(team_scores)
-    res = ((outside_scores > room_min) & (outside_scores < room_max)).sum()
-    return res
+    ordered = np.sort(candidates, axis=1)
+    return (np.diff(ordered, axis=1) == 0).sum(axis=1)
 
 
-def get_pullup_loss(round, teams, round_rooms):
-    """
-    Max pullups for a given bracket is 3
-    This penalises for each pullup beyond that
-    """
-    pullup_dict = dict(zip(np.arange(28), [0]*28))
-    for room in round_rooms:
-        if round == 8:
-            room_scores = [team.known + team.r7_est for team in room.teams]
-        if round == 9:
-            room_scores = [team.known + team.r7_est + team.r8_est
-                            for team in room.teams]
-        room_max = max(room_scores)
-        for team in room.teams:
-            if round == 8:
-                team_score = team.known + team.r7_est
-            if round == 9:
-                team_score = team.known + team.r7_est + team.r8_est
-            if team_score < room_max:
-                pullup_dict[team_score] += 1
-    pullup_loss = sum([max(0, val - 3) for val in pullup_dict.values()])
-    return pullup_loss * 2
-
-
-def choose_order_for_r7_room(teams, r7_room, r8_rooms):
+def choose_order_for_r7_room(known, r7_est, r8_est, r7_room, r8_state,
+                             r9_state, strategy, joint=False):
     """
     This is for the handful of r7 rooms for which the result isn't certain
-    This calculates loss over both rounds 8 and 9
     Another thing of note: it allows for multiple teams to get the same
     result in the round. However, that is penalised with "collision loss",
     which is the number of such collisions.
+    Only the r8 draw is scored here, unless joint: the r9 loss was always
+    weighted zero for this choice, though r9_state is still moved along
+    with the room. When joint, every r7 room is open, so the r9 draw is
+    scored too, with r8 results as they stand
     """
-    orders = [o for o in product(
-        r7_room.teams[0].r7_poss,
-        r7_room.teams[1].r7_poss,
-        r7_room.teams[2].r7_poss,
-        r7_room.teams[3].r7_poss,
-    )]
-    if len(orders) == 1:
-        r7_room.set_order(orders[0])
-        return
-
-    # Do infrastructure before loop to save calculations
-    team_r8_room = [team.r8_room for team in r7_room.teams
-                    if team.r8_room is not None]
-    team_r9_room = [team.r8_room for team in r7_room.teams
-                    if team.r9_room is not None]
-    scores_out_r8_rooms = []
-    scores_out_r9_rooms = []
-    for room in team_r8_room:
-        if room is None:
-            scores_out_r8_rooms.append(None)
-        else:
-            scores = pd.Series([team.known + team.r7_est
-                                for team in teams.values()
-                                if team not in r7_room.teams
-                                and team.r8_room is not None])
-            scores_out_r8_rooms.append(scores)
-    for room in team_r9_room:
-        if room is None:
-            scores_out_r9_rooms.append(None)
-        else:
-            scores = pd.Series([team.known + team.r7_est + team.r8_est
-                                for team in teams.values()
-                                if team not in r7_room.teams
-                                and team.r9_room is not None])
-            scores_out_r9_rooms.append(scores)
-
-    random.shuffle(orders)
-    order_scores = []
-    best_order = None
-    best_score = 10**10
-    for order in orders:
-        r7_room.set_order(order)
-        # Get loss for the order!!!
-
-        # 1. Get collision loss: num of teams in room who get same result
-        coll_loss = (4 - len(set(order))) * 5
-
-        # 2. Get out-of-bracket loss
-            # For each r8 room the teams in this r7 room end in
-            # See how many teams outside that room
-            # Fall between the highest and lowest points in that room
-        r8_oob_loss = 0
-        for r8_room, score_series in zip(team_r8_room, scores_out_r8_rooms):
-            if r8_room is None:
-                continue
-            r8_oob_loss += get_oob_loss(8, r8_room, score_series)
-        r9_oob_loss = 0
-        for r9_room, score_series in zip(team_r9_room, scores_out_r9_rooms):
-            if r9_room is None:
-                continue
-            r9_oob_loss += get_oob_loss(9, r9_room, score_series)
-
-        # 3. Get pullup loss
-        r8_pullup_loss = get_pullup_loss(8, teams, r8_rooms)
-        r9_pullup_loss = get_pullup_loss(9, teams, r9_rooms)
-
-        order_score = (coll_loss * 100
-                        + (r8_oob_loss + r8_pullup_loss)
-                        + (r9_oob_loss + r9_pullup_loss) * 0)
-        order_scores.append(order_score)
-        if order_score < best_score:
-            best_order = order
-            best_score = order_score
-
-    for order, order_score in zip(orders, order_scores):
-        continue
-        print(order, order_score)
-    r7_room.set_order(best_order)
-
-
-def choose_order_for_r8_room(teams, r8_room, r9_rooms):
-    """
-    Cycle through all possible orders, choose that which has the lowest loss
-    """
-    # Do infrastructure before loop to save calculations
-    team_r9_room = [team.r9_room for team in r8_room.teams
-                    if team.r9_room is not None]
-    scores_out_r9_rooms = []
-    for room in team_r9_room:
-        if room is None:
-            scores_out_r9_rooms.append(None)
-        else:
-            scores = pd.Series([team.known + team.r7_est + team.r8_est
-                                for team in teams.values()
-                                if team not in r8_room.teams
-                                and team.r9_room is not None])
-            scores_out_r9_rooms.append(scores)
-
-    random.shuffle(orders)
-    order_scores = []
-    best_order = None
-    best_score = 10**10
-    best_oob_loss = None
-    for order in orders:
-        r8_room.set_order(order)
-
-        # 1. Get collision loss: num of teams in room who get same result
-        coll_loss = (4 - len(set(order))) * 5
-
-        # 2. Get out-of-bracket loss
-            # For each r8 room the teams in this r7 room end in
-            # See how many teams outside that room
-            # Fall between the highest and lowest points in that room
-        oob_loss = 0
-        for r9_room, score_series in zip(team_r9_room, scores_out_r9_rooms):
-            if r9_room is None:
-                continue
-            oob_loss += get_oob_loss(9, r9_room, score_series)
-
-        # 3. Get pullup loss
-        pullup_loss = get_pullup_loss(9, teams, r9_rooms)
-
-        order_score = coll_loss + oob_loss + pullup_loss
-        order_scores.append(order_score)
-        if order_score < best_score:
-            best_order = order
-            best_score = order_score
-
-    r8_room.set_order(best_order)
+    options = r7_room.r7_options
+    ids = r7_room.ids
+    if len(options) == 1:
+        best = 0
+    else:
+        with metrics.timer("order_scoring"):
+            coll_loss = get_collision_loss(options) * 5
+            oob_delta, pullup_delta = r8_state.batch_delta(
+                ids, known[ids] + options)
+            order_scores = (coll_loss * 100 + oob_delta
+                            + pullup_delta * pullup_weight)
+            if joint:
+                oob_delta, pullup_delta = r9_state.batch_delta(
+                    ids, known[ids] + options + r8_est[ids])
+                order_scores += oob_delta + pullup_delta * pullup_weight
+            current = np.flatnonzero((options == r7_est[ids]).all(axis=1))
+            best = strategy.choose((7,) + tuple(ids), order_scores,
+                                   int(current[0]) if len(current) else None)
+        metrics.count("rooms_scored")
+        metrics.count("orders_scored", len(options))
+    r7_room.set_order(r7_est, options[best])
+    with metrics.timer("move"):
+        r8_state.move(ids, known[ids] + options[best])
+        r9_state.move(ids, known[ids] + options[best] + r8_est[ids])
+
+
+def choose_order_for_r8_room(known, r7_est, r8_est, r8_room, r9_state,
+                             strategy):
+    """
+    Score the change in loss for all possible orders in one batch, and let
+    the strategy choose (for descent, the lowest loss, ties broken at
+    random)
+    No collision loss here, as every order is a permutation
+    Only the room's r8_options are tried, if it has them
+    """
+    ids = r8_room.ids
+    options = orders if r8_room.r8_options is None else r8_room.r8_options
+    candidates = known[ids] + r7_est[ids] + options
+    if len(options) == 1:
+        best = 0
+    else:
+        with metrics.timer("order_scoring"):
+            oob_delta, pullup_delta = r9_state.batch_delta(ids, candidates)
+            order_scores = oob_delta + pullup_delta * pullup_weight
+            current = np.flatnonzero((options == r8_est[ids]).all(axis=1))
+            best = strategy.choose((8,) + tuple(ids), order_scores,
+                                   int(current[0]) if len(current) else None)
+        metrics.count("rooms_scored")
+        metrics.count("orders_scored", len(candidates))
+    r8_room.set_order(r8_est, options[best])
+    with metrics.timer("move"):
+        r9_state.move(ids, candidates[best])
 
 
 def import_r7(filename, teams):
@@ -299,140 +241,316 @@ def import_r7(filename, teams):
     Doesn't really care about the size of a probability, just whether
     it is nonzero
     """
+    import pandas as pd # only needed here, so startup doesn't pay for it
     r7_poss = pd.read_csv(filename, sep="\t", index_col=0)
     for team_name, row in r7_poss.iterrows():
         teams[team_name].r7_poss = [int(i) for i in row[row > 0].index
                                     if i != "count"]
 
 
-def global_loss(teams, r7_rooms, r8_rooms, r9_rooms):
+def set_r7_options(teams, r7_rooms, joint=False, filename=None):
     """
-    Calculate all losses, over round 8 and round 9
+    Works out the candidate results for every r7 room, once
+    Normally these come from a finished round 7 run (see import_r7): each
+    team's possible results, in every combination
+    When joint, no round 7 run is needed: every room can have any of the
+    24 orders, and the search settles r7 and r8 together
+    filename (str): round 7 output to read, r7_filename if None
     """
-    collision_loss = 0
+    if not joint:
+        import_r7(filename or r7_filename, teams)
     for room in r7_rooms:
-        coll = (4 - len(set([t.r7_est for t in room.teams])))
-        collision_loss += coll
-    for room in r8_rooms:
-        coll = (4 - len(set([t.r8_est for t in room.teams])))
-        collision_loss += coll
+        if joint:
+            room.r7_options = orders
+        else:
+            room.r7_options = np.array(list(product(
+                *[team.r7_poss for team in room.teams])), dtype=np.int64)
 
-    oob_loss = 0
-    r8_scores = [team.known + team.r7_est for team in teams.values()
-                if team.r8_room is not None]
-    for room in r8_rooms:
-        outside_r8_scores = [i for i in r8_scores]
-        for team in room.teams:
-            outside_r8_scores.remove(team.known + team.r7_est)
-        oob_loss += get_oob_loss(8, room, pd.Series(outside_r8_scores))
-    r9_scores = [t.known + t.r7_est + t.r8_est for t in teams.values()
-                if t.r9_room is not None]
-    for room in r9_rooms:
-        outside_r9_scores = [i for i in r9_scores]
-        for team in room.teams:
-            outside_r9_scores.remove(team.known + team.r7_est + team.r8_est)
-        room_oob_loss = get_oob_loss(9, room, pd.Series(outside_r9_scores))
-        oob_loss += room_oob_loss
 
-    pullup_loss = (get_pullup_loss(8, teams, r8_rooms)
-                    + get_pullup_loss(9, teams, r9_rooms))
+def prune_options(known, r7_rooms, r8_rooms, r9_rooms):
+    """
+    Rules out orders that can't give zero loss, straight from the draws
+    (see domains.py), after set_r7_options
+    Each r7 room keeps only those of its r7_options left (unless none
+    are, when a round 7 run disagrees with the draws), and each r8 room's
+    r8_options are set
+    Does nothing if prune_orders is off
+    """
+    if not prune_orders:
+        return
+    r7_ok, r8_ok = domains.prune(known, [room.ids for room in r7_rooms],
+                                 [room.ids for room in r8_rooms],
+                                 [room.ids for room in r9_rooms])
+    for room, ok in zip(r7_rooms, r7_ok):
+        keep = (room.r7_options[:, None, :]
+                == orders[ok][None, :, :]).all(axis=2).any(axis=1)
+        if keep.any():
+            room.r7_options = room.r7_options[keep]
+    for room, ok in zip(r8_rooms, r8_ok):
+        room.r8_options = orders[ok]
+
+
+def make_elites(r7_rooms, r8_rooms):
+    """
+    The ElitePool (see elites.py) of elite_size states, r7 and r8 results
+    together, that restarts start near warm_share of the time, if their
+    loss is at most elite_max_loss
+    Made after set_r7_options and prune_options, before the rooms are
+    first shuffled
+    """
+    rooms = [(0, room.ids, room.r7_options) for room in r7_rooms]
+    rooms += [(1, room.ids,
+               orders if room.r8_options is None else room.r8_options)
+              for room in r8_rooms]
+    return ElitePool(rooms, elite_size, warm_share=warm_share,
+                     max_loss=elite_max_loss)
+
+
+def global_loss(r7_est, r8_est, r7_rooms, r8_rooms, r8_state, r9_state):
+    """
+    Calculate all losses, over round 8 and round 9
+    OOB and pullup totals are read off the running draw states
+    """
+    with metrics.timer("global_loss"):
+        collision_loss = 0
+        for rooms, est in [(r7_rooms, r7_est), (r8_rooms, r8_est)]:
+            results = est[[room.ids for room in rooms]]
+            collision_loss += int(get_collision_loss(results).sum())
+
+        r8_oob_loss, r8_pullup_loss = r8_state.loss()
+        r9_oob_loss, r9_pullup_loss = r9_state.loss()
+        oob_loss = r8_oob_loss + r9_oob_loss
+        pullup_loss = (r8_pullup_loss + r9_pullup_loss) * pullup_weight
 
     return collision_loss, oob_loss, pullup_loss
 
 
-def expire_save(teams, loss):
+def expire_save(expire_store, r7_est, r8_est, loss):
     """
     On expiry, save the current state along with loss
+    expire_store (SimStore): append-only store, one record per simulation
     """
-    def map_index_to_value(index):
-        if index == "samples": return 0
-        if index == "success": return 1 if loss == 0 else 0
-        if index == "loss": return loss
-        team_name = index[:-3]
-        round = int(index[-1])
-        if round == 7: return teams[team_name].r7_est
-        else: return teams[team_name].r8_est
-
-    try:
-        expire_df = pd.read_csv("expire_file.txt", sep="\t", index_col=0)
-    except FileNotFoundError:
-        expire_df = pd.DataFrame(
-            index=[
-                f"{t.name}_r{r}"
-                for t in teams.values()
-                for r in [7, 8]
-            ] + ["loss", "samples", "success"]
-        )
-    cols = [int(i[4:]) for i in expire_df.columns]
-    sim_num = 1 if len(cols) == 0 else max(cols) + 1
-    new_col = list(expire_df.reset_index()["index"].apply(map_index_to_value))
-    expire_df[f"sim_{sim_num}"] = new_col
-    open("expire_file.txt", "w").write(expire_df.to_csv(sep="\t"))
-
-
-def print_zero(teams):
+    with metrics.timer("file_io"):
+        expire_store.append(r7_est, r8_est, loss)
+    metrics.count("samples_saved")
+
+
+def print_zero(zero_store, r7_est, r8_est):
     """
     On the very blessed (and rare) occasion you get to zero loss
-    Save to file, just like how round_7_backtab does
-    """
-    def map_index_to_value(index):
-        team_name = index[:-3]
-        round = int(index[-1])
-        if round == 7: return teams[team_name].r7_est
-        else: return teams[team_name].r8_est
-
-    try:
-        zero_df = pd.read_csv("zero_file.txt", sep="\t", index_col=0)
-    except FileNotFoundError:
-        zero_df = pd.DataFrame(
-            index=[
-                f"{t.name}_r{r}"
-                for t in teams.values()
-                for r in [7, 8]
-            ]
-        )
-    cols = [int(i[4:]) for i in expire_df.columns]
-    sim_num = 1 if len(cols) == 0 else max(cols) + 1
-    new_col = list(expire_df.reset_index()["index"].apply(map_index_to_value))
-    zero_df[f"sim_{sum_num}"] = new_col
-    open("zero_file.txt", "w").write(zero_df.to_csv(sep="\t"))
+    Save to its own store, kept apart from the expired simulations
+    """
+    with metrics.timer("file_io"):
+        zero_store.append(r7_est, r8_est, 0)
+    metrics.count("samples_saved")
+
+
+def run_restart(known, r7_est, r8_est, r7_rooms, r8_rooms, r8_state,
+                r9_state, strategy, verbose=True, joint=False, cache=None,
+                schedule=None, elites=None):
+    """
+    One full run of the search from a fresh random start, or a warm one
+    Returns (outcome, loss), outcome being "ZERO", "CUTOFF FAILED",
+    "EXPIRED" or "KNOWN DEAD END"; r7_est and r8_est are left holding the
+    final state
+    Only a restart ending with loss up to cutoff_threshold is EXPIRED
+    (under the fixed schedule, its cutoff sees to that)
+    The outcome and number of sweeps are added to strategy.stats
+    joint (bool): re-choose r7 rooms on every sweep rather than the first
+        r7_sweeps, scoring them on both draws (see set_r7_options)
+    cache (StateCache): states from earlier restarts; reaching one that
+        led to a zero, or to a cutoff, stops the restart early (states
+        from expired restarts aren't kept, as those are saved)
+    schedule (FixedSchedule): how long to go on and when to cut (see
+        schedules.py), max_search_len and the cutoffs above if None
+    elites (ElitePool): the best states so far, to start near now and
+        then (see make_elites), offered where this restart ended
+    """
+    if schedule is None:
+        schedule = make_schedule("fixed", max_search_len, cutoff_point,
+                                 cutoff_threshold, "ZERO")
+    budget = schedule.start()
+    warm = elites is not None and elites.start(
+        r7_est, r8_est, states=(r8_state, r9_state)) is not None
+    if warm:
+        r8_state.update(known + r7_est)
+        r9_state.update(known + r7_est + r8_est)
+    else:
+        reset_results(r7_est, r8_est, r7_rooms, r8_rooms, joint)
+        r8_state.reset(known + r7_est)
+        r9_state.reset(known + r7_est + r8_est)
+    strategy.start()
+    path = []
+    for j in range(budget.limit):
+        if verbose: print(f"Iteration {j+1}")
+        strategy.start_sweep(j)
+        if joint or j < r7_sweeps:
+            for r7_room in r7_rooms:
+                choose_order_for_r7_room(known, r7_est, r8_est, r7_room,
+                                         r8_state, r9_state, strategy,
+                                         joint)
+        random.shuffle(r8_rooms)
+        for r8_room in r8_rooms:
+            choose_order_for_r8_room(known, r7_est, r8_est, r8_room,
+                                     r9_state, strategy)
+        loss = global_loss(r7_est, r8_est, r7_rooms, r8_rooms,
+                           r8_state, r9_state)
+        if verbose: print(f"\t{sum(loss)} ({loss})")
+        cut = schedule.check(budget, sum(loss))
+        if sum(loss) == 0:
+            outcome = "ZERO"
+            break
+        if cut:
+            outcome = "CUTOFF FAILED"
+            break
+        if cache is not None:
+            key = fingerprint(r7_est, r8_est)
+            seen, solution = cache.lookup(key)
+            if seen and solution is None:
+                outcome = "KNOWN DEAD END"
+                break
+            if seen:
+                r7_est[:], r8_est[:] = solution
+                r8_state.reset(known + r7_est)
+                r9_state.reset(known + r7_est + r8_est)
+                loss = global_loss(r7_est, r8_est, r7_rooms, r8_rooms,
+                                   r8_state, r9_state)
+                outcome = "ZERO"
+                break
+            path.append(key)
+        outcome = "EXPIRED"
+    if (outcome == "EXPIRED" and schedule.name != "fixed"
+            and sum(loss) > cutoff_threshold):
+        # Luby and learned restarts can end short and uncut, so keep the
+        # fixed schedule's bar on what is saved as expired
+        outcome = "CUTOFF FAILED"
+    if cache is not None and outcome == "ZERO":
+        cache.record(path, (r7_est.copy(), r8_est.copy()))
+    if cache is not None and outcome in ("CUTOFF FAILED", "KNOWN DEAD END"):
+        cache.record(path)
+    if elites is not None:
+        elites.add(sum(loss), r7_est, r8_est, states=(r8_state, r9_state))
+    strategy.finish(outcome, j + 1)
+    schedule.finish(budget, outcome)
+    metrics.count("restarts")
+    metrics.count("sweeps", j + 1)
+    metrics.count(outcome)
+    metrics.tick()
+    if verbose: print(outcome)
+    return outcome, loss
+
+
+def job_state(r7_rooms, r8_rooms, strategy, schedule, cache, elites=None,
+              convergence=None, r8_counts=None, stores=()):
+    """
+    Everything a run needs to carry on exactly from here (see
+    checkpoint.py): random state, room orders, the strategy, schedule,
+    cache and elites, and, for the process keeping the results, the convergence
+    tracker, the r8 counts and how many sims each SimStore holds
+    """
+    return {
+        "random": random.getstate(),
+        "r7_order": [room.ids[0] for room in r7_rooms],
+        "r8_order": [room.ids[0] for room in r8_rooms],
+        "strategy": strategy,
+        "schedule": schedule,
+        "cache": cache,
+        "elites": elites,
+        "convergence": convergence,
+        "r8_counts": None if r8_counts is None else r8_counts.copy(),
+        "stores": {store.base: len(store) for store in stores},
+    }
+
+
+def restore_job(state, r7_rooms, r8_rooms, stores=()):
+    """
+    Goes back to a job_state: the stores lose any sims saved after it,
+    as the resumed run will find them again; by anyone, so the stores
+    must have been this job's alone since the checkpoint
+    Returns (strategy, schedule, cache, elites, convergence, r8_counts)
+    """
+    random.setstate(state["random"])
+    for rooms, order in [(r7_rooms, state["r7_order"]),
+                         (r8_rooms, state["r8_order"])]:
+        position = {team: i for i, team in enumerate(order)}
+        rooms.sort(key=lambda room: position[room.ids[0]])
+    for store in stores:
+        store.truncate(state["stores"][store.base])
+    return (state["strategy"], state["schedule"], state["cache"],
+            state["elites"], state["convergence"], state["r8_counts"])
 
 
 def run_tests():
     """
     Loops over and over, running the backtabber round after round
+    Stops once the r8 marginals over saved simulations (zero and expired)
+    settle, see stop_width and stable_window
+    Restarts start near the best states found so far warm_share of the
+    time (see elites.py)
+    Every checkpoint_interval seconds the whole job is saved to
+    checkpoint_filename, and with resume set it carries on from there
     """
-    teams, r7_rooms, r8_rooms, r9_rooms = initialise(initialise_directory)
-    import_r7(r7_filename, teams)
+    teams, r7_rooms, r8_rooms, r9_rooms, known, r8_loss, r9_loss = initialise(
+        initialise_directory)
+    set_r7_options(teams, r7_rooms, joint)
+    prune_options(known, r7_rooms, r8_rooms, r9_rooms)
+    elites = make_elites(r7_rooms, r8_rooms)
+    r7_est = np.zeros(len(teams), dtype=np.int64)
+    r8_est = np.zeros(len(teams), dtype=np.int64)
+    r8_state = DrawState(r8_loss, known + r7_est)
+    r9_state = DrawState(r9_loss, known + r7_est + r8_est)
+    expire_store = SimStore(expire_filename, list(teams))
+    zero_store = SimStore(zero_filename, list(teams))
+    strategy = make_strategy(strategy_name)
+    cache = StateCache(cache_size)
+    schedule = make_schedule(schedule_name, max_search_len, cutoff_point,
+                             cutoff_threshold, "ZERO")
+    metrics.configure(metrics_filename, metrics_interval, "round 8")
+    convergence = Convergence(list(teams), stop_width, stable_window,
+                              stable_tolerance)
+    r8_counts = np.zeros((len(teams), 4), dtype=np.int64)
+    checkpointer = Checkpointer(checkpoint_filename, checkpoint_interval)
+    state = checkpointer.load() if resume else None
+    if state is not None:
+        strategy, schedule, cache, elites, convergence, r8_counts = (
+            restore_job(state, r7_rooms, r8_rooms,
+                        [expire_store, zero_store]))
+        print(f"Resumed from {checkpoint_filename} at "
+              f"{len(expire_store) + len(zero_store)} sims")
     i = 0
     while True:
-        top = "*" * (13 + len(str(i+1)))
-        print(f"{top}\n* FULL RUN {i+1} *\n{top}")
-        for j in range(max_search_len):
-            print(f"Iteration {j+1}")
-            if j < 5:
-                for r7_room in r7_rooms:
-                    choose_order_for_r7_room(teams, r7_room, r8_rooms)
-            random.shuffle(r8_rooms)
-            for r8_room in r8_rooms:
-                choose_order_for_r8_room(teams, r8_room, r9_rooms)
-            loss = global_loss(teams, r7_rooms, r8_rooms, r9_rooms)
-            print(f"\t{sum(loss)} ({loss})")
-            if sum(loss) == 0:
-                print("ZERO")
-                print_zero(teams)
-                break
-            if sum(loss) > cutoff_threshold and j >= cutoff_point - 1:
-                print("CUTOFF FAILED")
+        if not quiet:
+            top = "*" * (13 + len(str(i+1)))
+            print(f"{top}\n* FULL RUN {i+1} *\n{top}")
+        outcome, loss = run_restart(known, r7_est, r8_est, r7_rooms,
+                                    r8_rooms, r8_state, r9_state, strategy,
+                                    verbose=not quiet, joint=joint,
+                                    cache=cache, schedule=schedule,
+                                    elites=elites)
+        if outcome == "ZERO":
+            print_zero(zero_store, r7_est, r8_est)
+            if not quiet:
+                print(f"{len(zero_store)} zero sims, "
+                      f"{zero_store.distinct()} distinct")
+                print(schedule.describe())
+        if outcome == "EXPIRED":
+            expire_save(expire_store, r7_est, r8_est, sum(loss))
+        if outcome in ("ZERO", "EXPIRED"):
+            r8_counts[np.arange(len(teams)), r8_est] += 1
+            settled = convergence.update(r8_counts, int(r8_counts[0].sum()))
+            if not quiet:
+                print(convergence.report())
+            if settled:
+                metrics.write()
+                print("SETTLED")
                 break
-            if j == max_search_len - 1:
-                print("EXPIRED")
-                expire_save(teams, sum(loss))
-
-        reset_results(r7_rooms, r8_rooms)
+        if checkpointer.due():
+            with metrics.timer("checkpoint"):
+                checkpointer.save(job_state(
+                    r7_rooms, r8_rooms, strategy, schedule, cache, elites,
+                    convergence, r8_counts, [expire_store, zero_store]))
         i += 1
 
 
-
-
-run_tests()
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,315 @@
+import time
+from collections import deque
+import numpy as np
+
+# CONFIG (defaults, each can be passed to make_schedule instead)
+luby_unit = 10 # sweeps in the shortest luby restart
+explore_share = 0.1 # share of sweeps a learned schedule spends on uncut
+explore_factor = 2 # uncut restarts run up to this times max_search_len
+min_successes = 10 # uncut zero-loss restarts needed before cutting any
+history = 2000 # uncut restarts remembered
+refit_every = 25 # restarts between fits of the cutoffs
+quantiles = (None, 1.0, 0.9, 0.75, 0.5) # envelopes tried, None for no cut
+
+
+class Budget:
+    """
+    One restart's allowance: at most limit sweeps, and cut as soon as the
+    loss after sweep n is over cutoffs[n - 1] (never, if cutoffs is None)
+    Also keeps the loss after each sweep, and when the restart began
+    """
+    __slots__ = ("limit", "cutoffs", "explore", "losses", "clock")
+
+    def __init__(self, limit, cutoffs=None, explore=False):
+        self.limit = limit
+        self.cutoffs = cutoffs
+        self.explore = explore # run uncut, so a learned schedule can see
+        self.losses = []       # where it would have gone
+        self.clock = time.process_time()
+
+
+def luby(i):
+    """
+    The i-th term (from 1) of 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8...
+    """
+    while True:
+        k = i.bit_length()
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+        i -= (1 << (k - 1)) - 1
+
+
+def policy_cost(trajectories, won, limit, cutoffs=None):
+    """
+    Sweeps and zero-loss restarts the given restarts would have had under
+    a limit and cutoffs, had they been run that way
+    trajectories (array): loss after each sweep, one row per restart,
+        NaN after it finished
+    won (array): True for the rows that ended at zero loss
+    Returns (sweeps, successes)
+    """
+    ends = (~np.isnan(trajectories)).sum(axis=1) - 1
+    num_rows, width = trajectories.shape
+    never = width
+    won_at = np.where(won, ends, never)
+    if cutoffs is None:
+        cut_at = np.full(num_rows, never)
+    else:
+        over = np.zeros(trajectories.shape, dtype=bool)
+        span = min(width, len(cutoffs))
+        with np.errstate(invalid="ignore"):
+            over[:, :span] = trajectories[:, :span] > cutoffs[:span]
+        cut_at = np.where(over.any(axis=1), over.argmax(axis=1), never)
+    stop = np.minimum.reduce([won_at, cut_at, ends,
+                              np.full(num_rows, limit - 1)])
+    successes = won & (won_at <= np.minimum(cut_at, limit - 1))
+    return int((stop + 1).sum()), int(successes.sum())
+
+
+class FixedSchedule:
+    """
+    When to give up on a restart: here the hand-set policy, up to
+    max_search_len sweeps, cut once the loss is over cutoff_threshold
+    after cutoff_point sweeps
+    A schedule is asked for a Budget as each restart starts (start), told
+    the loss after every sweep (check, which says whether to cut), and
+    told how the restart ended (finish); from those it keeps the CPU spent
+    per accepted sample
+    """
+    name = "fixed"
+
+    def __init__(self, max_search_len, cutoff_point, cutoff_threshold,
+                 success="ACHIEVED"):
+        """
+        success (str): the outcome of an accepted sample, "ACHIEVED" for
+            round 7 and "ZERO" for round 8
+        """
+        self.max_search_len = max_search_len
+        self.cutoff_point = cutoff_point
+        self.cutoff_threshold = cutoff_threshold
+        self.success = success
+        self.cutoffs = np.full(max_search_len, np.inf)
+        self.cutoffs[cutoff_point - 1:] = cutoff_threshold
+        self.restarts = 0
+        self.accepted = 0
+        self.sweeps = 0
+        self.seconds = 0.0
+
+    def start(self):
+        return Budget(self.max_search_len, self.cutoffs)
+
+    def check(self, budget, loss):
+        """
+        Adds the loss after a sweep, returning True if the restart is to
+        be cut
+        """
+        budget.losses.append(loss)
+        return (budget.cutoffs is not None
+                and loss > budget.cutoffs[len(budget.losses) - 1])
+
+    def finish(self, budget, outcome, seconds=None):
+        """
+        seconds (float): CPU time the restart took, if not all the time
+            since it started (e.g. when restarts share the CPU)
+        """
+        if seconds is None:
+            seconds = time.process_time() - budget.clock
+        self.restarts += 1
+        self.accepted += outcome == self.success
+        self.sweeps += len(budget.losses)
+        self.seconds += float(seconds)
+
+    def expected_sweeps(self):
+        """
+        Sweeps per accepted sample the current policy is expected to take
+        (None until there is anything to go on)
+        """
+        if not self.accepted:
+            return None
+        return self.sweeps / self.accepted
+
+    def report(self):
+        """
+        Returns a dict of restarts, accepted samples, CPU seconds, CPU
+        seconds per accepted sample so far, and expected under the current
+        policy
+        """
+        expected = self.expected_sweeps()
+        per_sweep = self.seconds / self.sweeps if self.sweeps else None
+        return {
+            "schedule": self.name,
+            "restarts": self.restarts,
+            "accepted": self.accepted,
+            "cpu_seconds": self.seconds,
+            "cpu_per_accepted": self.seconds / self.accepted
+                                if self.accepted else None,
+            "expected_cpu_per_accepted": expected * per_sweep
+                                         if expected and per_sweep else None,
+        }
+
+    def describe(self):
+        """
+        One line on the CPU time each accepted sample costs
+        """
+        report = self.report()
+        if report["cpu_per_accepted"] is None:
+            return f"no accepted samples in {self.restarts} restarts"
+        line = f"{report['cpu_per_accepted']:.1f} CPU-seconds per sample"
+        if report["expected_cpu_per_accepted"] is not None:
+            line += (f", {report['expected_cpu_per_accepted']:.1f} expected "
+                     f"from the {self.name} schedule")
+        return line
+
+
+class LubySchedule(FixedSchedule):
+    """
+    Luby restarts: restart n may take luby_unit * luby(n) sweeps, with no
+    loss cutoff, which is never far off the best fixed length whatever
+    the spread of sweeps to zero loss turns out to be
+    """
+    name = "luby"
+
+    def __init__(self, max_search_len, cutoff_point, cutoff_threshold,
+                 success="ACHIEVED", unit=luby_unit):
+        super().__init__(max_search_len, cutoff_point, cutoff_threshold,
+                         success)
+        self.unit = unit
+        self.started = 0
+
+    def start(self):
+        self.started += 1
+        return Budget(self.unit * luby(self.started))
+
+
+class LearnedSchedule(FixedSchedule):
+    """
+    Learns the cutoffs from the loss after each sweep of past restarts
+    Restarts run uncut for up to explore_factor * max_search_len sweeps
+    until min_successes have reached zero loss, and after that whenever
+    uncut restarts have had less than explore_share of all sweeps; every
+    refit_every restarts, each candidate policy is replayed on those and
+    the one with the fewest sweeps per zero-loss restart is kept
+    Candidates are a limit (a quantile of sweeps to zero loss) and a
+    cutoff curve (no cut, or after each sweep, a quantile of the losses of
+    the restarts that went on to reach zero loss)
+    """
+    name = "learned"
+
+    def __init__(self, max_search_len, cutoff_point, cutoff_threshold,
+                 success="ACHIEVED", explore_share=explore_share,
+                 explore_factor=explore_factor, min_successes=min_successes,
+                 history=history, refit_every=refit_every):
+        super().__init__(max_search_len, cutoff_point, cutoff_threshold,
+                         success)
+        self.explore_share = explore_share
+        self.explore_limit = explore_factor * max_search_len
+        self.min_successes = min_successes
+        self.refit_every = refit_every
+        self.trajectories = deque(maxlen=history) # (losses, won) if uncut
+        self.explore_sweeps = 0 # sweeps uncut restarts may take, so far
+        self.limit = None # None until fitted
+        self.curve = None
+        self.fitted_sweeps = None
+
+    def start(self):
+        if (self.limit is None
+                or self.explore_sweeps < self.explore_share * self.sweeps):
+            # Counted in full now, so restarts started side by side don't
+            # all explore, and given back at finish if cut short
+            self.explore_sweeps += self.explore_limit
+            return Budget(self.explore_limit, explore=True)
+        return Budget(self.limit, self.curve)
+
+    def finish(self, budget, outcome, seconds=None):
+        super().finish(budget, outcome, seconds)
+        if budget.explore:
+            self.explore_sweeps -= budget.limit - len(budget.losses)
+            self.trajectories.append((np.array(budget.losses, dtype=float),
+                                      outcome == self.success))
+        if self.restarts % self.refit_every == 0:
+            self.fit()
+
+    def _replay(self):
+        """
+        The uncut restarts as (trajectories, won), see policy_cost
+        """
+        trajectories = np.full((len(self.trajectories), self.explore_limit),
+                               np.nan)
+        for row, (losses, _) in zip(trajectories, self.trajectories):
+            row[:len(losses)] = losses
+        won = np.array([won for _, won in self.trajectories], dtype=bool)
+        return trajectories, won
+
+    def fit(self):
+        """
+        Pick the limit and cutoffs with the fewest sweeps per zero-loss
+        restart over the uncut restarts, once there are enough
+        """
+        if sum(won for _, won in self.trajectories) < self.min_successes:
+            return
+        trajectories, won = self._replay()
+        running = ~np.isnan(trajectories[won])
+        lengths = running.sum(axis=1)
+        reached = running.any(axis=0) # sweeps some zero-loss restart ran
+        best = None
+        for q in quantiles:
+            if q is None:
+                curve = None
+            else:
+                curve = np.full(self.explore_limit, np.inf)
+                curve[reached] = np.nanquantile(
+                    trajectories[won][:, reached], q, axis=0)
+            for limit in np.unique(np.quantile(lengths, [0.5, 0.75, 0.9,
+                                                         1.0],
+                                               method="higher")):
+                sweeps, successes = policy_cost(trajectories, won,
+                                                int(limit), curve)
+                if successes and (best is None
+                                  or sweeps / successes < best[0]):
+                    best = (sweeps / successes, int(limit), curve)
+        self.fitted_sweeps, self.limit, curve = best
+        self.curve = None if curve is None else curve[:self.limit]
+
+    def expected_sweeps(self):
+        """
+        As FixedSchedule.expected_sweeps, uncut restarts included
+        """
+        if self.fitted_sweeps is None:
+            return None
+        return self.fitted_sweeps / (1 - self.explore_share)
+
+    def report(self):
+        """
+        As FixedSchedule.report, plus the fitted limit and the hand-set
+        policy's expected CPU per accepted sample on the same restarts
+        """
+        report = super().report()
+        report["limit"] = self.limit
+        report["fixed_expected_cpu_per_accepted"] = None
+        if self.limit is not None and self.sweeps:
+            trajectories, won = self._replay()
+            sweeps, successes = policy_cost(trajectories, won,
+                                            self.max_search_len, self.cutoffs)
+            if successes:
+                report["fixed_expected_cpu_per_accepted"] = (
+                    sweeps / successes * self.seconds / self.sweeps)
+        return report
+
+
+schedules = {cls.name: cls
+             for cls in [FixedSchedule, LubySchedule, LearnedSchedule]}
+
+
+def make_schedule(name, max_search_len, cutoff_point, cutoff_threshold,
+                  success="ACHIEVED", **kwargs):
+    """
+    name (str): "fixed", "luby" or "learned"
+    max_search_len, cutoff_point, cutoff_threshold: the round script's
+        hand-set policy, which "fixed" keeps to and the others start from
+    kwargs: settings for that schedule, e.g. explore_share=0.2
+    """
+    if name not in schedules:
+        raise ValueError(f"unknown schedule {name}, "
+                         f"pick from {', '.join(schedules)}")
+    return schedules[name](max_search_len, cutoff_point, cutoff_threshold,
+                           success, **kwargs)
@@ -0,0 +1,172 @@
+import argparse
+import os
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # not on Windows, where appends go unlocked
+    fcntl = None
+
+
+class SimStore:
+    """
+    Append-only store of round 8 simulations (what used to be the wide
+    expire_file.txt / zero_file.txt)
+    {base}.names holds the team names, one per line
+    {base}.bin holds one fixed-size record per simulation: loss, samples,
+    success, then each team's r7 and r8 result as int8
+    Adding a simulation appends one record, so it costs O(teams) however
+    many simulations are already saved, and readers can memory-map the
+    file rather than loading it all
+    """
+    def __init__(self, base, names=None):
+        """
+        base (str): file name without extension
+        names (list): team names, needed the first time the store is made
+        """
+        self.base = base
+        self.names_filename = f"{base}.names"
+        self.bin_filename = f"{base}.bin"
+        if os.path.exists(self.names_filename):
+            with open(self.names_filename) as f:
+                stored_names = f.read().splitlines()
+            if names is not None and list(names) != stored_names:
+                raise ValueError(f"{self.names_filename} has different teams")
+            names = stored_names
+        elif names is None:
+            raise FileNotFoundError(self.names_filename)
+        else:
+            temp_filename = f"{self.names_filename}.{os.getpid()}.tmp"
+            with open(temp_filename, "w") as f:
+                f.write("\n".join(names) + "\n")
+            os.replace(temp_filename, self.names_filename)
+        self.names = list(names)
+        self.dtype = np.dtype([
+            ("loss", "<i4"),
+            ("samples", "<i4"),
+            ("success", "i1"),
+            ("r7", "i1", (len(self.names),)),
+            ("r8", "i1", (len(self.names),)),
+        ])
+
+    def append(self, r7_est, r8_est, loss, samples=0):
+        """
+        Add one simulation, r7_est and r8_est being indexed like names
+        The record goes down in a single locked write to the end of the
+        file, so several programmes can share a store
+        """
+        record = np.zeros(1, dtype=self.dtype)
+        record["loss"] = loss
+        record["samples"] = samples
+        record["success"] = 1 if loss == 0 else 0
+        record["r7"] = r7_est
+        record["r8"] = r8_est
+        fd = os.open(self.bin_filename,
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            os.write(fd, record.tobytes())
+        finally:
+            os.close(fd) # also drops the lock
+
+    def truncate(self, num_sims):
+        """
+        Drop every simulation after the first num_sims, e.g. to go back
+        to a checkpoint; only safe while nothing else is writing
+        """
+        if len(self) <= num_sims:
+            return
+        fd = os.open(self.bin_filename, os.O_WRONLY)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            os.ftruncate(fd, num_sims * self.dtype.itemsize)
+        finally:
+            os.close(fd)
+
+    def __len__(self):
+        if not os.path.exists(self.bin_filename):
+            return 0
+        return os.path.getsize(self.bin_filename) // self.dtype.itemsize
+
+    def read(self):
+        """
+        Returns the simulations as a read-only memory-mapped record array
+        A record still being written at the end of the file is left off
+        """
+        num_sims = len(self)
+        if num_sims == 0:
+            return np.zeros(0, dtype=self.dtype)
+        return np.memmap(self.bin_filename, dtype=self.dtype, mode="r",
+                         shape=(num_sims,))
+
+    def distinct(self):
+        """
+        Number of distinct (r7, r8) results among the stored simulations,
+        however many times each was saved
+        """
+        sims = self.read()
+        if len(sims) == 0:
+            return 0
+        results = np.concatenate([sims["r7"], sims["r8"]], axis=1)
+        return len(np.unique(results, axis=0))
+
+    def to_wide_tsv(self, filename, meta=True):
+        """
+        Write the old wide format: a row per (team, round), a column per
+        simulation, plus loss/samples/success rows if meta is True
+        (zero_file.txt never had those)
+        """
+        sims = self.read()
+        header = [""] + [f"sim_{i + 1}" for i in range(len(sims))]
+        temp_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(temp_filename, "w") as f:
+            f.write("\t".join(header) + "\n")
+            for i, name in enumerate(self.names):
+                for round in [7, 8]:
+                    values = sims[f"r{round}"][:, i]
+                    f.write("\t".join([f"{name}_r{round}"]
+                                      + [str(v) for v in values]) + "\n")
+            if meta:
+                for row, values in [("loss", sims["loss"]),
+                                    ("samples", sims["samples"]),
+                                    ("success", sims["success"])]:
+                    f.write("\t".join([row] + [str(v) for v in values])
+                            + "\n")
+        os.replace(temp_filename, filename)
+
+    def import_wide_tsv(self, filename):
+        """
+        Append every simulation in an old wide file to the store
+        """
+        import pandas as pd
+        wide = pd.read_csv(filename, sep="\t", index_col=0)
+        r7_rows = [f"{name}_r7" for name in self.names]
+        r8_rows = [f"{name}_r8" for name in self.names]
+        has_meta = "loss" in wide.index
+        for column in wide.columns:
+            loss = int(wide.loc["loss", column]) if has_meta else 0
+            samples = int(wide.loc["samples", column]) if has_meta else 0
+            self.append(wide.loc[r7_rows, column].values,
+                        wide.loc[r8_rows, column].values, loss, samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a simulation store to or from the wide format")
+    parser.add_argument("base", help="store name, e.g. expire_file")
+    parser.add_argument("tsv", help="wide tab-separated file")
+    parser.add_argument("--import", dest="import_tsv", action="store_true",
+                        help="append the wide file to the store instead")
+    parser.add_argument("--no-meta", action="store_true",
+                        help="leave out loss/samples/success rows")
+    args = parser.parse_args()
+    if args.import_tsv:
+        import pandas as pd
+        names = [index[:-3] for index in pd.read_csv(
+            args.tsv, sep="\t", index_col=0).index
+            if index.endswith("_r7")]
+        SimStore(args.base, names).import_wide_tsv(args.tsv)
+    else:
+        SimStore(args.base).to_wide_tsv(args.tsv, meta=not args.no_meta)
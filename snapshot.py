@@ -0,0 +1,85 @@
+import argparse
+import csv
+import os
+import numpy as np
+
+snapshot_name = "snapshot.npz"
+source_names = ["standings.txt", "r7_draw.txt", "r8_draw.txt",
+                "r9_draw.txt"]
+
+
+def _read_rows(filename):
+    """
+    Rows of a tab-separated file, header first, blank lines skipped
+    """
+    with open(filename, newline="") as f:
+        return [row for row in csv.reader(f, delimiter="\t") if row]
+
+
+def compile_snapshot(directory):
+    """
+    Turns a data/{year} directory into {directory}/snapshot.npz:
+    names: team names in standings order (so team index i is names[i])
+    points: post-r6 points per team index
+    r7, r8, r9: one row of four team indices per room
+    A round whose draw file is missing gets no rooms
+    Returns the snapshot filename
+    """
+    header, *rows = _read_rows(f"{directory}/standings.txt")
+    team_col, points_col = header.index("team"), header.index("points")
+    names = [row[team_col] for row in rows]
+    points = np.array([int(float(row[points_col])) for row in rows],
+                      dtype=np.int64)
+    index = {name: i for i, name in enumerate(names)}
+
+    rooms = {}
+    for round_num in [7, 8, 9]:
+        filename = f"{directory}/r{round_num}_draw.txt"
+        if not os.path.exists(filename):
+            rooms[f"r{round_num}"] = np.zeros((0, 4), dtype=np.int64)
+            continue
+        _, *rows = _read_rows(filename)
+        rooms[f"r{round_num}"] = np.array(
+            [[index[name] for name in row] for row in rows],
+            dtype=np.int64).reshape(-1, 4)
+
+    filename = f"{directory}/{snapshot_name}"
+    temp_filename = f"{filename}.{os.getpid()}.tmp.npz"
+    np.savez(temp_filename, names=np.array(names), points=points, **rooms)
+    os.replace(temp_filename, filename)
+    return filename
+
+
+def is_stale(directory):
+    """
+    True if there is no snapshot, or a source file has changed since
+    """
+    filename = f"{directory}/{snapshot_name}"
+    if not os.path.exists(filename):
+        return True
+    built = os.path.getmtime(filename)
+    return any(os.path.getmtime(f"{directory}/{name}") > built
+               for name in source_names
+               if os.path.exists(f"{directory}/{name}"))
+
+
+def load_snapshot(directory):
+    """
+    Returns a dict of names (list), points and r7/r8/r9 room arrays,
+    compiling the snapshot first if it is missing or out of date
+    """
+    if is_stale(directory):
+        compile_snapshot(directory)
+    with np.load(f"{directory}/{snapshot_name}") as data:
+        snapshot = {key: data[key] for key in data.files}
+    snapshot["names"] = snapshot["names"].tolist()
+    return snapshot
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compile data directories into binary snapshots")
+    parser.add_argument("directories", nargs="+", help="e.g. data/2025")
+    args = parser.parse_args()
+    for directory in args.directories:
+        print(compile_snapshot(directory))
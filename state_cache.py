@@ -0,0 +1,60 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+# CONFIG
+cache_size = 100000 # states remembered per process, least recent dropped
+
+
+def fingerprint(*ests):
+    """
+    Compact (8 byte) hash of one or more result arrays, e.g. r7_est, or
+    r7_est and r8_est together
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for est in ests:
+        digest.update(np.asarray(est, dtype=np.int8).tobytes())
+    return digest.digest()
+
+
+class StateCache:
+    """
+    Bounded memory of states the search has been through, with where they
+    led: either a solution (whatever the round script wants to keep, e.g.
+    a copy of r7_est) or a dead end (None)
+    Evicts the least recently used state once there are max_size of them
+    """
+    def __init__(self, max_size=cache_size):
+        self.max_size = max_size
+        self.states = OrderedDict()
+        self.solution_hits = 0
+        self.dead_end_hits = 0
+
+    def __len__(self):
+        return len(self.states)
+
+    def lookup(self, key):
+        """
+        Returns (seen, solution): seen is False for a new state, and
+        solution is None for a known dead end
+        """
+        if key not in self.states:
+            return False, None
+        self.states.move_to_end(key)
+        solution = self.states[key]
+        if solution is None:
+            self.dead_end_hits += 1
+        else:
+            self.solution_hits += 1
+        return True, solution
+
+    def record(self, path, solution=None):
+        """
+        Remember that every state in path led to solution (None for a
+        dead end)
+        """
+        for key in path:
+            self.states[key] = solution
+            self.states.move_to_end(key)
+        while len(self.states) > self.max_size:
+            self.states.popitem(last=False)
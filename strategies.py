@@ -0,0 +1,176 @@
+import random
+import time
+import numpy as np
+
+# CONFIG (defaults, each can be passed to make_strategy instead)
+start_temperature = 2.0 # annealing temperature on the first sweep
+end_temperature = 0.05 # never cooled below this
+cooling = 0.85 # geometric: each sweep multiplies the temperature by this
+tabu_tenure = 3 # sweeps an abandoned order stays forbidden
+
+
+class RestartStats:
+    """
+    What happened on each restart: outcome, sweeps taken and CPU time
+    Enough to say which strategy gives the most accepted samples per
+    CPU-second on a given year
+    """
+    def __init__(self):
+        self.outcomes = []
+        self.sweeps = []
+        self.seconds = []
+
+    def record(self, outcome, sweeps, seconds):
+        self.outcomes.append(outcome)
+        self.sweeps.append(sweeps)
+        self.seconds.append(seconds)
+
+    def summary(self, success):
+        """
+        success (str): the outcome that counts as zero loss,
+            "ACHIEVED" for round 7 and "ZERO" for round 8
+        Returns a dict of restarts, zero-loss restarts, sweeps to zero
+        loss (mean, median, max), CPU seconds and zeros per CPU-second
+        """
+        sweeps = [s for o, s in zip(self.outcomes, self.sweeps)
+                  if o == success]
+        cpu_seconds = sum(self.seconds)
+        return {
+            "restarts": len(self.outcomes),
+            "zeros": len(sweeps),
+            "zero_rate": len(sweeps) / len(self.outcomes)
+                         if self.outcomes else 0.0,
+            "mean_sweeps_to_zero": float(np.mean(sweeps)) if sweeps else None,
+            "median_sweeps_to_zero": float(np.median(sweeps))
+                                     if sweeps else None,
+            "max_sweeps_to_zero": max(sweeps) if sweeps else None,
+            "cpu_seconds": cpu_seconds,
+            "zeros_per_cpu_second": len(sweeps) / cpu_seconds
+                                    if cpu_seconds else 0.0,
+        }
+
+
+class Descent:
+    """
+    The original search: every room takes its best order, ties broken at
+    random
+    A strategy is told when a restart starts, when each sweep over the
+    rooms starts, and when the restart finishes; in between, choose is
+    called once per room with the change in loss of each candidate order
+    """
+    name = "descent"
+
+    def __init__(self):
+        self.stats = RestartStats()
+        self.sweep = 0
+        self._clock = None
+
+    def start(self):
+        self.sweep = 0
+        self._clock = time.process_time()
+
+    def start_sweep(self, sweep):
+        self.sweep = sweep
+
+    def choose(self, key, scores, current=None):
+        """
+        key (tuple): the room's team ids, the same on every sweep
+        scores (array): change in loss for each candidate order
+        current (int): index of the room's current order among the
+            candidates, or None if it isn't one of them
+        Returns the index of the order to take
+        """
+        return random.choice(np.flatnonzero(scores == scores.min()))
+
+    def finish(self, outcome, sweeps):
+        self.stats.record(outcome, sweeps,
+                          time.process_time() - self._clock)
+
+
+class Annealing(Descent):
+    """
+    Simulated annealing, by heat-bath moves: each room picks an order at
+    random, worse orders being exponentially less likely the colder it
+    is, so early sweeps can climb out of local minima
+    Temperature falls from start_temperature to end_temperature, either
+    geometrically (times cooling each sweep) or linearly over num_sweeps
+    """
+    name = "annealing"
+
+    def __init__(self, start_temperature=start_temperature,
+                 end_temperature=end_temperature, cooling=cooling,
+                 schedule="geometric", num_sweeps=None):
+        super().__init__()
+        if schedule not in ("geometric", "linear"):
+            raise ValueError(f"unknown schedule {schedule}")
+        if schedule == "linear" and not num_sweeps:
+            raise ValueError("a linear schedule needs num_sweeps")
+        self.start_temperature = start_temperature
+        self.end_temperature = end_temperature
+        self.cooling = cooling
+        self.schedule = schedule
+        self.num_sweeps = num_sweeps
+
+    def temperature(self):
+        if self.schedule == "geometric":
+            temperature = self.start_temperature * self.cooling ** self.sweep
+        else:
+            fraction = min(1.0, self.sweep / max(1, self.num_sweeps - 1))
+            temperature = self.start_temperature + fraction * (
+                self.end_temperature - self.start_temperature)
+        return max(temperature, self.end_temperature)
+
+    def choose(self, key, scores, current=None):
+        weights = np.exp(-(scores - scores.min()) / self.temperature())
+        return random.choices(range(len(scores)), weights=weights)[0]
+
+
+class Tabu(Descent):
+    """
+    Tabu search: like descent, but when a room leaves an order, going back
+    to it is forbidden for tabu_tenure sweeps, so the search can't just
+    cycle between the same few states
+    A forbidden order is still allowed if it scores strictly lower than
+    the room's current order
+    """
+    name = "tabu"
+
+    def __init__(self, tenure=tabu_tenure):
+        super().__init__()
+        self.tenure = tenure
+        self.tabu = {} # (key, order index): last sweep it is forbidden
+
+    def start(self):
+        super().start()
+        self.tabu = {}
+
+    def choose(self, key, scores, current=None):
+        # Scores needn't be deltas (r7 rooms in round 8 include the
+        # collision loss), so aspiration is against the current order's
+        aspiration = -np.inf if current is None else scores[current]
+        allowed = np.array([
+            self.tabu.get((key, i), -1) < self.sweep
+            or scores[i] < aspiration
+            for i in range(len(scores))])
+        if not allowed.any():
+            allowed[:] = True
+        allowed_scores = np.where(allowed, scores, np.inf)
+        best = random.choice(
+            np.flatnonzero(allowed_scores == allowed_scores.min()))
+        if current is not None and best != current:
+            self.tabu[(key, current)] = self.sweep + self.tenure
+        return best
+
+
+strategies = {cls.name: cls for cls in [Descent, Annealing, Tabu]}
+
+
+def make_strategy(name="descent", **kwargs):
+    """
+    name (str): "descent", "annealing" or "tabu"
+    kwargs: settings for that strategy, e.g. cooling=0.9
+    """
+    if name not in strategies:
+        raise ValueError(f"unknown strategy {name}, "
+                         f"pick from {', '.join(strategies)}")
+    return strategies[name](**kwargs)
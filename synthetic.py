@@ -0,0 +1,132 @@
+import argparse
+import csv
+import os
+import numpy as np
+from loss_engine import num_brackets
+from snapshot import _read_rows
+
+# CONFIG (each can be overridden on the command line)
+num_teams = 600
+num_prelims = 6 # rounds played before the standings
+skill_spread = 1.0 # spread of hidden team strength, 0 for coin-flip rooms
+seed = 0
+truth_name = "truth.txt" # the hidden r7 and r8 results, kept alongside
+
+
+def pair_round(points, rng):
+    """
+    BP power-pairing: teams ranked by points (ties broken at random) and
+    put into rooms of four in rank order, so the only teams debating above
+    their bracket are the pullups at the bottom of a room, at most three
+    from any bracket
+    The lowest-ranked teams sit out if the count isn't a multiple of four
+    Positions (og, oo, cg, co) are random
+    Returns one row of four team indices per room, top room first
+    """
+    ranked = np.lexsort((rng.random(len(points)), -points))
+    rooms = ranked[:len(ranked) // 4 * 4].reshape(-1, 4)
+    return rng.permuted(rooms, axis=1)
+
+
+def play_round(rooms, skill, rng):
+    """
+    Each room ranks its teams by skill plus Gumbel noise (the
+    Plackett-Luce model): first gets 3, then 2, 1 and 0
+    Returns the points each team index gained (0 for teams sitting out)
+    """
+    gained = np.zeros(len(skill), dtype=np.int64)
+    performance = skill[rooms] + rng.gumbel(size=rooms.shape)
+    places = performance.argsort(axis=1).argsort(axis=1)
+    gained[rooms] = places
+    return gained
+
+
+def generate(num_teams, num_prelims=num_prelims, skill_spread=skill_spread,
+             seed=seed):
+    """
+    Simulates a tournament up to the r9 draw
+    Returns a dict of names, points (after the prelims), r7, r8 and r9
+    rooms (four team indices each), and the true r7 and r8 points gained
+    Raises ValueError if a team winning every room (prelims, r7 and r8)
+    would have more points than loss_engine's num_brackets allows
+    """
+    if 3 * (num_prelims + 2) >= num_brackets:
+        raise ValueError(f"{num_prelims} prelims can take a team to "
+                         f"{3 * (num_prelims + 2)} points by the r9 draw, "
+                         f"past the top bracket ({num_brackets - 1}); use "
+                         f"at most {(num_brackets - 1) // 3 - 2}")
+    rng = np.random.default_rng(seed)
+    skill = rng.normal(scale=skill_spread, size=num_teams)
+    points = np.zeros(num_teams, dtype=np.int64)
+    for _ in range(num_prelims):
+        points += play_round(pair_round(points, rng), skill, rng)
+    tournament = {"names": [f"Team_{i:04d}" for i in range(num_teams)],
+                  "points": points.copy()}
+    for round_num in [7, 8, 9]:
+        rooms = pair_round(points, rng)
+        tournament[f"r{round_num}"] = rooms
+        if round_num < 9:
+            gained = play_round(rooms, skill, rng)
+            tournament[f"r{round_num}_truth"] = gained
+            points += gained
+    return tournament
+
+
+def write_tournament(directory, tournament):
+    """
+    Writes standings.txt and the three draws in the data/{year} format,
+    and the true results to truth.txt (team, r7, r8)
+    """
+    os.makedirs(directory, exist_ok=True)
+    names = tournament["names"]
+    order = np.argsort(-tournament["points"], kind="stable")
+
+    def write(filename, header, rows):
+        with open(f"{directory}/{filename}", "w", newline="") as f:
+            writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    write("standings.txt", ["team", "points"],
+          [[names[i], int(tournament["points"][i])] for i in order])
+    for round_num in [7, 8, 9]:
+        write(f"r{round_num}_draw.txt", ["og", "oo", "cg", "co"],
+              [[names[i] for i in room]
+               for room in tournament[f"r{round_num}"]])
+    write(truth_name, ["team", "r7", "r8"],
+          [[names[i], int(tournament["r7_truth"][i]),
+            int(tournament["r8_truth"][i])] for i in order])
+
+
+def load_truth(directory, names):
+    """
+    The true results of a generated tournament, or None if it has none
+    names (list): team names in index order (e.g. from the snapshot)
+    Returns a dict with r7 and r8: points gained per team index
+    """
+    filename = f"{directory}/{truth_name}"
+    if not os.path.exists(filename):
+        return None
+    header, *rows = _read_rows(filename)
+    index = {name: i for i, name in enumerate(names)}
+    truth = {}
+    for round_name in ["r7", "r8"]:
+        col = header.index(round_name)
+        truth[round_name] = np.zeros(len(names), dtype=np.int64)
+        for row in rows:
+            truth[round_name][index[row[0]]] = int(row[col])
+    return truth
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a power-paired tournament with known results")
+    parser.add_argument("directory", help="e.g. data/synthetic_600")
+    parser.add_argument("--teams", type=int, default=num_teams)
+    parser.add_argument("--prelims", type=int, default=num_prelims)
+    parser.add_argument("--skill-spread", type=float, default=skill_spread)
+    parser.add_argument("--seed", type=int, default=seed)
+    args = parser.parse_args()
+    write_tournament(args.directory, generate(
+        args.teams, args.prelims, args.skill_spread, args.seed))
+    print(f"Written to {args.directory}")
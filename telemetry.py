@@ -0,0 +1,115 @@
+import json
+import os
+import time
+from collections import defaultdict
+
+
+class _Timer:
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        telemetry = self.telemetry
+        telemetry.seconds[self.name] += time.perf_counter() - self.start
+        telemetry.calls[self.name] += 1
+
+
+class _NullTimer:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+class Telemetry:
+    """
+    Counters and per-phase timers, written as JSON lines every interval
+    seconds, so several processes can share one metrics file and it can
+    be read with any JSON tool rather than by scraping the console
+    Off until configure is given a filename, and then timers and counters
+    do nothing at all, so leaving the calls in costs next to nothing
+    Phases can nest (a timer inside another counts in both), so timer
+    seconds don't add up to the wall time
+    """
+    def __init__(self):
+        self.filename = None
+        self.interval = 10.0
+        self.label = None
+        self.enabled = False
+        self.reset()
+
+    def configure(self, filename=None, interval=10.0, label=None):
+        """
+        filename (str): JSONL file to append to, None to switch off
+        interval (float): seconds between lines
+        label (str): written on every line, e.g. "round 7 worker 3"
+        """
+        self.filename = filename
+        self.interval = interval
+        self.label = label
+        self.enabled = filename is not None
+        self.reset()
+
+    def reset(self):
+        self.counters = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.started = time.time()
+        self.last_write = self.started
+
+    def timer(self, name):
+        """
+        Use as "with metrics.timer(name):" around a phase
+        """
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def snapshot(self):
+        """
+        Totals since configure, as a dict
+        """
+        now = time.time()
+        return {
+            "time": now,
+            "elapsed": now - self.started,
+            "pid": os.getpid(),
+            "label": self.label,
+            "counters": dict(self.counters),
+            "timers": {name: {"calls": self.calls[name],
+                              "seconds": self.seconds[name]}
+                       for name in self.seconds},
+        }
+
+    def tick(self):
+        """
+        Write a line if interval seconds have passed since the last one
+        """
+        if self.enabled and time.time() - self.last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        """
+        Append the current totals as one JSON line
+        """
+        if not self.enabled:
+            return
+        line = json.dumps(self.snapshot()) + "\n"
+        with open(self.filename, "a") as f:
+            f.write(line)
+        self.last_write = time.time()
+
+
+metrics = Telemetry() # shared by everything in the process
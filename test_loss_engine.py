@@ -0,0 +1,121 @@
+import os
+import random
+import numpy as np
+import round_8_backtab as r8_backtab
+from loss_engine import DrawState, DrawStates, orders
+
+# CONFIG
+year = 2025 # a bundled year, see data/
+num_moves = 300
+num_chains = 3
+
+
+def load(year=year):
+    """
+    The rooms and both draws of a bundled year, with random r7 and r8
+    results to start from
+    """
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "data", str(year))
+    teams, r7_rooms, r8_rooms, _, known, r8_loss, r9_loss = (
+        r8_backtab.initialise(directory))
+    rng = np.random.default_rng(year)
+    r7_est = rng.integers(4, size=len(teams))
+    r8_est = rng.integers(4, size=len(teams))
+    return known, r7_rooms, r8_rooms, r8_loss, r9_loss, r7_est, r8_est
+
+
+def test_running_totals_match_a_rescan():
+    """
+    Random room reorderings, scored by batch_delta and applied by move,
+    on both draws: every delta and every running loss must agree with
+    DrawLoss.loss worked out from scratch
+    """
+    random.seed(0)
+    known, r7_rooms, r8_rooms, r8_loss, r9_loss, r7_est, r8_est = load()
+    r8_state = DrawState(r8_loss, known + r7_est)
+    r9_state = DrawState(r9_loss, known + r7_est + r8_est)
+    assert r8_state.loss() == r8_loss.loss(known + r7_est)
+    assert r9_state.loss() == r9_loss.loss(known + r7_est + r8_est)
+
+    for _ in range(num_moves):
+        r7_move = random.random() < 0.5
+        room = random.choice(r7_rooms if r7_move else r8_rooms)
+        ids = np.array(room.ids)
+        est = r7_est if r7_move else r8_est
+        # As the search does, r7 moves shift both draws, r8 moves only r9
+        draws = ([(r8_state, r8_loss, known), (r9_state, r9_loss,
+                                              known + r8_est)]
+                 if r7_move else [(r9_state, r9_loss, known + r7_est)])
+        for state, draw, base in draws:
+            points = base + est
+            oob_delta, pullup_delta = state.batch_delta(ids,
+                                                        base[ids] + orders)
+            oob_before, pullup_before = draw.loss(points)
+            for order, oob, pullup in zip(orders, oob_delta, pullup_delta):
+                moved = points.copy()
+                moved[ids] = base[ids] + order
+                oob_after, pullup_after = draw.loss(moved)
+                assert oob == oob_after - oob_before
+                assert pullup == pullup_after - pullup_before
+
+        est[ids] = orders[random.randrange(len(orders))]
+        for state, draw, base in draws:
+            state.move(ids, base[ids] + est[ids])
+            assert state.loss() == draw.loss(base + est)
+
+
+def test_chains_match_a_rescan():
+    """
+    The same with several chains at once, each on its own r7 results:
+    every chain's deltas and losses must be its own from-scratch ones
+    """
+    random.seed(1)
+    known, r7_rooms, _, r8_loss, _, _, _ = load()
+    rng = np.random.default_rng(1)
+    r7_est = rng.integers(4, size=(num_chains, len(known)))
+    states = DrawStates(r8_loss, known + r7_est)
+
+    for _ in range(num_moves // 3):
+        ids = np.array(random.choice(r7_rooms).ids)
+        oob_delta, pullup_delta = states.batch_delta(ids,
+                                                     known[ids] + orders)
+        for chain in range(num_chains):
+            points = known + r7_est[chain]
+            oob_before, pullup_before = r8_loss.loss(points)
+            for i, order in enumerate(orders):
+                moved = points.copy()
+                moved[ids] = known[ids] + order
+                oob_after, pullup_after = r8_loss.loss(moved)
+                assert oob_delta[chain, i] == oob_after - oob_before
+                assert pullup_delta[chain, i] == pullup_after - pullup_before
+
+        r7_est[:, ids] = orders[rng.integers(len(orders), size=num_chains)]
+        states.move(ids, known[ids] + r7_est[:, ids])
+        oob_loss, pullup_loss = states.loss()
+        for chain in range(num_chains):
+            assert (oob_loss[chain], pullup_loss[chain]) == r8_loss.loss(
+                known + r7_est[chain])
+
+
+def test_snapshot_restore_and_update():
+    """
+    restore puts back exactly the snapshot's totals, and update brings a
+    state from any points to any others
+    """
+    random.seed(2)
+    known, r7_rooms, _, r8_loss, _, r7_est, _ = load()
+    state = DrawState(r8_loss, known + r7_est)
+    saved = state.snapshot()
+    saved_loss = state.loss()
+    buffer = np.zeros_like(saved)
+    for _ in range(20):
+        ids = np.array(random.choice(r7_rooms).ids)
+        r7_est[ids] = orders[random.randrange(len(orders))]
+        state.move(ids, known[ids] + r7_est[ids])
+    assert state.snapshot(buffer) is buffer
+    state.restore(saved)
+    assert state.loss() == saved_loss
+    state.update(known + r7_est)
+    assert (state.snapshot() == buffer).all()
+    assert state.loss() == r8_loss.loss(known + r7_est)